@@ -13,4 +13,33 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'GatituProject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Long-lived endpoints are plain ASGI apps that bypass Django's request
+# cycle; everything else goes through Django as usual.
+from django.conf import settings  # noqa: E402
+from public_site import media, streams  # noqa: E402  (needs Django set up first)
+
+STREAM_ROUTES = {
+    '/notifications/stream/': streams.notification_stream,
+}
+
+WEBSOCKET_ROUTES = {
+    '/community/ws/': streams.chat_socket,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        handler = STREAM_ROUTES.get(scope['path'])
+        if handler is not None:
+            return await handler(scope, receive, send)
+        if scope['path'].startswith(settings.MEDIA_URL):
+            return await media.asgi_serve(scope, receive, send)
+    elif scope['type'] == 'websocket':
+        handler = WEBSOCKET_ROUTES.get(scope['path'])
+        if handler is None:
+            await receive()
+            return await send({'type': 'websocket.close'})
+        return await handler(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -69,14 +69,20 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'django.contrib.staticfiles',
+    # Ahead of staticfiles so its collectstatic, which builds the base.html
+    # bundles first, is the one manage.py runs
     'public_site',
+    'django.contrib.staticfiles',
     'users',
+    'jobs',
 ]
 
 MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'public_site.middleware.AnonymousPageCacheMiddleware',
+    'public_site.middleware.CompressionMiddleware',
+    'public_site.middleware.HTMLMinifyMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -100,6 +106,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'public_site.context_processors.notification_bell',
             ],
         },
     },
@@ -162,9 +169,37 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # Fingerprinted names, served with immutable caching and with gzip and
+    # (when the Brotli package is installed) Brotli copies written at build time
+    'staticfiles': {
+        'BACKEND': 'public_site.bundles.StaticFilesStorage',
+    },
+}
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Widths (px) of the WebP/JPEG copies written for each gallery photo
+PHOTO_DERIVATIVE_WIDTHS = (320, 640, 1280)
+# Sizes (px) of the square WebP copies kept of each member's avatar
+AVATAR_SIZES = (32, 96, 256)
+
+# How uploaded files are sent (public_site/media.py): 'direct' from the app
+# (read in chunks under the Procfile's uvicorn workers), or handed to a
+# fronting server with 'x-accel-redirect' (nginx, internal location at
+# MEDIA_ACCEL_PREFIX) or 'x-sendfile' (Apache/lighttpd)
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'direct')
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Files renamed whenever their content changes, cached by browsers for a year
+MEDIA_IMMUTABLE_PATTERNS = [
+    r'/derivatives/',
+    r'^gallery/imported/',
+    r'^avatars/[0-9a-f]{16}-\d+\.webp$',
+]
+# Cache lifetime (seconds) for every other uploaded file
+MEDIA_CACHE_SECONDS = 3600
 LOGIN_URL = '/users/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -203,6 +238,91 @@ else:
 # Password reset settings
 PASSWORD_RESET_TIMEOUT = 86400  # 24 hours in seconds
 
+# Notifications: 'fanout' writes one row per member, 'broadcast' one row per event
+NOTIFICATION_DELIVERY = os.environ.get('NOTIFICATION_DELIVERY', 'fanout')
+NOTIFICATION_FAN_OUT_BATCH_SIZE = 500
+# Seconds to cache each member's header bell; 0 turns the cache off
+NOTIFICATION_BELL_CACHE_TTL = 15
+
+# With several web processes, point REDIS_URL at a Redis server (needs the
+# `redis` package) so they share one cache. Otherwise each process keeps its
+# own in-memory cache, and a change made in one process reaches the others'
+# cached page fragments only when those expire.
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+# Upper bound in seconds on how long a cached page section lives
+# (public_site/fragments.py); saves normally expire it straight away
+FRAGMENT_CACHE_TIMEOUT = 300
+
+# Whole public pages for visitors without a session (public_site/middleware.py).
+# Entries are fresh for PAGE_CACHE_TTL seconds or until a model they show is
+# saved; stale ones are kept PAGE_CACHE_STALE_TTL longer and served while a
+# single request re-renders them. 0 turns the page cache off.
+PAGE_CACHE_TTL = 300
+PAGE_CACHE_STALE_TTL = 86400
+PAGE_CACHE_LOCK_TIMEOUT = 30
+
+# Dynamic responses (public_site/compression.py). Brotli's quality 5 and
+# gzip's level 6 keep a page's compression under a millisecond of CPU;
+# `manage.py bench_compression` shows the trade-off at other settings.
+COMPRESSION_MIN_SIZE = 500
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_GZIP_LEVEL = 6
+
+# Live notifications and chat (public_site/realtime.py). The default backend
+# polls the notifications and chat tables, so it works across worker
+# processes with no extra services; RelayBackend gives instant delivery
+# across processes via `manage.py run_relay`; LocalBackend only reaches
+# clients on the same process.
+REALTIME_BACKEND = os.environ.get('REALTIME_BACKEND', 'public_site.realtime.DatabasePollingBackend')
+REALTIME_POLL_INTERVAL = 2.0
+# Seconds of rows each poll re-reads, so ones committed out of id order still arrive
+REALTIME_POLL_LOOKBACK = 30.0
+REALTIME_RELAY_URL = os.environ.get('REALTIME_RELAY_URL', 'tcp://127.0.0.1:8765')
+
+# Blog posts per page, and the latest comments shown under each (public_site/blog.py)
+BLOG_PAGE_SIZE = 10
+BLOG_INLINE_COMMENTS = 3
+BLOG_COMMENTS_PAGE_SIZE = 50
+
+# Gallery tiles per page, server-rendered and per scroll fetch (public_site/gallery.py)
+GALLERY_PAGE_SIZE = 24
+GALLERY_MAX_PAGE_SIZE = 100
+
+# Community chat messages per page (public_site/chat.py)
+CHAT_PAGE_SIZE = 50
+CHAT_MAX_PAGE_SIZE = 100
+# Buffer chat posts in memory and save them in bulk (public_site/chat_buffer.py).
+# Faster under bursts, but a crashed process loses what it hadn't flushed yet.
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', 'false').lower() == 'true'
+CHAT_BUFFER_SIZE = 5000
+CHAT_FLUSH_BATCH_SIZE = 200
+CHAT_FLUSH_INTERVAL = 0.05
+
+# Site search ranks only this many of the newest matches of each kind
+# (public_site/search.py), which keeps a common word about as fast as a rare one
+SEARCH_CANDIDATES = 1000
+
+# Retention periods in days for `manage.py prune`, keyed by policy name
+# (see public_site/retention.py for the policies and their defaults)
+RETENTION_DAYS = {}
+
+# `manage.py check_query_plans` fails on full scans of tables bigger than this
+QUERY_PLAN_MAX_SCAN_ROWS = 1000
+
+# Background jobs (see jobs/queue.py); run them with `manage.py run_worker`.
+# JOBS_RUN_EAGERLY runs handlers inline, for local development without a worker.
+JOBS_RUN_EAGERLY = os.environ.get('JOBS_RUN_EAGERLY', 'false').lower() == 'true'
+JOBS_WORKER_CONCURRENCY = int(os.environ.get('JOBS_WORKER_CONCURRENCY', 4))
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BASE_SECONDS = 10
+
 # Site URL for password reset links
 if DEBUG:
     SITE_URL = 'http://localhost:8000'
@@ -15,17 +15,21 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from public_site import media
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('public_site.urls')),
     path('users/', include('users.urls')),
+    path('jobs/', include('jobs.urls')),
+    # Under ASGI, asgi.py answers these before Django; see public_site/media.py
+    re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), media.serve, name='media'),
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -0,0 +1,19 @@
+from django.contrib import admin
+from .models import Job
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_at', 'created_at', 'finished_at']
+    list_filter = ['status', 'name', 'created_at']
+    search_fields = ['name', 'last_error']
+    readonly_fields = ['created_at', 'started_at', 'heartbeat_at', 'finished_at', 'locked_by', 'last_error']
+    # Payloads are the handlers' business, not something to browse
+    exclude = ['payload']
+    date_hierarchy = 'created_at'
+    actions = ['retry_jobs']
+
+    def retry_jobs(self, request, queryset):
+        from django.utils import timezone
+        updated = queryset.exclude(status=Job.RUNNING).update(status=Job.QUEUED, run_at=timezone.now(), attempts=0)
+        self.message_user(request, f'{updated} jobs were queued again.')
+    retry_jobs.short_description = "Retry selected jobs"
@@ -0,0 +1,124 @@
+import json
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from jobs import queue
+
+logger = logging.getLogger('jobs.worker')
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs in a thread pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int,
+            default=getattr(settings, 'JOBS_WORKER_CONCURRENCY', 4),
+            help='Number of jobs to run at the same time',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float,
+            default=getattr(settings, 'JOBS_POLL_INTERVAL', 1.0),
+            help='Seconds to wait between polls when the queue is empty',
+        )
+        parser.add_argument(
+            '--stale-after', type=int, default=120,
+            help=(
+                'Requeue (or fail, once out of attempts) running jobs whose worker has sent no '
+                'heartbeat for this many seconds'
+            ),
+        )
+        parser.add_argument(
+            '--metrics-every', type=int, default=60,
+            help='Log queue metrics every N seconds (0 to disable)',
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once no jobs are due instead of waiting for more',
+        )
+        parser.add_argument(
+            '--metrics', action='store_true',
+            help='Print queue depth and latency metrics as JSON and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['metrics']:
+            self.stdout.write(json.dumps(queue.metrics(), indent=2))
+            return
+
+        self.stopping = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.request_stop)
+
+        worker = queue.worker_id()
+        concurrency = max(options['concurrency'], 1)
+        stale_after = timedelta(seconds=options['stale_after'])
+        self.stdout.write(f'Worker {worker} started with {concurrency} threads')
+
+        # Future -> id of the job it runs
+        in_flight = {}
+        last_metrics = time.monotonic()
+        self.last_heartbeat = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job') as pool:
+            while not self.stopping.is_set():
+                self.heartbeat(worker, in_flight, stale_after)
+                requeued, failed = queue.requeue_stale(stale_after)
+                if requeued or failed:
+                    self.stdout.write(f'Requeued {requeued} and failed {failed} jobs whose worker was lost')
+
+                for claimed in queue.claim(worker, concurrency - len(in_flight)):
+                    in_flight[pool.submit(self.run_job, claimed)] = claimed.pk
+
+                if options['metrics_every'] and time.monotonic() - last_metrics >= options['metrics_every']:
+                    self.stdout.write(json.dumps(queue.metrics()))
+                    last_metrics = time.monotonic()
+
+                if not in_flight:
+                    if options['burst']:
+                        break
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+
+                done, _ = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    del in_flight[future]
+
+            # Keep beating while running jobs finish, or another worker takes them over
+            while in_flight:
+                self.heartbeat(worker, in_flight, stale_after)
+                done, _ = wait(in_flight, timeout=options['poll_interval'])
+                for future in done:
+                    del in_flight[future]
+        connection.close()
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker} stopped'))
+
+    def heartbeat(self, worker, in_flight, stale_after):
+        # Several beats per stale period, so a long job is never taken for a lost one
+        if in_flight and time.monotonic() - self.last_heartbeat >= stale_after.total_seconds() / 4:
+            queue.heartbeat(worker, in_flight.values())
+            self.last_heartbeat = time.monotonic()
+
+    def run_job(self, claimed):
+        close_old_connections()
+        try:
+            return queue.run(claimed)
+        except Exception:
+            # queue.run() records handler errors itself; this is the queue's
+            # own bookkeeping failing. The job stays RUNNING and is requeued
+            # once its heartbeats stop.
+            logger.exception("Could not record the outcome of %s", claimed)
+        finally:
+            # Each pool thread has its own connection; don't leak them
+            connection.close()
+
+    def request_stop(self, signum, frame):
+        self.stdout.write('Finishing running jobs before exiting...')
+        self.stopping.set()
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:36
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_heartbeats(apps, schema_editor):
+    # Jobs already running count from when they started
+    Job = apps.get_model('jobs', 'Job')
+    Job.objects.filter(status='running').update(heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_heartbeats, migrations.RunPython.noop),
+    ]
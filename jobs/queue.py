@@ -0,0 +1,208 @@
+"""
+A small job queue stored in the main database.
+
+Handlers are registered with ``@job('app.name')`` in an app's ``tasks.py``
+and enqueued with ``enqueue('app.name', **payload)``. ``manage.py run_worker``
+claims due jobs and runs them in a thread pool.
+"""
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+WORKER_LOST = 'Worker lost: it stopped sending heartbeats while running this job'
+
+_registry = {}
+
+
+def job(name, max_attempts=None):
+    """Register ``func`` as the handler for jobs called ``name``"""
+    def decorator(func):
+        if name in _registry:
+            raise ValueError(f"A job handler named {name!r} is already registered")
+        _registry[name] = func
+        func.job_name = name
+        func.delay = lambda **payload: enqueue(name, max_attempts=max_attempts, **payload)
+        return func
+    return decorator
+
+
+def get_handler(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f"No job handler registered for {name!r}") from None
+
+
+def enqueue(name, max_attempts=None, **payload):
+    """
+    Queue a job. The row is written in the caller's transaction, so workers
+    only see it once that transaction commits and it disappears with a
+    rollback - the same guarantee as ``on_commit`` without the window where a
+    crash after commit loses the job.
+
+    With ``JOBS_RUN_EAGERLY`` the handler runs inline instead, which is what
+    tests and local development without a worker want.
+    """
+    get_handler(name)  # fail fast on typos rather than in the worker
+    if getattr(settings, 'JOBS_RUN_EAGERLY', False):
+        get_handler(name)(**payload)
+        return None
+
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        max_attempts=max_attempts or getattr(settings, 'JOBS_MAX_ATTEMPTS', 5),
+    )
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claim(worker, limit):
+    """
+    Atomically move up to ``limit`` due jobs to RUNNING for ``worker``.
+
+    Postgres uses ``SELECT ... FOR UPDATE SKIP LOCKED`` so concurrent workers
+    never wait on each other. SQLite has no row locks; there the conditional
+    UPDATE on ``status`` is what stops two workers claiming the same job.
+    """
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        Job.objects.filter(pk__in=ids, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            locked_by=worker,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(pk__in=ids, status=Job.RUNNING, locked_by=worker))
+
+
+def backoff(attempts):
+    """Exponential backoff with jitter: ~10s, 20s, 40s ... capped at an hour"""
+    base = getattr(settings, 'JOBS_RETRY_BASE_SECONDS', 10)
+    delay = min(base * 2 ** max(attempts - 1, 0), 3600)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def run(claimed):
+    """Run a claimed job and record the outcome"""
+    try:
+        get_handler(claimed.name)(**claimed.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if claimed.attempts >= claimed.max_attempts:
+            logger.error("Job %s failed permanently:\n%s", claimed, error)
+            changes = {'status': Job.FAILED, 'finished_at': timezone.now()}
+        else:
+            run_at = timezone.now() + backoff(claimed.attempts)
+            logger.warning("Job %s failed, retrying at %s:\n%s", claimed, run_at, error)
+            changes = {'status': Job.QUEUED, 'run_at': run_at}
+        _record(claimed.pk, last_error=error, locked_by='', **changes)
+        return False
+
+    # A finished job's arguments are no longer needed, so don't keep them
+    _record(claimed.pk, status=Job.DONE, finished_at=timezone.now(), locked_by='', payload={})
+    return True
+
+
+def _record(pk, retries=5, **changes):
+    # SQLite allows one writer at a time; a busy database shouldn't turn a
+    # finished job into a stale one, so retry briefly before giving up.
+    for attempt in range(retries):
+        try:
+            return Job.objects.filter(pk=pk).update(**changes)
+        except OperationalError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(0.05 * 2 ** attempt)
+
+
+def heartbeat(worker, ids):
+    """Mark jobs ``worker`` is still running as alive, however long they take"""
+    return Job.objects.filter(pk__in=list(ids), status=Job.RUNNING, locked_by=worker).update(
+        heartbeat_at=timezone.now(),
+    )
+
+
+def requeue_stale(timeout):
+    """
+    Recover RUNNING jobs whose worker died: no heartbeat for ``timeout``.
+    Jobs with attempts left go back in the queue. The rest fail, or a job
+    that keeps killing its worker would be retried for ever. Returns the
+    number requeued and the number failed.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=now - timeout)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, locked_by='', finished_at=now, last_error=WORKER_LOST,
+    )
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(
+        status=Job.QUEUED, locked_by='', run_at=now,
+    )
+    if failed:
+        logger.error("%d jobs failed permanently after losing their worker", failed)
+    return requeued, failed
+
+
+def metrics(window=timedelta(hours=1), sample=1000):
+    """Queue depth per status and wait/run latency of recently finished jobs"""
+    now = timezone.now()
+    depth = {status: 0 for status, _ in Job.STATUS_CHOICES}
+    for row in Job.objects.order_by().values('status').annotate(total=Count('id')):
+        depth[row['status']] = row['total']
+
+    oldest_due = (
+        Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+        .order_by('run_at').values_list('run_at', flat=True).first()
+    )
+    finished = (
+        Job.objects.filter(status=Job.DONE, finished_at__gte=now - window)
+        .order_by('-finished_at')
+        .values_list('created_at', 'started_at', 'finished_at')[:sample]
+    )
+    waits = sorted((started - created).total_seconds() for created, started, _ in finished)
+    runs = sorted((done - started).total_seconds() for _, started, done in finished)
+
+    return {
+        'depth': depth,
+        'due': Job.objects.filter(status=Job.QUEUED, run_at__lte=now).count(),
+        'oldest_due_age': (now - oldest_due).total_seconds() if oldest_due else 0.0,
+        'finished_in_window': len(waits),
+        'wait_seconds': _summary(waits),
+        'run_seconds': _summary(runs),
+    }
+
+
+def _summary(values):
+    if not values:
+        return {'avg': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    return {
+        'avg': sum(values) / len(values),
+        'p50': values[len(values) // 2],
+        'p95': values[min(int(len(values) * 0.95), len(values) - 1)],
+        'max': values[-1],
+    }
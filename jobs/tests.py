@@ -0,0 +1,120 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import queue
+from .models import Job
+
+calls = []
+
+
+@queue.job('jobs.tests.record')
+def record(value):
+    calls.append(value)
+
+
+@queue.job('jobs.tests.explode')
+def explode():
+    raise RuntimeError('boom')
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        queued = queue.enqueue('jobs.tests.record', value=1)
+        self.assertEqual(queued.status, Job.QUEUED)
+
+        claimed = queue.claim('w1', 10)
+        self.assertEqual([j.pk for j in claimed], [queued.pk])
+        self.assertEqual(queue.claim('w2', 10), [])
+
+        self.assertTrue(queue.run(claimed[0]))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.DONE)
+        self.assertEqual(queued.attempts, 1)
+        self.assertEqual(calls, [1])
+
+    def test_unknown_job_is_rejected_at_enqueue(self):
+        with self.assertRaises(LookupError):
+            queue.enqueue('jobs.tests.missing')
+
+    def test_failed_job_backs_off_then_gives_up(self):
+        queued = queue.enqueue('jobs.tests.explode', max_attempts=2)
+
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            queue.run(queue.claim('w1', 1)[0])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.QUEUED)
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertIn('boom', queued.last_error)
+        self.assertEqual(queue.claim('w1', 1), [])
+
+        Job.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            queue.run(queue.claim('w1', 1)[0])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.FAILED)
+
+    def test_stale_jobs_are_requeued(self):
+        queue.enqueue('jobs.tests.record', value=1)
+        queue.claim('dead-worker', 1)
+        Job.objects.update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(queue.requeue_stale(timedelta(minutes=10)), (1, 0))
+        self.assertEqual(len(queue.claim('w1', 1)), 1)
+
+    def test_long_jobs_with_a_heartbeat_are_left_running(self):
+        queued = queue.enqueue('jobs.tests.record', value=1)
+        queue.claim('w1', 1)
+        Job.objects.update(started_at=timezone.now() - timedelta(hours=1), heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(queue.heartbeat('w1', [queued.pk]), 1)
+        self.assertEqual(queue.requeue_stale(timedelta(minutes=10)), (0, 0))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.RUNNING)
+
+    def test_job_that_keeps_losing_its_worker_fails(self):
+        queued = queue.enqueue('jobs.tests.record', value=1, max_attempts=2)
+        for attempt in range(2):
+            queue.claim('dead-worker', 1)
+            Job.objects.update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            if attempt == 0:
+                self.assertEqual(queue.requeue_stale(timedelta(minutes=10)), (1, 0))
+
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertEqual(queue.requeue_stale(timedelta(minutes=10)), (0, 1))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.locked_by), (Job.FAILED, 2, ''))
+        self.assertEqual(queued.last_error, queue.WORKER_LOST)
+        self.assertEqual(queue.claim('w1', 1), [])
+
+    def test_metrics(self):
+        queue.enqueue('jobs.tests.record', value=1)
+        queue.enqueue('jobs.tests.record', value=2)
+        queue.run(queue.claim('w1', 1)[0])
+
+        metrics = queue.metrics()
+        self.assertEqual(metrics['depth'][Job.QUEUED], 1)
+        self.assertEqual(metrics['depth'][Job.DONE], 1)
+        self.assertEqual(metrics['finished_in_window'], 1)
+
+    @override_settings(JOBS_RUN_EAGERLY=True)
+    def test_eager_mode_runs_inline(self):
+        self.assertIsNone(queue.enqueue('jobs.tests.record', value=3))
+        self.assertEqual(calls, [3])
+        self.assertFalse(Job.objects.exists())
+
+
+class RunWorkerTests(TransactionTestCase):
+    def test_burst_worker_drains_queue(self):
+        calls.clear()
+        for value in range(5):
+            queue.enqueue('jobs.tests.record', value=value)
+
+        call_command('run_worker', '--burst', '--concurrency', '2', '--metrics-every', '0', stdout=StringIO())
+
+        self.assertEqual(sorted(calls), list(range(5)))
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 5)
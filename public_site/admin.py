@@ -1,8 +1,27 @@
 from django.contrib import admin
-from .models import Announcement, Activity, BlogPost, Comment, ChatMessage, Photo, FinancialRecord, Notification
+from django.db import transaction
+from django.db.models import Count, Q
+from . import notifications, search
+from .models import Announcement, Activity, BlogPost, Comment, ChatMessage, Photo, FinancialRecord, FinancialRollup, Notification, NotificationReadState
+
+class FullTextSearchMixin:
+    """
+    Answer the admin search box from public_site.search's full-text index
+    instead of icontains scans over ``search_fields``.
+    """
+    # Still matched with icontains alongside the index, e.g. emails
+    search_also = []
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip() or not search.available():
+            return super().get_search_results(request, queryset, search_term)
+        condition = Q(pk__in=search.matching_ids(self.model, search_term))
+        for field in self.search_also:
+            condition |= Q(**{f'{field}__icontains': search_term})
+        return queryset.filter(condition), False
 
 @admin.register(Announcement)
-class AnnouncementAdmin(admin.ModelAdmin):
+class AnnouncementAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['title', 'author', 'date', 'is_active']
     list_filter = ['date', 'is_active']
     search_fields = ['title', 'content']
@@ -10,24 +29,25 @@ class AnnouncementAdmin(admin.ModelAdmin):
     date_hierarchy = 'date'
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['title', 'activity_type', 'date', 'created_at']
     list_filter = ['activity_type', 'date']
     search_fields = ['title', 'description']
     date_hierarchy = 'date'
 
 @admin.register(BlogPost)
-class BlogPostAdmin(admin.ModelAdmin):
-    list_display = ['title', 'author', 'date']
+class BlogPostAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    list_display = ['title', 'author', 'date', 'comment_count', 'last_commented_at']
     list_filter = ['date']
     search_fields = ['title', 'content']
     date_hierarchy = 'date'
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['author', 'post', 'date']
     list_filter = ['date']
     search_fields = ['content', 'author__email']
+    search_also = ['author__email']
     date_hierarchy = 'date'
 
 @admin.register(ChatMessage)
@@ -39,9 +59,9 @@ class ChatMessageAdmin(admin.ModelAdmin):
 
 @admin.register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
-    list_display = ['title', 'photo_type', 'upload_date']
+    list_display = ['title', 'photo_type', 'album', 'upload_date']
     list_filter = ['photo_type', 'upload_date']
-    search_fields = ['title', 'description']
+    search_fields = ['title', 'album', 'description']
     date_hierarchy = 'upload_date'
 
 @admin.register(FinancialRecord)
@@ -50,10 +70,70 @@ class FinancialRecordAdmin(admin.ModelAdmin):
     list_filter = ['record_date']
     date_hierarchy = 'record_date'
 
+@admin.register(FinancialRollup)
+class FinancialRollupAdmin(admin.ModelAdmin):
+    """Read-only: the rows follow FinancialRecord (reconcile_financial_rollups rebuilds them)"""
+    list_display = ['start', 'period', 'offering', 'donations', 'expenses', 'net', 'record_count']
+    list_filter = ['period']
+    date_hierarchy = 'start'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ['title', 'user', 'notification_type', 'is_read', 'created_at']
     list_filter = ['notification_type', 'is_read', 'created_at']
     search_fields = ['title', 'message', 'user__email']
     list_editable = ['is_read']
-    date_hierarchy = 'created_at'
\ No newline at end of file
+    date_hierarchy = 'created_at'
+
+    # Keep NotificationReadState.unread_count and the members' bells in step
+    # with edits made here, including the is_read toggle on the changelist
+    def save_model(self, request, obj, form, change):
+        affected = set()
+        with transaction.atomic():
+            before = None
+            if change:
+                before = Notification.objects.filter(pk=obj.pk).values('user_id', 'is_read').first()
+            super().save_model(request, obj, form, change)
+            if before and before['user_id'] and not before['is_read']:
+                notifications.adjust_unread_count(before['user_id'], -1)
+                affected.add(before['user_id'])
+            if obj.user_id and not obj.is_read:
+                notifications.adjust_unread_count(obj.user_id, 1)
+                affected.add(obj.user_id)
+        for user_id in affected:
+            notifications.forget_bell(user_id)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            if obj.user_id and not obj.is_read:
+                notifications.adjust_unread_count(obj.user_id, -1)
+        if obj.user_id and not obj.is_read:
+            notifications.forget_bell(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            unread = dict(
+                queryset.filter(user__isnull=False, is_read=False)
+                .order_by().values_list('user').annotate(total=Count('id'))
+            )
+            super().delete_queryset(request, queryset)
+            for user_id, total in unread.items():
+                notifications.adjust_unread_count(user_id, -total)
+        for user_id in unread:
+            notifications.forget_bell(user_id)
+
+@admin.register(NotificationReadState)
+class NotificationReadStateAdmin(admin.ModelAdmin):
+    list_display = ['user', 'unread_count', 'last_seen_at']
+    search_fields = ['user__email']
+    raw_id_fields = ['user']
\ No newline at end of file
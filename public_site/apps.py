@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PublicSiteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'public_site'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,134 @@
+"""
+Blog listing and comment threads with a fixed number of queries per page.
+
+Posts are paged newest first by keyset cursors over ``(date, id)``; each
+page loads its authors with a join and prefetches only the latest
+``BLOG_INLINE_COMMENTS`` comments per post. Longer threads are fetched
+through the comments API on demand.
+
+Each post stores its ``comment_count`` and ``last_commented_at``, updated
+in place by ``comment_added()``/``comment_removed()`` (wired to Comment's
+post_save/post_delete signals) so listings never aggregate over comments.
+``manage.py reconcile_comment_counts`` repairs any drift.
+"""
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Prefetch, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import BlogPost, Comment
+
+
+@dataclass
+class Page:
+    posts: list = field(default_factory=list)
+    # Older posts exist after this page
+    has_more: bool = False
+
+    @property
+    def next_cursor(self):
+        return self.posts[-1].pk if self.has_more else None
+
+
+def _limit(requested, setting, default, maximum):
+    try:
+        size = int(requested) if requested else getattr(settings, setting, default)
+    except (TypeError, ValueError):
+        size = getattr(settings, setting, default)
+    return max(1, min(size, maximum))
+
+
+def inline_comments():
+    return getattr(settings, 'BLOG_INLINE_COMMENTS', 3)
+
+
+def posts(before_id=None, limit=None):
+    """A page of posts, newest first, older than ``before_id`` if given"""
+    limit = _limit(limit, 'BLOG_PAGE_SIZE', 10, 50)
+    recent = Comment.objects.select_related('author').order_by('-date', '-id')[:inline_comments()]
+    queryset = (
+        BlogPost.objects.select_related('author')
+        .prefetch_related(Prefetch('comments', queryset=recent, to_attr='recent_comments'))
+        .order_by('-date', '-id')
+    )
+    if before_id is not None:
+        anchor = BlogPost.objects.filter(pk=before_id).values_list('date', 'pk').first()
+        if anchor is None:
+            return Page()
+        date, pk = anchor
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))
+
+    rows = list(queryset[:limit + 1])
+    for post in rows:
+        # Prefetched newest first; threads read oldest first
+        post.recent_comments.reverse()
+    return Page(rows[:limit], len(rows) > limit)
+
+
+def comments(post_id, after_id=None, limit=None):
+    """A post's comments, oldest first, after ``after_id`` if given"""
+    limit = _limit(limit, 'BLOG_COMMENTS_PAGE_SIZE', 50, 200)
+    queryset = Comment.objects.select_related('author').filter(post_id=post_id).order_by('date', 'id')
+    if after_id is not None:
+        anchor = Comment.objects.filter(pk=after_id, post_id=post_id).values_list('date', 'pk').first()
+        if anchor is None:
+            return [], False
+        date, pk = anchor
+        queryset = queryset.filter(Q(date__gt=date) | Q(date=date, pk__gt=pk))
+    rows = list(queryset[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.get_full_name(),
+        'content': comment.content,
+        'date': comment.date.isoformat(),
+    }
+
+
+def comment_added(comment):
+    """Count a new comment against its post, in one UPDATE"""
+    BlogPost.objects.filter(pk=comment.post_id).update(
+        comment_count=F('comment_count') + 1,
+        last_commented_at=Greatest(Coalesce('last_commented_at', Value(comment.date)), Value(comment.date)),
+    )
+
+
+def comment_removed(comment):
+    """Uncount a deleted comment, never going below zero, in one UPDATE"""
+    latest = (
+        Comment.objects.filter(post_id=OuterRef('pk'))
+        .order_by('-date').values('date')[:1]
+    )
+    BlogPost.objects.filter(pk=comment.post_id).update(
+        comment_count=Greatest(F('comment_count') - 1, 0),
+        last_commented_at=Subquery(latest),
+    )
+
+
+def rebuild_comment_counters(batch_size=500):
+    """
+    Recompute every post's comment count and latest comment time from the
+    comments table. Returns the number of posts that had drifted.
+    """
+    stats = {
+        post_id: (total, latest)
+        for post_id, total, latest in (
+            Comment.objects.order_by().values_list('post')
+            .annotate(total=Count('id'), latest=Max('date'))
+        )
+    }
+    with transaction.atomic():
+        drifted = []
+        stored = BlogPost.objects.select_for_update().only('pk', 'comment_count', 'last_commented_at')
+        for post in stored.iterator(chunk_size=batch_size):
+            expected = stats.get(post.pk, (0, None))
+            if (post.comment_count, post.last_commented_at) != expected:
+                post.comment_count, post.last_commented_at = expected
+                drifted.append(post)
+        BlogPost.objects.bulk_update(drifted, ['comment_count', 'last_commented_at'], batch_size=batch_size)
+    return len(drifted)
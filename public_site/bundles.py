@@ -0,0 +1,170 @@
+"""
+Static bundles for base.html.
+
+The site-wide CSS and JavaScript are kept in public_site/assets/ and
+``build()`` minifies them into static/bundles/, which is what templates
+use: ``critical.css`` (header, navigation, cover) is inlined into every
+page by ``{% inline_bundle %}`` so the first paint needs no request, and
+``site.css`` and ``site.js`` are ordinary static files. ``collectstatic``
+runs ``build_assets`` first (see management/commands/collectstatic.py),
+then fingerprints the bundles, and WhiteNoise serves the fingerprinted
+names with a year's immutable caching and precompressed gzip and Brotli
+copies. Relative ``url()``s in the CSS are written as seen from
+static/bundles/; ``inline()`` makes them absolute for inlined copies,
+which the browser would otherwise resolve against the page.
+
+The built bundles are committed so runserver and the tests work without
+a build; a test fails when they fall behind their sources.
+
+The minifiers are deliberately simple. CSS loses comments and the
+whitespace around punctuation. JavaScript loses comments and indentation
+but keeps its line breaks, so automatic semicolon insertion reads it
+exactly as before. Strings and template literals are left untouched;
+regular expression literals are not recognised, so keep ``//``, ``/*``
+and quotes out of them or build them with ``new RegExp()``.
+"""
+import hashlib
+import posixpath
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+BUNDLES = ('critical.css', 'site.css', 'site.js')
+SOURCE_DIR = Path(__file__).resolve().parent / 'assets'
+STATIC_PREFIX = 'bundles/'
+
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/''', re.S)
+# url(...) pointing at another static file, i.e. not absolute or data:
+CSS_URL = re.compile(r'''url\((['"]?)(?![a-z]+:|/|#)([^'")]+)\1\)''', re.I)
+JS_TOKENS = re.compile(
+    r'''("(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)|//[^\n]*|/\*.*?\*/''', re.S,
+)
+
+
+@dataclass
+class Built:
+    name: str
+    source_size: int
+    size: int
+    changed: bool
+
+
+def output_dir():
+    return Path(settings.BASE_DIR) / 'static' / 'bundles'
+
+
+def _minify(text, tokens, code, comment):
+    """Apply ``code`` to everything outside strings, with comments replaced by ``comment()``"""
+    out, pending, position = [], [], 0
+    for match in tokens.finditer(text):
+        pending.append(text[position:match.start()])
+        if match.group(1):
+            out += [code(''.join(pending)), match.group(1)]
+            pending = []
+        else:
+            pending.append(comment(match.group(0)))
+        position = match.end()
+    pending.append(text[position:])
+    out.append(code(''.join(pending)))
+    return ''.join(out).strip()
+
+
+def _css_code(code):
+    code = re.sub(r'\s+', ' ', code)
+    code = re.sub(r' ?([{};,>]) ?', r'\1', code)
+    code = re.sub(r': ', ':', code)
+    return code.replace(';}', '}')
+
+
+def _js_code(code):
+    code = re.sub(r'[ \t]+', ' ', code)
+    return re.sub(r' ?\n\s*', '\n', code)
+
+
+def minify_css(text):
+    return _minify(text, CSS_TOKENS, _css_code, lambda comment: ' ')
+
+
+def minify_js(text):
+    return _minify(text, JS_TOKENS, _js_code, lambda comment: '\n' if '\n' in comment else ' ')
+
+
+def minify(name, text):
+    return minify_css(text) if name.endswith('.css') else minify_js(text)
+
+
+def build(check=False):
+    """
+    Minify every source into static/bundles/. With ``check``, only report
+    which bundles differ from what building would write.
+    """
+    target = output_dir()
+    if not check:
+        target.mkdir(parents=True, exist_ok=True)
+    results = []
+    for name in BUNDLES:
+        source = (SOURCE_DIR / name).read_text()
+        content = minify(name, source) + '\n'
+        path = target / name
+        changed = not path.exists() or path.read_text() != content
+        if changed and not check:
+            path.write_text(content)
+        results.append(Built(name, len(source.encode()), len(content.encode()), changed))
+    read.cache_clear()
+    inline.cache_clear()
+    return results
+
+
+@lru_cache(maxsize=None)
+def read(name):
+    """A built bundle's content, read once per process"""
+    path = finders.find(STATIC_PREFIX + name)
+    if path is None:
+        raise FileNotFoundError(f'No {STATIC_PREFIX}{name}; run manage.py build_assets')
+    return Path(path).read_text()
+
+
+@lru_cache(maxsize=None)
+def inline(name):
+    """read() for a ``<style>`` element: relative url()s become static URLs"""
+    content = read(name)
+    if not name.endswith('.css'):
+        return content
+    directory = posixpath.dirname(STATIC_PREFIX + name)
+    return CSS_URL.sub(
+        lambda match: f"url('{static(posixpath.normpath(posixpath.join(directory, match.group(2))))}')",
+        content,
+    )
+
+
+def fingerprint():
+    """
+    Changes whenever a bundle, or a file an inlined bundle refers to, does.
+    Cached pages and ETags include it, so a deploy never replays HTML that
+    links to files no longer served.
+    """
+    digest = hashlib.md5(usedforsecurity=False)
+    for name in BUNDLES:
+        digest.update(inline(name).encode())
+    return digest.hexdigest()[:12]
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    WhiteNoise's storage, except that files missing from the manifest get
+    their plain URL instead of an error. That only happens where
+    collectstatic hasn't run (the tests); WhiteNoise serves both names.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
@@ -0,0 +1,98 @@
+"""
+Community chat: posting messages, and history paged by keyset cursors over
+``(timestamp, id)``.
+
+A cursor is a message id: ``after_id`` pages forward to messages newer than
+it, ``before_id`` pages back to older ones. Each page is one indexed range
+read on ``chatmessage_timestamp_idx``, so the thousandth page back costs the
+same as the first.
+"""
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db.models import Q
+
+from . import chat_buffer, realtime
+from .models import ChatMessage
+
+MAX_MESSAGE_LENGTH = 2000
+
+
+@dataclass
+class Page:
+    messages: list = field(default_factory=list)
+    # More messages exist beyond this page in the direction it was read
+    has_more: bool = False
+
+
+def page_size(requested=None):
+    default = getattr(settings, 'CHAT_PAGE_SIZE', 50)
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, getattr(settings, 'CHAT_MAX_PAGE_SIZE', 100)))
+
+
+def _anchor(message_id):
+    return (
+        ChatMessage.objects.filter(pk=message_id)
+        .values_list('timestamp', 'pk')
+        .first()
+    )
+
+
+def page(after_id=None, before_id=None, limit=None):
+    """
+    Up to ``limit`` messages, oldest first: the newest ones by default, those
+    after ``after_id`` or those before ``before_id``. An unknown cursor (say,
+    a message that has since been pruned) gives an empty page.
+    """
+    limit = page_size(limit)
+    queryset = ChatMessage.objects.select_related('user')
+
+    if after_id is not None:
+        anchor = _anchor(after_id)
+        if anchor is None:
+            return Page()
+        timestamp, pk = anchor
+        queryset = queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk))
+        rows = list(queryset.order_by('timestamp', 'pk')[:limit + 1])
+        return Page(rows[:limit], len(rows) > limit)
+
+    if before_id is not None:
+        anchor = _anchor(before_id)
+        if anchor is None:
+            return Page()
+        timestamp, pk = anchor
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+
+    rows = list(queryset.order_by('-timestamp', '-pk')[:limit + 1])
+    return Page(rows[:limit][::-1], len(rows) > limit)
+
+
+def serialize(message, member=None):
+    return {
+        'id': message.pk,
+        'message': message.message,
+        'timestamp': message.timestamp.isoformat(),
+        'user': {
+            'id': message.user_id,
+            'name': message.user.get_full_name(),
+        },
+        'mine': member is not None and message.user_id == member.pk,
+    }
+
+
+def post(user, text):
+    """
+    Save a chat message and push it to everyone connected. With
+    CHAT_WRITE_BEHIND on the message is only queued: the result is a
+    ``chat_buffer.Accepted`` with a provisional id instead of the saved
+    message, and ``chat_buffer.BufferFull`` means try again shortly.
+    """
+    if chat_buffer.enabled():
+        return chat_buffer.get_buffer().submit(user, text)
+    message = ChatMessage.objects.create(user=user, message=text)
+    realtime.publish(realtime.CHAT_CHANNEL, realtime.chat_event(message))
+    return message
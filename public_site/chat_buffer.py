@@ -0,0 +1,139 @@
+"""
+Write-behind ingestion for chat messages.
+
+With ``CHAT_WRITE_BEHIND`` on, ``chat.post()`` hands messages to a bounded
+per-process buffer and returns straight away with a provisional id. A
+background thread saves the buffer with one bulk INSERT every
+``CHAT_FLUSH_INTERVAL`` seconds, or sooner once ``CHAT_FLUSH_BATCH_SIZE``
+messages are waiting, and only then publishes them with their real ids.
+
+Messages accepted but not yet flushed live only in memory: the buffer is
+flushed when the process exits normally, but a crash loses up to one
+interval's worth of messages.
+"""
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import realtime
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    """The buffer is at capacity; the caller should retry shortly"""
+
+
+@dataclass
+class Accepted:
+    provisional_id: str
+    message: ChatMessage
+
+
+class ChatBuffer:
+    def __init__(self, max_size=None, batch_size=None, interval=None, background=True):
+        self.max_size = max_size or getattr(settings, 'CHAT_BUFFER_SIZE', 5000)
+        self.batch_size = batch_size or getattr(settings, 'CHAT_FLUSH_BATCH_SIZE', 200)
+        self.interval = interval or getattr(settings, 'CHAT_FLUSH_INTERVAL', 0.05)
+        self.pending = []
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.prefix = f'{os.getpid()}-{int(time.time())}'
+        # Without the background thread nothing is saved until flush() is called
+        self.background = background
+        self.thread = None
+        self.stopping = False
+
+    def __len__(self):
+        return len(self.pending)
+
+    def submit(self, user, text):
+        """Queue a message for saving; raises BufferFull when at capacity"""
+        with self.condition:
+            if len(self.pending) >= self.max_size:
+                raise BufferFull()
+            accepted = Accepted(f'{self.prefix}-{next(self.ids)}', ChatMessage(user=user, message=text))
+            self.pending.append(accepted)
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+            if self.background and self.thread is None and not self.stopping:
+                self.thread = threading.Thread(target=self.run, name='chat-buffer', daemon=True)
+                self.thread.start()
+        return accepted
+
+    def take(self):
+        with self.condition:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+        return batch
+
+    def flush(self):
+        """Save everything waiting now; returns the number of messages saved"""
+        saved = 0
+        with self.flush_lock:
+            while True:
+                batch = self.take()
+                if not batch:
+                    return saved
+                try:
+                    ChatMessage.objects.bulk_create([accepted.message for accepted in batch])
+                except Exception:
+                    # Keep the batch for the next attempt, ahead of newer messages
+                    with self.condition:
+                        self.pending[:0] = batch
+                    raise
+                saved += len(batch)
+                for accepted in batch:
+                    event = realtime.chat_event(accepted.message, client_id=accepted.provisional_id)
+                    realtime.publish(realtime.CHAT_CHANNEL, event)
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.stopping and len(self.pending) < self.batch_size:
+                    self.condition.wait(self.interval)
+                stopping = self.stopping
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception("Could not save buffered chat messages; will retry")
+                time.sleep(self.interval)
+            if stopping:
+                return
+
+    def close(self, timeout=10):
+        """Stop the flusher after it saves what is left"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        if self.pending:
+            self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = ChatBuffer()
+            atexit.register(_buffer.close)
+        return _buffer
@@ -0,0 +1,196 @@
+"""
+Whitespace minification and Brotli/gzip compression for dynamic responses.
+
+WhiteNoise compresses static files at build time; this covers what views
+render. ``minify_html()`` collapses each run of whitespace in an HTML page
+to one space, or one newline when the run contains one. Browsers render
+that identically outside ``<pre>``, ``<textarea>``, ``<script>`` and
+``<style>``, whose content is left untouched (as is any element styled
+``white-space: pre``, which the site doesn't use).
+
+``compress()`` and ``compress_stream()`` encode with whichever of Brotli
+and gzip the client's Accept-Encoding prefers; Brotli needs the Brotli
+package and is skipped without it. Streams are compressed chunk by chunk
+and flushed after every chunk, so nothing the view yields is held back.
+
+Every compressed response is measured: bytes before and after and the
+CPU time spent compressing. Buffered responses report it in a
+``Server-Timing`` header, visible in the browser's network panel, and
+every response is logged to ``public_site.compression``, which is what
+to sum when weighing bandwidth saved against dyno CPU.
+"""
+import gzip
+import logging
+import re
+import time
+import zlib
+from dataclasses import dataclass
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Content inside these elements keeps its whitespace
+PRESERVED = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.S | re.I)
+WHITESPACE = re.compile(r'\s+')
+
+# Types worth compressing; images, audio, video, fonts and archives
+# are compressed already
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml',
+    'application/rss+xml', 'application/atom+xml', 'image/svg+xml',
+)
+
+
+@dataclass
+class Measurement:
+    encoding: str
+    original: int = 0
+    compressed: int = 0
+    cpu_ns: int = 0
+
+    @property
+    def ratio(self):
+        return round(self.compressed / self.original, 3) if self.original else None
+
+    @property
+    def server_timing(self):
+        return (
+            f'compress;dur={self.cpu_ns / 1e6:.2f};'
+            f'desc="{self.encoding} {self.original}->{self.compressed}"'
+        )
+
+    def log(self, path):
+        logger.info(
+            "Compressed %s with %s: %d -> %d bytes (ratio %s) in %.2f ms CPU",
+            path, self.encoding, self.original, self.compressed, self.ratio, self.cpu_ns / 1e6,
+        )
+
+
+def min_size():
+    return getattr(settings, 'COMPRESSION_MIN_SIZE', 500)
+
+
+def minify_html(html):
+    parts = PRESERVED.split(html)
+    # split() returns text, then each match's two groups; keep matches whole
+    out = []
+    for index in range(0, len(parts), 3):
+        out.append(WHITESPACE.sub(_collapse, parts[index]))
+        if index + 1 < len(parts):
+            out.append(parts[index + 1])
+    return ''.join(out)
+
+
+def _collapse(match):
+    return '\n' if '\n' in match.group(0) else ' '
+
+
+def compressible(content_type):
+    return content_type.split(';')[0].strip().lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' or None for an Accept-Encoding header, honouring ``q=0``"""
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([\d.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    wildcard = accepted.get('*', 0.0)
+    candidates = [coding for coding in ('br', 'gzip') if accepted.get(coding, wildcard) > 0]
+    if brotli is None and 'br' in candidates:
+        candidates.remove('br')
+    if not candidates:
+        return None
+    # Brotli wins ties; otherwise the client's preference
+    return max(candidates, key=lambda coding: (accepted.get(coding, wildcard), coding == 'br'))
+
+
+def brotli_quality():
+    return getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5)
+
+
+def gzip_level():
+    return getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6)
+
+
+def compress(content, encoding):
+    """``(compressed bytes, Measurement)`` for a whole body"""
+    started = time.thread_time_ns()
+    if encoding == 'br':
+        compressed = brotli.compress(content, quality=brotli_quality())
+    else:
+        compressed = gzip.compress(content, gzip_level(), mtime=0)
+    return compressed, Measurement(encoding, len(content), len(compressed), time.thread_time_ns() - started)
+
+
+class StreamCompressor:
+    """Incremental compression of a body that arrives in chunks, measured as it goes"""
+
+    def __init__(self, encoding):
+        self.measurement = Measurement(encoding)
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=brotli_quality())
+        else:
+            self.compressor = zlib.compressobj(gzip_level(), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def _timed(self, compress, *args):
+        started = time.thread_time_ns()
+        out = compress(*args)
+        self.measurement.cpu_ns += time.thread_time_ns() - started
+        self.measurement.compressed += len(out)
+        return out
+
+    def _chunk(self, data):
+        # Flushed, so the client can decode everything sent so far
+        if self.measurement.encoding == 'br':
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _finish(self):
+        if self.measurement.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush(zlib.Z_FINISH)
+
+    def feed(self, data):
+        self.measurement.original += len(data)
+        return self._timed(self._chunk, data)
+
+    def finish(self):
+        return self._timed(self._finish)
+
+
+def compress_stream(chunks, encoding, on_finish):
+    """Compress an iterable of bytes as it is consumed; ``on_finish(Measurement)`` runs at the end"""
+    stream = StreamCompressor(encoding)
+    for chunk in chunks:
+        out = stream.feed(chunk)
+        if out:
+            yield out
+    out = stream.finish()
+    on_finish(stream.measurement)
+    yield out
+
+
+async def acompress_stream(chunks, encoding, on_finish):
+    """compress_stream() for the async iterators of async streaming responses"""
+    stream = StreamCompressor(encoding)
+    async for chunk in chunks:
+        out = stream.feed(chunk)
+        if out:
+            yield out
+    out = stream.finish()
+    on_finish(stream.measurement)
+    yield out
@@ -0,0 +1,80 @@
+"""
+Conditional GET for the listing pages.
+
+Each page names the queryset it lists, the date field to watch and the
+fragment sections (see fragments.py) its models belong to. Before the view
+runs, one aggregate query over the queryset (newest date and row count),
+the sections' version stamps and the static bundles (see bundles.py) make
+up the ETag, and the time the sections last changed is the Last-Modified
+date. The stamps come from the database (fragments.stamps()) rather than
+the cache, which may be local to each web worker. A request whose
+If-None-Match or If-Modified-Since still matches gets a 304 and neither the
+listing queries nor the template run.
+
+Logged-in members see their own header (name, avatar, notification bell),
+so their ETag also covers the member and their unread notifications. They
+get no Last-Modified, which a new notification would not move.
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import bundles, fragments, notifications
+
+
+def viewer(request):
+    """What the page header shows this visitor, as a list of plain values"""
+    # Flash messages are shown on the next page rendered
+    parts = [request.COOKIES.get('messages', '')]
+    user = request.user
+    if user.is_authenticated:
+        bell = notifications.bell(user)
+        parts += [
+            user.pk, user.get_full_name(), user.avatar.name if user.avatar else '', user.is_staff,
+            bell.count, [notification.pk for notification in bell.items],
+        ]
+    return parts
+
+
+def conditional_listing(queryset, field, sections):
+    """
+    Answer conditional GETs for a view listing ``queryset`` before it
+    runs. ``field`` is the model's date or timestamp column and
+    ``sections`` the fragment sections whose changes alter the page.
+    """
+    def stamps(request):
+        # etag() and last_modified() both need them; read the table once
+        if not hasattr(request, '_section_stamps'):
+            request._section_stamps = fragments.stamps(sections)
+        return request._section_stamps
+
+    def etag(request, *args, **kwargs):
+        state = queryset.aggregate(latest=Max(field), count=Count('pk'))
+        latest = state['latest'].isoformat() if state['latest'] else ''
+        versions = [version for version, _ in stamps(request)]
+        parts = [latest, state['count'], versions, bundles.fingerprint(), viewer(request)]
+        return hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        return max(changed for _, changed in stamps(request))
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            # Revalidate every time rather than trust a heuristic lifetime
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(response, no_cache=True)
+            patch_vary_headers(response, ['Cookie'])
+            return response
+        return wrapper
+    return decorator
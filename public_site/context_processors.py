@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import notifications
+
+
+def notification_bell(request):
+    """
+    Unread count and newest unread notifications for the header bell in
+    base.html, loaded once per request and only if the page renders the bell.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'notification_bell': SimpleLazyObject(lambda: notifications.bell(user))}
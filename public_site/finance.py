@@ -0,0 +1,173 @@
+"""
+Monthly and yearly financial totals.
+
+FinancialRollup holds offering, donations, expenses, net and the number
+of records for every calendar month and year that has records. Saving or
+deleting a FinancialRecord adds its difference to its month and its year
+in place (``record_saved()``/``record_deleted()``, wired to the model's
+signals), so reading any range of totals costs one query over at most one
+row per period, however many records it covers. Bulk updates and deletes
+skip the signals; ``manage.py reconcile_financial_rollups`` rebuilds the
+table from the records.
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth, TruncYear
+
+from .models import FinancialRecord, FinancialRollup
+
+AMOUNTS = ('offering', 'donations', 'expenses')
+TRUNCATE = {'month': TruncMonth, 'year': TruncYear}
+BOUND = re.compile(r'^(\d{4})(?:-(\d{1,2}))?$')
+
+
+@dataclass
+class Summary:
+    period: str
+    rows: list = field(default_factory=list)
+
+    @property
+    def totals(self):
+        totals = {name: sum((getattr(row, name) for row in self.rows), Decimal('0')) for name in (*AMOUNTS, 'net')}
+        totals['record_count'] = sum(row.record_count for row in self.rows)
+        return totals
+
+    @property
+    def trend(self):
+        """``(rollup, change in net from the period before)``; None for the first"""
+        previous = None
+        for row in self.rows:
+            yield row, None if previous is None else row.net - previous.net
+            previous = row
+
+
+def period_start(day, period):
+    return day.replace(day=1) if period == 'month' else day.replace(month=1, day=1)
+
+
+def parse_bound(value):
+    """The first day of a ``YYYY`` or ``YYYY-MM`` period; ValueError otherwise"""
+    match = BOUND.match(value.strip())
+    if not match:
+        raise ValueError(f'{value!r} is not YYYY or YYYY-MM')
+    return date(int(match.group(1)), int(match.group(2) or 1), 1)
+
+
+def _amount(record, name):
+    # Through str() so a float assigned in code adds what the column will store
+    return Decimal(str(getattr(record, name)))
+
+
+def _net(amounts):
+    return amounts['offering'] + amounts['donations'] - amounts['expenses']
+
+
+def _apply(day, amounts, records):
+    """Add ``amounts`` and ``records`` (either may be negative) to the month and year of ``day``"""
+    changes = {name: F(name) + amounts[name] for name in AMOUNTS}
+    changes['net'] = F('net') + _net(amounts)
+    changes['record_count'] = F('record_count') + records
+    with transaction.atomic():
+        for period in TRUNCATE:
+            start = period_start(day, period)
+            FinancialRollup.objects.get_or_create(period=period, start=start)
+            FinancialRollup.objects.filter(period=period, start=start).update(**changes)
+        if records < 0:
+            FinancialRollup.objects.filter(record_count=0).delete()
+
+
+def previous_state(record):
+    """What ``record`` held before this save, for record_saved(); None for new records"""
+    if record.pk is None:
+        return None
+    return FinancialRecord.objects.filter(pk=record.pk).values(*AMOUNTS, 'record_date').first()
+
+
+def record_saved(record, previous):
+    """Move ``record``'s totals from what ``previous_state()`` returned to what it holds now"""
+    current = {name: _amount(record, name) for name in AMOUNTS}
+    if previous is None:
+        _apply(record.record_date, current, 1)
+        return
+    if previous['record_date'] == record.record_date:
+        difference = {name: current[name] - previous[name] for name in AMOUNTS}
+        if any(difference.values()):
+            _apply(record.record_date, difference, 0)
+        return
+    with transaction.atomic():
+        _apply(previous['record_date'], {name: -previous[name] for name in AMOUNTS}, -1)
+        _apply(record.record_date, current, 1)
+
+
+def record_deleted(record):
+    _apply(record.record_date, {name: -_amount(record, name) for name in AMOUNTS}, -1)
+
+
+def expected_rollups():
+    """Totals per (period, start) computed from the records themselves"""
+    expected = {}
+    for period, truncate in TRUNCATE.items():
+        totals = (
+            FinancialRecord.objects.order_by()
+            .annotate(start=truncate('record_date')).values('start')
+            .annotate(record_count=Count('id'), **{name: Sum(name) for name in AMOUNTS})
+        )
+        for row in totals:
+            amounts = {name: row[name] or Decimal('0') for name in AMOUNTS}
+            expected[period, row['start']] = {**amounts, 'net': _net(amounts), 'record_count': row['record_count']}
+    return expected
+
+
+def rebuild_rollups(batch_size=500):
+    """
+    Recompute every rollup from the records table. Returns the number of
+    rollups that were wrong, missing or left over.
+    """
+    expected = expected_rollups()
+    fields = [*AMOUNTS, 'net', 'record_count']
+    with transaction.atomic():
+        drifted, stale = [], []
+        for rollup in FinancialRollup.objects.select_for_update().iterator(chunk_size=batch_size):
+            values = expected.pop((rollup.period, rollup.start), None)
+            if values is None:
+                stale.append(rollup.pk)
+            elif any(getattr(rollup, name) != values[name] for name in fields):
+                for name in fields:
+                    setattr(rollup, name, values[name])
+                drifted.append(rollup)
+        FinancialRollup.objects.filter(pk__in=stale).delete()
+        FinancialRollup.objects.bulk_update(drifted, fields, batch_size=batch_size)
+        FinancialRollup.objects.bulk_create(
+            [FinancialRollup(period=period, start=start, **values) for (period, start), values in expected.items()],
+            batch_size=batch_size,
+        )
+    return len(drifted) + len(stale) + len(expected)
+
+
+def summary(period='month', start=None, end=None):
+    """The ``period`` rollups from ``start`` to ``end`` (first days of periods), oldest first"""
+    if period not in TRUNCATE:
+        raise ValueError(f'period must be one of {", ".join(TRUNCATE)}')
+    rollups = FinancialRollup.objects.filter(period=period)
+    if start is not None:
+        rollups = rollups.filter(start__gte=period_start(start, period))
+    if end is not None:
+        rollups = rollups.filter(start__lte=period_start(end, period))
+    return Summary(period, list(rollups.order_by('start')))
+
+
+def serialize(rollup):
+    return {'start': rollup.start.isoformat(), **serialize_totals(vars(rollup))}
+
+
+def serialize_totals(totals):
+    # Amounts as strings, so JSON clients get them to the cent
+    return {
+        **{name: str(totals[name]) for name in (*AMOUNTS, 'net')},
+        'record_count': totals['record_count'],
+    }
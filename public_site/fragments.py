@@ -0,0 +1,147 @@
+"""
+Versioned fragment cache for pages built from rarely-changing content.
+
+Each section of a page (``{% fragment 'announcements' %}`` in a template)
+is cached under a key carrying that section's version stamp. Saving or
+deleting one of the section's models bumps the stamp (see signals.py), so
+the next render misses and rebuilds it; until then the section costs no
+queries at all. Old versions are simply never read again and expire.
+
+The cache may be local to each process, so bumps are also written to a
+SectionVersion row; ``stamps()`` reads those for validators that every web
+worker must agree on (see conditional.py).
+
+Hit and miss counts live in the cache next to the fragments; see
+``stats()`` and the staff-only ``cache/stats/`` view.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Announcement, Activity, FinancialRecord, Photo, SectionVersion
+
+SECTION_MODELS = {
+    'announcements': (Announcement,),
+    'activities': (Activity,),
+    'financial': (FinancialRecord,),
+    'photos': (Photo,),
+}
+
+VERSION_KEY = 'fragment_version:{}'
+FRAGMENT_KEY = 'fragment:{}:{}'
+STATS_KEY = 'fragment_stats:{}:{}'
+
+
+def timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 300)
+
+
+def version(section):
+    key = VERSION_KEY.format(section)
+    stamp = cache.get(key)
+    if stamp is None:
+        # Start from the clock so a stamp lost from the cache can never
+        # bring back fragments rendered under an older one
+        cache.add(key, time.time_ns(), None)
+        stamp = cache.get(key)
+    return stamp
+
+
+def versions(sections):
+    """Version stamps for several sections, in one cache round trip when warm"""
+    keys = [VERSION_KEY.format(section) for section in sections]
+    found = cache.get_many(keys)
+    return tuple(found.get(key) or version(section) for key, section in zip(keys, sections))
+
+
+def stamps(sections):
+    """
+    The shared (version, changed_at) of each section, from the database in
+    one query. A section never bumped starts now: claiming an older time
+    could tell a browser its copy is current when it isn't.
+    """
+    found = {
+        row.section: row
+        for row in SectionVersion.objects.filter(section__in=sections)
+    }
+    for section in sections:
+        if section not in found:
+            found[section], _ = SectionVersion.objects.get_or_create(
+                section=section, defaults={'changed_at': timezone.now()},
+            )
+    return [(found[section].version, found[section].changed_at) for section in sections]
+
+
+def _bump_shared(section):
+    now = timezone.now()
+    if SectionVersion.objects.filter(section=section).update(version=F('version') + 1, changed_at=now):
+        return
+    try:
+        with transaction.atomic():
+            SectionVersion.objects.create(section=section, version=1, changed_at=now)
+    except IntegrityError:
+        SectionVersion.objects.filter(section=section).update(version=F('version') + 1, changed_at=now)
+
+
+def bump(section):
+    key = VERSION_KEY.format(section)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+    _bump_shared(section)
+
+
+def expire_for(model):
+    """Invalidate every section built from ``model``"""
+    for section, models in SECTION_MODELS.items():
+        if model in models:
+            bump(section)
+
+
+def _count(section, outcome):
+    key = STATS_KEY.format(section, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_or_render(section, render):
+    """The cached HTML for ``section``, calling ``render()`` on a miss"""
+    if section not in SECTION_MODELS:
+        raise ValueError(f"Unknown fragment section {section!r}; add it to SECTION_MODELS")
+    key = FRAGMENT_KEY.format(section, version(section))
+    html = cache.get(key)
+    if html is not None:
+        _count(section, 'hits')
+        return html
+    _count(section, 'misses')
+    html = render()
+    cache.set(key, html, timeout())
+    return html
+
+
+def stats():
+    """Hits, misses and hit ratio per section since the counters started"""
+    keys = {
+        (section, outcome): STATS_KEY.format(section, outcome)
+        for section in SECTION_MODELS for outcome in ('hits', 'misses')
+    }
+    values = cache.get_many(keys.values())
+    result = {}
+    for section in SECTION_MODELS:
+        hits = values.get(keys[section, 'hits'], 0)
+        misses = values.get(keys[section, 'misses'], 0)
+        result[section] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+            'version': cache.get(VERSION_KEY.format(section)),
+        }
+    return result
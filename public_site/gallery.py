@@ -0,0 +1,97 @@
+"""
+Gallery photos paged by keyset cursors over ``(upload_date, id)``, per
+photo type and optionally per album.
+
+A cursor is the id of the last photo shown; the next page is one indexed
+range read on ``photo_type_date_idx`` (or ``photo_album_date_idx`` for an
+album) that loads only the columns a tile needs, so page 500 costs what
+page 1 does. The album list is cached until a photo changes.
+"""
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+
+from . import fragments, images
+from .models import Photo
+
+TILE_FIELDS = ('pk', 'title', 'image', 'photo_type', 'album', 'upload_date', 'width', 'height', 'derivatives', 'placeholder')
+ALBUMS_KEY = 'gallery_albums:{}:{}'
+
+
+@dataclass
+class Page:
+    photos: list = field(default_factory=list)
+    # Older photos exist after this page
+    has_more: bool = False
+
+    @property
+    def next_cursor(self):
+        return self.photos[-1].pk if self.has_more else None
+
+
+def page_size(requested=None):
+    default = getattr(settings, 'GALLERY_PAGE_SIZE', 24)
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, getattr(settings, 'GALLERY_MAX_PAGE_SIZE', 100)))
+
+
+def page(photo_type, before_id=None, album=None, limit=None):
+    """A page of ``photo_type`` photos, newest first, older than ``before_id`` if given"""
+    limit = page_size(limit)
+    queryset = Photo.objects.filter(photo_type=photo_type).only(*TILE_FIELDS)
+    if album is not None:
+        queryset = queryset.filter(album=album)
+    if before_id is not None:
+        anchor = Photo.objects.filter(pk=before_id).values_list('upload_date', 'pk').first()
+        if anchor is None:
+            return Page()
+        upload_date, pk = anchor
+        # The redundant upload_date__lte bounds the index range; without it
+        # SQLite reads every newer photo before the first one it keeps
+        queryset = queryset.filter(
+            Q(upload_date__lte=upload_date),
+            Q(upload_date__lt=upload_date) | Q(pk__lt=pk),
+        )
+    rows = list(queryset.order_by('-upload_date', '-pk')[:limit + 1])
+    return Page(rows[:limit], len(rows) > limit)
+
+
+def albums(photo_type):
+    """Albums of ``photo_type`` photos with their size, most recently added to first"""
+    key = ALBUMS_KEY.format(photo_type, fragments.version('photos'))
+    result = cache.get(key)
+    if result is None:
+        result = [
+            {'name': row['album'], 'count': row['count'], 'latest': row['latest'].isoformat()}
+            for row in (
+                Photo.objects.filter(photo_type=photo_type).exclude(album='')
+                .values('album').annotate(count=Count('id'), latest=Max('upload_date'))
+                .order_by('-latest')
+            )
+        ]
+        cache.set(key, result, fragments.timeout())
+    return result
+
+
+def serialize(photo):
+    """What the gallery's scripts need to draw one tile"""
+    tile = {
+        'id': photo.pk,
+        'title': photo.title,
+        'album': photo.album,
+        'src': photo.image.url,
+        'width': photo.width,
+        'height': photo.height,
+    }
+    if images.is_current(photo):
+        tile.update({
+            'src': images.fallback_url(photo),
+            'srcset': {fmt: images.srcset(photo, fmt) for fmt in images.FORMATS},
+            'placeholder': photo.placeholder,
+        })
+    return tile
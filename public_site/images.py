@@ -0,0 +1,160 @@
+"""
+Resized copies of gallery photos for responsive ``<img srcset>`` markup.
+
+Saving a photo with a new image queues a job (see tasks.py) that writes
+the image at each of ``PHOTO_DERIVATIVE_WIDTHS`` in WebP and JPEG next to
+the original, plus an inline blurred placeholder a few pixels wide. Their
+paths and sizes are stored on the photo; ``{% photo_img %}`` (see
+templatetags/images.py) turns them into a ``<picture>`` element, and
+falls back to the original until they exist.
+
+``manage.py generate_photo_derivatives`` backfills existing photos in a
+process pool.
+"""
+import base64
+import io
+import logging
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+
+from . import fragments
+from .models import Photo
+
+logger = logging.getLogger(__name__)
+
+# Pillow format name, file extension and encoder options per format; the
+# first is preferred by browsers that support it, the last is the fallback
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 75, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+PLACEHOLDER_WIDTH = 16
+
+
+def widths():
+    return sorted(getattr(settings, 'PHOTO_DERIVATIVE_WIDTHS', (320, 640, 1280)))
+
+
+def _open(name):
+    with default_storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        image.load()
+    # Phones store rotation in EXIF; apply it so derivatives come out upright
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        # JPEG has no alpha: flatten transparent images onto white
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+        image = background
+    return image.convert('RGB')
+
+
+def _encode(image, fmt):
+    pillow_format, _, options = FORMATS[fmt]
+    buffer = io.BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def placeholder(image):
+    """A blurred data: URI a few pixels wide, shown while the real image loads"""
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    tiny = image.resize((PLACEHOLDER_WIDTH, height), Image.LANCZOS).filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'JPEG', quality=40)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def render(name, replace=False):
+    """
+    Write the derivatives of the image stored at ``name``. Touches storage
+    only, never the database, so it can run in a worker process. With
+    ``replace``, files left at the derivative names are overwritten rather
+    than kept beside new, suffixed copies.
+    """
+    image = _open(name)
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    # Never upscale; an image narrower than every width gets one copy at its own
+    sizes = [width for width in widths() if width < image.width] or [image.width]
+    if image.width <= widths()[-1] and image.width not in sizes:
+        sizes.append(image.width)
+
+    derivatives = {'source': name, **{fmt: [] for fmt in FORMATS}}
+    for width in sizes:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for fmt, (_, extension, _) in FORMATS.items():
+            path = posixpath.join(directory, 'derivatives', f'{stem}-{width}w.{extension}')
+            if replace and default_storage.exists(path):
+                default_storage.delete(path)
+            saved = default_storage.save(path, ContentFile(_encode(resized, fmt)))
+            derivatives[fmt].append({'name': saved, 'width': width, 'height': height})
+    return {
+        'width': image.width,
+        'height': image.height,
+        'placeholder': placeholder(image),
+        'derivatives': derivatives,
+    }
+
+
+def files(derivatives):
+    return [item['name'] for fmt in FORMATS for item in derivatives.get(fmt, ())]
+
+
+def delete_files(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning("Could not delete photo derivative %s", name, exc_info=True)
+
+
+def is_current(photo):
+    return bool(photo.image) and photo.derivatives.get('source') == photo.image.name
+
+
+def store(photo, result):
+    """
+    Save ``render()``'s result on ``photo``, unless its image was replaced
+    in the meantime. Returns whether it was saved.
+    """
+    saved = Photo.objects.filter(pk=photo.pk, image=result['derivatives']['source']).update(
+        width=result['width'],
+        height=result['height'],
+        placeholder=result['placeholder'],
+        derivatives=result['derivatives'],
+    )
+    if not saved:
+        delete_files(files(result['derivatives']))
+        return False
+    delete_files(files(photo.derivatives))
+    for field in ('width', 'height', 'placeholder', 'derivatives'):
+        setattr(photo, field, result[field])
+    # update() sends no signals; pages showing photos must still re-render
+    fragments.expire_for(Photo)
+    return True
+
+
+def process(photo, force=False):
+    """Generate and store ``photo``'s derivatives if they are missing or stale"""
+    if not photo.image or (is_current(photo) and not force):
+        return False
+    return store(photo, render(photo.image.name))
+
+
+def srcset(photo, fmt):
+    return ', '.join(
+        f"{default_storage.url(item['name'])} {item['width']}w"
+        for item in photo.derivatives.get(fmt, ())
+    )
+
+
+def fallback_url(photo):
+    """The JPEG for browsers that ignore srcset; the middle width suits them well enough"""
+    jpegs = photo.derivatives['jpeg']
+    return default_storage.url(jpegs[len(jpegs) // 2]['name'])
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management.base import BaseCommand
+
+from public_site import realtime, streams
+from users.models import CustomUser
+
+BACKENDS = {
+    'local': realtime.LocalBackend,
+    'database': realtime.DatabasePollingBackend,
+    'relay': realtime.RelayBackend,
+}
+
+
+class SimulatedClient:
+    """A chat socket driven in-process through the ASGI interface"""
+
+    def __init__(self, cookie, read_delay=0.0):
+        self.scope = {'type': 'websocket', 'path': '/community/ws/', 'headers': [(b'cookie', cookie.encode())]}
+        self.inbox = asyncio.Queue()
+        self.inbox.put_nowait({'type': 'websocket.connect'})
+        self.read_delay = read_delay
+        self.accepted = asyncio.Event()
+        self.closed_code = None
+        self.received = {}
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, message):
+        if message['type'] == 'websocket.accept':
+            self.accepted.set()
+        elif message['type'] == 'websocket.send':
+            self.received[json.loads(message['text'])['message']['message']] = time.perf_counter()
+            if self.read_delay:
+                await asyncio.sleep(self.read_delay)
+        elif message['type'] == 'websocket.close':
+            self.closed_code = message.get('code')
+
+    def say(self, text):
+        self.inbox.put_nowait({'type': 'websocket.receive', 'text': json.dumps({'message': text})})
+
+    def disconnect(self):
+        self.inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+
+
+class Command(BaseCommand):
+    help = 'Measure chat socket latency and throughput with simulated clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='Connected clients')
+        parser.add_argument('--senders', type=int, default=5, help='How many of the clients send messages')
+        parser.add_argument('--messages', type=int, default=20, help='Messages per sender')
+        parser.add_argument('--slow', type=int, default=0, help='Extra clients that take 50ms to read each event')
+        parser.add_argument('--backend', choices=sorted(BACKENDS), default='local')
+        parser.add_argument(
+            '--relay-url',
+            help='Existing relay for --backend relay (default: start one in this process)',
+        )
+        parser.add_argument('--queue-size', type=int, default=100, help='Per-client event queue size')
+        parser.add_argument('--timeout', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        user, session = self.create_member()
+        try:
+            results = asyncio.run(self.run(session.session_key, options))
+        finally:
+            # Deleting the member takes its chat messages with it
+            session.delete()
+            user.delete()
+        self.report(results, options)
+
+    def create_member(self):
+        user = CustomUser.objects.create_user(
+            username=f'bench-{uuid.uuid4().hex[:12]}', email=f'bench-{uuid.uuid4().hex[:12]}@example.invalid',
+        )
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return user, session
+
+    async def run(self, session_key, options):
+        relay_server = None
+        backend_class = BACKENDS[options['backend']]
+        if backend_class is realtime.RelayBackend:
+            url = options['relay_url']
+            if url is None:
+                relay_server = await realtime.Relay().serve('127.0.0.1', 0)
+                url = 'tcp://127.0.0.1:%d' % relay_server.sockets[0].getsockname()[1]
+            backend = backend_class(url)
+        else:
+            backend = backend_class()
+        realtime._hub = realtime.Hub(backend, options['queue_size'])
+
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+        clients = [SimulatedClient(cookie) for _ in range(options['clients'])]
+        slow = [SimulatedClient(cookie, read_delay=0.05) for _ in range(options['slow'])]
+        everyone = clients + slow
+        tasks = [asyncio.create_task(streams.chat_socket(c.scope, c.receive, c.send)) for c in everyone]
+        while realtime._hub.subscriber_count < len(everyone):
+            await asyncio.sleep(0.01)
+        if backend_class is realtime.RelayBackend:
+            await backend.connected.wait()
+
+        run_id = uuid.uuid4().hex[:8]
+        sent_at = {}
+        senders = clients[:max(1, min(options['senders'], len(clients)))]
+        started = time.perf_counter()
+        for n in range(options['messages']):
+            for i, sender in enumerate(senders):
+                text = f'bench {run_id} {i}:{n}'
+                sent_at[text] = time.perf_counter()
+                sender.say(text)
+            # Let the socket handlers pick the messages up
+            await asyncio.sleep(0)
+
+        deadline = time.perf_counter() + options['timeout']
+        while time.perf_counter() < deadline:
+            if all(len(c.received) >= len(sent_at) for c in clients):
+                break
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        for client in everyone:
+            client.disconnect()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        realtime._hub = None
+        if relay_server is not None:
+            relay_server.close()
+            await relay_server.wait_closed()
+
+        latencies = [
+            received - sent_at[text]
+            for client in clients
+            for text, received in client.received.items()
+            if text in sent_at
+        ]
+        return {
+            'sent': len(sent_at),
+            'expected': len(sent_at) * len(clients),
+            'delivered': len(latencies),
+            'elapsed': elapsed,
+            'latencies': sorted(latencies),
+            'slow_disconnected': sum(1 for c in slow if c.closed_code == streams.SLOW_CONSUMER_CLOSE_CODE),
+            'slow': len(slow),
+        }
+
+    def report(self, results, options):
+        latencies = results['latencies']
+        self.stdout.write(
+            f"{options['backend']} backend, {options['clients']} clients: "
+            f"{results['delivered']}/{results['expected']} deliveries of {results['sent']} messages "
+            f"in {results['elapsed']:.2f}s"
+        )
+        if latencies:
+            self.stdout.write(
+                f"  throughput {results['sent'] / results['elapsed']:.0f} msg/s in, "
+                f"{results['delivered'] / results['elapsed']:.0f} deliveries/s out"
+            )
+            pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+            self.stdout.write(
+                f"  latency ms: p50 {pct(0.5):.1f}  p95 {pct(0.95):.1f}  p99 {pct(0.99):.1f}  "
+                f"max {latencies[-1] * 1000:.1f}  mean {statistics.mean(latencies) * 1000:.1f}"
+            )
+        if results['slow']:
+            self.stdout.write(
+                f"  slow clients disconnected by backpressure: {results['slow_disconnected']}/{results['slow']}"
+            )
@@ -0,0 +1,72 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from public_site import chat_buffer
+from public_site.models import ChatMessage
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Compare chat posts per second: one INSERT per message vs the write-behind buffer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Messages per run')
+        parser.add_argument('--threads', type=int, default=4, help='Concurrent posters, like request threads')
+        parser.add_argument('--batch-size', type=int, default=200, help='Write-behind flush batch size')
+        parser.add_argument('--interval', type=float, default=0.05, help='Write-behind flush interval in seconds')
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.create_user(
+            username=f'bench-{uuid.uuid4().hex[:12]}', email=f'bench-{uuid.uuid4().hex[:12]}@example.invalid',
+        )
+        try:
+            direct = self.measure(options, lambda text: ChatMessage.objects.create(user=user, message=text))
+            self.report('create() per message', direct, options)
+
+            buffer = chat_buffer.ChatBuffer(
+                max_size=options['messages'], batch_size=options['batch_size'], interval=options['interval'],
+            )
+            buffered = self.measure(options, lambda text: buffer.submit(user, text), finish=buffer.close)
+            self.report('write-behind buffer', buffered, options)
+
+            saved = ChatMessage.objects.filter(user=user).count()
+            if saved != 2 * options['messages']:
+                self.stderr.write(f'Expected {2 * options["messages"]} saved messages, found {saved}')
+            self.stdout.write(f'Speed-up: {direct / buffered:.1f}x')
+        finally:
+            user.delete()
+
+    def measure(self, options, post, finish=None):
+        """Seconds to post every message, including the final flush"""
+        per_thread = options['messages'] // options['threads']
+        extra = options['messages'] - per_thread * options['threads']
+
+        def poster(count):
+            try:
+                for n in range(count):
+                    post(f'Amen {n}')
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=poster, args=(per_thread + (1 if i < extra else 0),))
+            for i in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if finish is not None:
+            finish()
+        return time.perf_counter() - started
+
+    def report(self, label, elapsed, options):
+        self.stdout.write(
+            f"{label}: {options['messages']} messages in {elapsed:.2f}s "
+            f"({options['messages'] / elapsed:.0f} msg/s)"
+        )
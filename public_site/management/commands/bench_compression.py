@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from public_site import compression
+
+MINIFY = 'public_site.middleware.HTMLMinifyMiddleware'
+COMPRESS = 'public_site.middleware.CompressionMiddleware'
+
+
+class Command(BaseCommand):
+    help = (
+        'Render pages as an anonymous visitor and report, per page, what HTML minification and each '
+        'Brotli quality and gzip level save in bytes and cost in CPU time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/', '/gallery/', '/announcements/', '/activities/'])
+        parser.add_argument('--repeat', type=int, default=20, help='Compressions timed per setting')
+
+    def handle(self, *args, **options):
+        settings_in_use = {
+            'br': [1, 4, settings.COMPRESSION_BROTLI_QUALITY, 8, 11] if compression.brotli else [],
+            'gzip': [1, settings.COMPRESSION_GZIP_LEVEL, 9],
+        }
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        middleware = [name for name in settings.MIDDLEWARE if name not in (MINIFY, COMPRESS)]
+        for path in options['paths']:
+            # The page as templates render it, before either middleware
+            with override_settings(MIDDLEWARE=middleware, PAGE_CACHE_TTL=0):
+                response = Client(HTTP_HOST=host).get(path)
+            if response.status_code != 200:
+                raise CommandError(f'{path} answered {response.status_code}')
+            html = response.content.decode(response.charset)
+
+            started = time.thread_time_ns()
+            minified = compression.minify_html(html).encode(response.charset)
+            minify_ms = (time.thread_time_ns() - started) / 1e6
+            self.stdout.write(
+                f'{path}: {len(html.encode()) / 1024:.1f} KB, minified {len(minified) / 1024:.1f} KB '
+                f'in {minify_ms:.2f} ms'
+            )
+            for encoding, levels in settings_in_use.items():
+                for level in levels:
+                    self.report(minified, encoding, level, options['repeat'])
+
+    def report(self, content, encoding, level, repeat):
+        name = 'COMPRESSION_BROTLI_QUALITY' if encoding == 'br' else 'COMPRESSION_GZIP_LEVEL'
+        with override_settings(**{name: level}):
+            cpu_ns = 0
+            for _ in range(repeat):
+                compressed, measurement = compression.compress(content, encoding)
+                cpu_ns += measurement.cpu_ns
+        self.stdout.write(
+            f'  {encoding:<4} {level:>2}  {len(compressed) / 1024:6.1f} KB  ratio {measurement.ratio:.3f}  '
+            f'{cpu_ns / repeat / 1e6:6.2f} ms CPU'
+        )
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.views import static
+
+from public_site import media
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare serving an uploaded file through django.views.static.serve (the old DEBUG-only '
+        'helper) with public_site.media.serve and asgi_serve: requests per second and bytes sent '
+        'per request'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=float, default=4, help='File size in MB')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per scenario')
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp()
+        try:
+            size = int(options['size'] * 1024 * 1024)
+            with open(os.path.join(root, 'photo.jpg'), 'wb') as file:
+                file.write(os.urandom(size))
+            with override_settings(MEDIA_ROOT=root, MEDIA_SERVE_MODE='direct'):
+                self.run_scenarios(root, size, options['requests'])
+        finally:
+            shutil.rmtree(root)
+
+    def run_scenarios(self, root, size, count):
+        factory = RequestFactory()
+        helper = lambda request: static.serve(request, 'photo.jpg', document_root=root)  # noqa: E731
+        view = lambda request: media.serve(request, 'photo.jpg')  # noqa: E731
+
+        first = view(factory.get('/media/photo.jpg'))
+        etag, last_modified = first['ETag'], first['Last-Modified']
+        first.close()
+        scenarios = [
+            ('whole file', {}),
+            ('revisit with validators', {'HTTP_IF_NONE_MATCH': etag, 'HTTP_IF_MODIFIED_SINCE': last_modified}),
+            ('resume: last 64KB', {'HTTP_RANGE': f'bytes={size - 65536}-'}),
+        ]
+        self.stdout.write(f'{size / 1024 / 1024:.1f} MB file, {count} requests per scenario')
+        for label, headers in scenarios:
+            for name, serve in (('static.serve', helper), ('media.serve', view)):
+                rate, sent, status = self.measure(serve, factory, headers, count)
+                self.report(label, name, status, rate, sent)
+            rate, sent, status = self.measure_asgi(headers, count)
+            self.report(label, 'asgi_serve', status, rate, sent)
+        self.stdout.write(
+            'Every body here is read through Python. asgi_serve is what the Procfile runs: uvicorn '
+            'has no zerocopysend, so it sends CHUNK_SIZE pieces read off the event loop. Only '
+            'MEDIA_SERVE_MODE=x-accel-redirect behind nginx takes the bytes off the app servers.'
+        )
+
+    def report(self, label, name, status, rate, sent):
+        self.stdout.write(f'{label:<24} {name:<13} {status}  {rate:8.1f} req/s  {sent / 1024:10.1f} KB/request')
+
+    def measure(self, serve, factory, headers, count):
+        sent = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            response = serve(factory.get('/media/photo.jpg', **headers))
+            status = response.status_code
+            body = response.streaming_content if response.streaming else [response.content]
+            sent += sum(len(chunk) for chunk in body)
+            response.close()
+        elapsed = time.perf_counter() - started
+        return count / elapsed, sent / count, status
+
+    def measure_asgi(self, headers, count):
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/media/photo.jpg',
+            'headers': [
+                (name[5:].replace('_', '-').lower().encode(), value.encode()) for name, value in headers.items()
+            ],
+        }
+        sent = 0
+        status = None
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        async def send(message):
+            nonlocal sent, status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            sent += len(message.get('body', b''))
+
+        started = time.perf_counter()
+        for _ in range(count):
+            async_to_sync(media.asgi_serve)(scope, receive, send)
+        elapsed = time.perf_counter() - started
+        return count / elapsed, sent / count, status
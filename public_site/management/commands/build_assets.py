@@ -0,0 +1,30 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from public_site import bundles
+
+
+class Command(BaseCommand):
+    help = (
+        'Minify the site-wide CSS and JavaScript in public_site/assets/ into static/bundles/. '
+        'collectstatic runs this first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Write nothing; fail if any bundle is out of date with its source')
+
+    def handle(self, *args, **options):
+        results = bundles.build(check=options['check'])
+        if options['verbosity']:
+            for built in results:
+                content = bundles.minify(built.name, (bundles.SOURCE_DIR / built.name).read_text())
+                state = ('out of date' if options['check'] else 'written') if built.changed else 'unchanged'
+                self.stdout.write(
+                    f'{built.name:<14} {built.source_size / 1024:6.1f} KB -> {built.size / 1024:5.1f} KB '
+                    f'({len(gzip.compress(content.encode())) / 1024:.1f} KB gzipped)  {state}'
+                )
+        stale = [built.name for built in results if built.changed]
+        if options['check'] and stale:
+            raise CommandError(f"Out of date: {', '.join(stale)}. Run manage.py build_assets.")
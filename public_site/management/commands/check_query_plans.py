@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from public_site import query_plans
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot view querysets and fail on full scans of large tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows', type=int,
+            default=getattr(settings, 'QUERY_PLAN_MAX_SCAN_ROWS', 1000),
+            help='Only fail for full scans of tables with more rows than this',
+        )
+        parser.add_argument('--show-plans', action='store_true', help='Print every query plan')
+
+    def handle(self, *args, **options):
+        reports = query_plans.check(options['min_rows'])
+        failures = 0
+        for report in reports:
+            if report.ok:
+                status = self.style.SUCCESS('ok')
+                if report.scanned_tables:
+                    status += f" (small full scan: {', '.join(report.scanned_tables)})"
+            else:
+                failures += 1
+                scans = ', '.join(f'{table} ({rows} rows)' for table, rows in report.large_scans.items())
+                status = self.style.ERROR(f'FULL SCAN of {scans}')
+            self.stdout.write(f'{report.label}: {status}')
+            if options['show_plans'] or not report.ok:
+                self.stdout.write('    ' + report.plan.replace('\n', '\n    '))
+
+        if failures:
+            raise CommandError(f'{failures} of {len(reports)} queries scan a table with more than {options["min_rows"]} rows')
+        self.stdout.write(self.style.SUCCESS(f'All {len(reports)} query plans use indexes'))
@@ -0,0 +1,11 @@
+from django.contrib.staticfiles.management.commands import collectstatic
+from django.core.management import call_command
+
+
+class Command(collectstatic.Command):
+    help = collectstatic.Command.help + ' Builds the base.html bundles (build_assets) first.'
+
+    def handle(self, **options):
+        if not options['dry_run']:
+            call_command('build_assets', verbosity=options['verbosity'], stdout=self.stdout)
+        return super().handle(**options)
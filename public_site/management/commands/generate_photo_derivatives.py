@@ -0,0 +1,46 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from public_site import images
+from public_site.models import Photo
+
+
+class Command(BaseCommand):
+    help = 'Write the resized WebP/JPEG copies and placeholders for gallery photos that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes resizing images in parallel (default: one per CPU)')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate photos whose derivatives are already current')
+
+    def handle(self, *args, **options):
+        photos = {
+            photo.pk: photo
+            for photo in Photo.objects.exclude(image='').only('pk', 'image', 'derivatives')
+            if options['force'] or not images.is_current(photo)
+        }
+        if not photos:
+            self.stdout.write('Every photo is up to date')
+            return
+
+        # Workers only read and write files; results are saved from here.
+        # Forked workers must not inherit this process's database connections.
+        connections.close_all()
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=max(1, options['workers']), initializer=django.setup) as pool:
+            futures = {pool.submit(images.render, photo.image.name): pk for pk, photo in photos.items()}
+            for future in as_completed(futures):
+                photo = photos[futures[future]]
+                try:
+                    images.store(photo, future.result())
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{photo.image.name}: {error}')
+                else:
+                    done += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {done} photos, {failed} failed'))
@@ -0,0 +1,117 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from public_site import fragments, images, photo_import
+from public_site.models import Photo
+
+
+class Command(BaseCommand):
+    help = (
+        'Import every image under a directory as gallery photos. Subdirectories become albums; '
+        'files already imported are skipped, so an interrupted import can simply be run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--type', dest='photo_type', required=True, choices=dict(Photo.PHOTO_TYPES))
+        parser.add_argument('--album', help='Album for every photo, instead of the subdirectory names')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes decoding images in parallel (default: one per CPU)')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Photos per INSERT')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['directory']):
+            raise CommandError(f"{options['directory']} is not a directory")
+        files = photo_import.find(options['directory'])
+        albums = dict(files)
+        known = frozenset(Photo.objects.exclude(content_hash='').values_list('content_hash', flat=True))
+        self.stdout.write(f'Found {len(files)} images, {len(known)} photos already imported')
+
+        self.rows, self.prepared, self.imported, self.chunk_size = [], {}, 0, options['chunk_size']
+        # Content hash -> the first copy prepared in this run
+        seen = {}
+        duplicates = invalid = 0
+        started = time.monotonic()
+        # Workers only touch files; rows are saved from here. Forked workers
+        # must not inherit this process's database connections.
+        connections.close_all()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=max(1, options['workers']), initializer=photo_import.init_worker, initargs=(known,),
+            ) as pool:
+                for prepared in pool.map(photo_import.prepare, [path for path, _ in files], chunksize=4):
+                    if prepared.error:
+                        invalid += 1
+                        self.stderr.write(f'{prepared.path}: {prepared.error}')
+                    elif prepared.duplicate:
+                        duplicates += 1
+                    elif prepared.content_hash in seen:
+                        # A second copy within this run. It wrote to the same
+                        # names as the first unless the two raced each other
+                        duplicates += 1
+                        first = seen[prepared.content_hash]
+                        self.discard(prepared, first.name, first.rendered['derivatives'])
+                    else:
+                        seen[prepared.content_hash] = prepared
+                        self.add(prepared, options['photo_type'], options['album'] or albums[prepared.path])
+        finally:
+            # Keep everything finished so far, interrupted or not
+            self.flush()
+            if self.imported:
+                # bulk_create sends no signals
+                fragments.expire_for(Photo)
+
+        elapsed = time.monotonic() - started
+        rate = len(files) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} photos, skipped {duplicates} duplicates and {invalid} invalid files '
+            f'in {elapsed:.1f}s ({rate:.1f} images/s)'
+        ))
+
+    def add(self, prepared, photo_type, album):
+        rendered = prepared.rendered
+        self.rows.append(Photo(
+            title=photo_import.title_for(prepared.path),
+            image=prepared.name,
+            photo_type=photo_type,
+            album=album[:100],
+            width=rendered['width'],
+            height=rendered['height'],
+            derivatives=rendered['derivatives'],
+            placeholder=rendered['placeholder'],
+            content_hash=prepared.content_hash,
+        ))
+        self.prepared[prepared.content_hash] = prepared
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def discard(self, prepared, kept_name, kept_derivatives):
+        """Delete the files ``prepared`` wrote that the photo that was kept doesn't use"""
+        kept = set(images.files(kept_derivatives)) | {kept_name}
+        images.delete_files([
+            name for name in [prepared.name, *images.files(prepared.rendered['derivatives'])]
+            if name not in kept
+        ])
+
+    def flush(self):
+        if not self.rows:
+            return
+        saved = Photo.objects.filter(content_hash__in=[row.content_hash for row in self.rows])
+        with transaction.atomic():
+            before = set(saved.values_list('content_hash', flat=True))
+            # ignore_conflicts: another import may have added the same file meanwhile
+            Photo.objects.bulk_create(self.rows, ignore_conflicts=True)
+            stored = {photo.content_hash: photo for photo in saved.only('content_hash', 'image', 'derivatives')}
+        for row in self.rows:
+            photo = stored[row.content_hash]
+            if row.content_hash in before or (photo.image.name, photo.derivatives) != (row.image.name, row.derivatives):
+                # The other import's row won; keep only the files it uses
+                self.discard(self.prepared[row.content_hash], photo.image.name, photo.derivatives)
+            else:
+                self.imported += 1
+        self.stdout.write(f'  saved {self.imported} photos')
+        self.rows, self.prepared = [], {}
@@ -0,0 +1,79 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from public_site import retention
+
+
+class Command(BaseCommand):
+    help = 'Delete rows that are past their retention period, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'policies', nargs='*', metavar='policy',
+            help='Policies to apply (default: all). Choices: '
+                 + ', '.join(policy.name for policy in retention.POLICIES),
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument('--days', type=int, help='Override the retention period of the selected policies')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument(
+            '--archive-dir',
+            help='Append deleted rows to <policy>-<date>.jsonl.gz files in this directory first',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            policies = retention.get_policies(options['policies'])
+        except KeyError as e:
+            raise CommandError(e.args[0])
+
+        archive_dir = options['archive_dir']
+        if archive_dir and not options['dry_run']:
+            os.makedirs(archive_dir, exist_ok=True)
+
+        now = timezone.now()
+        total_rows = total_bytes = 0
+        for policy in policies:
+            days = options['days'] if options['days'] is not None else retention.retention_days(policy)
+            label = f'{policy.name} ({policy.description} older than {days} days)'
+
+            if options['dry_run']:
+                queryset = policy.queryset(now, days)
+                count = queryset.count()
+                size = count * retention.estimate_row_bytes(queryset) if count else 0
+                total_rows += count
+                total_bytes += size
+                self.stdout.write(f'{label}: {count} rows, ~{format_bytes(size)}')
+                continue
+
+            archive = None
+            if archive_dir:
+                path = os.path.join(archive_dir, f'{policy.name}-{now:%Y%m%d}.jsonl.gz')
+                archive = open(path, 'ab')
+            try:
+                deleted = retention.prune(
+                    policy, days=days, batch_size=options['batch_size'],
+                    pause=options['pause'], archive=archive, now=now,
+                )
+            finally:
+                if archive is not None:
+                    archive.close()
+            total_rows += deleted
+            self.stdout.write(f'{label}: deleted {deleted} rows')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Would delete {total_rows} rows, reclaiming ~{format_bytes(total_bytes)}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Deleted {total_rows} rows'))
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from public_site import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from announcements, activities, blog posts and comments'
+
+    def handle(self, *args, **options):
+        if not search.available():
+            self.stdout.write('This database has no full-text index; search uses icontains filters')
+            return
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} documents'))
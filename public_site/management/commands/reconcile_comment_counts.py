@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from public_site import blog
+
+
+class Command(BaseCommand):
+    help = "Rebuild every blog post's stored comment count and latest comment time"
+
+    def handle(self, *args, **options):
+        drifted = blog.rebuild_comment_counters()
+        self.stdout.write(self.style.SUCCESS(f'Fixed {drifted} blog posts'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from public_site import finance
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly and yearly financial totals from the financial records'
+
+    def handle(self, *args, **options):
+        drifted = finance.rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Fixed {drifted} financial rollups'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from public_site import notifications
+
+
+class Command(BaseCommand):
+    help = "Rebuild every member's stored unread-notification count from scratch"
+
+    def handle(self, *args, **options):
+        drifted = notifications.rebuild_unread_counts()
+        self.stdout.write(self.style.SUCCESS(f'Fixed {drifted} unread counts'))
@@ -0,0 +1,31 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from public_site import realtime
+
+
+class Command(BaseCommand):
+    help = 'Run the TCP relay that shares realtime events between web processes (RelayBackend)'
+
+    def add_arguments(self, parser):
+        host, port = realtime.relay_address()
+        parser.add_argument('--host', default=host, help='Interface to listen on')
+        parser.add_argument('--port', type=int, default=port, help='Port to listen on')
+        parser.add_argument(
+            '--buffer-limit', type=int, default=1024 * 1024,
+            help='Disconnect clients with more than this many bytes waiting to be sent',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self.serve(options['host'], options['port'], options['buffer_limit']))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, host, port, buffer_limit):
+        relay = realtime.Relay(buffer_limit)
+        server = await relay.serve(host, port)
+        self.stdout.write(f'Relay listening on {host}:{port}')
+        async with server:
+            await server.serve_forever()
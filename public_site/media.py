@@ -0,0 +1,302 @@
+"""
+Serving uploaded files from MEDIA_ROOT.
+
+Every response carries a strong ETag (a hash of the file's content, worked
+out once per file version and cached), Last-Modified and Cache-Control.
+Files whose names change whenever their content does (photo derivatives,
+imported photos, avatar variants; see ``MEDIA_IMMUTABLE_PATTERNS``) are
+cacheable for a year. Conditional requests get 304s and single byte ranges
+get 206s, so a dropped download of a large photo resumes where it stopped.
+
+``MEDIA_SERVE_MODE`` picks how the bytes leave:
+
+- ``direct``: from this process. The Procfile runs the ASGI app under
+  uvicorn workers, which don't offer the ``zerocopysend`` extension, so
+  ``asgi_serve()`` reads the file in CHUNK_SIZE pieces off the event loop
+  and every byte passes through Python. It uses ``zerocopysend`` on servers
+  that have it, and ``serve()`` gets ``os.sendfile()`` through
+  ``wsgi.file_wrapper`` under a WSGI server (gunicorn's sync and gthread
+  workers), but neither is the shipped setup.
+- ``x-accel-redirect``: nginx sends the file from an ``internal`` location
+  at ``MEDIA_ACCEL_PREFIX`` that aliases MEDIA_ROOT.
+- ``x-sendfile``: Apache's mod_xsendfile or lighttpd send it by path.
+
+With a fronting server the validators and ranges are its job; this module
+still answers conditional requests itself, before handing over. Behind
+nginx, set ``MEDIA_SERVE_MODE=x-accel-redirect`` to take the bytes off the
+app servers altogether.
+"""
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+MODES = ('direct', 'x-accel-redirect', 'x-sendfile')
+ETAG_KEY = 'media_etag:{}:{}:{}'
+CHUNK_SIZE = 64 * 1024
+ONE_YEAR = 365 * 24 * 60 * 60
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class Unsatisfiable(Exception):
+    """The requested range lies entirely past the end of the file"""
+
+
+@dataclass
+class MediaFile:
+    name: str
+    path: str
+    size: int
+    mtime: int
+    etag: str
+    content_type: str
+
+    @property
+    def immutable(self):
+        patterns = getattr(settings, 'MEDIA_IMMUTABLE_PATTERNS', ())
+        return any(re.search(pattern, self.name) for pattern in patterns)
+
+    @property
+    def cache_control(self):
+        if self.immutable:
+            return f'public, max-age={ONE_YEAR}, immutable'
+        return f"public, max-age={getattr(settings, 'MEDIA_CACHE_SECONDS', 3600)}"
+
+
+@dataclass
+class Reply:
+    status: int
+    headers: dict = field(default_factory=dict)
+    # The bytes to send, for 200 and 206
+    start: int = 0
+    length: int = 0
+
+
+def mode():
+    serve_mode = getattr(settings, 'MEDIA_SERVE_MODE', 'direct')
+    if serve_mode not in MODES:
+        raise ValueError(f"MEDIA_SERVE_MODE must be one of {', '.join(MODES)}, not {serve_mode!r}")
+    return serve_mode
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def locate(name):
+    """The MediaFile for a path under MEDIA_ROOT, or None"""
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, OSError):
+        # Names escaping MEDIA_ROOT are as missing as names that aren't there
+        return None
+    if not os.path.isfile(path):
+        return None
+    key = ETAG_KEY.format(quote(name), stat.st_mtime_ns, stat.st_size)
+    etag = cache.get(key)
+    if etag is None:
+        etag = f'"{content_hash(path)}"'
+        cache.set(key, etag, None)
+    content_type, encoding = mimetypes.guess_type(path)
+    return MediaFile(
+        name, path, stat.st_size, int(stat.st_mtime), etag,
+        'application/octet-stream' if encoding or not content_type else content_type,
+    )
+
+
+def byte_range(header, size):
+    """
+    ``(start, end)``, inclusive, for a single ``Range: bytes=`` header, or
+    None to send the whole file: servers may ignore malformed and
+    multi-range headers. Raises Unsatisfiable past the end.
+    """
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        if int(last) == 0 or size == 0:
+            raise Unsatisfiable()
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise Unsatisfiable()
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def not_modified(media, headers):
+    if_none_match = headers.get('if-none-match')
+    if if_none_match:
+        # Weak comparison, as RFC 9110 asks for If-None-Match
+        etags = [etag.removeprefix('W/') for etag in parse_etags(if_none_match)]
+        return '*' in etags or media.etag in etags
+    modified_since = parse_http_date_safe(headers.get('if-modified-since') or '')
+    return modified_since is not None and media.mtime <= modified_since
+
+
+def range_applies(media, headers):
+    """If-Range: only honour the range while the client's copy is current"""
+    if_range = headers.get('if-range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == media.etag
+    return parse_http_date_safe(if_range) == media.mtime
+
+
+def reply(media, headers, ranges=True):
+    """What to answer for a GET or HEAD of ``media``"""
+    base = {
+        'ETag': media.etag,
+        'Last-Modified': http_date(media.mtime),
+        'Cache-Control': media.cache_control,
+        'X-Content-Type-Options': 'nosniff',
+    }
+    if not_modified(media, headers):
+        return Reply(304, base)
+    base['Content-Type'] = media.content_type
+    if not ranges:
+        return Reply(200, base, 0, media.size)
+
+    base['Accept-Ranges'] = 'bytes'
+    span = None
+    if headers.get('range') and range_applies(media, headers):
+        try:
+            span = byte_range(headers['range'], media.size)
+        except Unsatisfiable:
+            return Reply(416, {**base, 'Content-Range': f'bytes */{media.size}'})
+    if span is None:
+        return Reply(200, {**base, 'Content-Length': str(media.size)}, 0, media.size)
+    start, end = span
+    length = end - start + 1
+    return Reply(206, {
+        **base,
+        'Content-Range': f'bytes {start}-{end}/{media.size}',
+        'Content-Length': str(length),
+    }, start, length)
+
+
+def offload_headers(media, serve_mode):
+    """The header that hands the transfer to a fronting server"""
+    if serve_mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+        return {'X-Accel-Redirect': prefix + quote(media.name)}
+    return {'X-Sendfile': media.path}
+
+
+class FileRange:
+    """
+    ``length`` bytes of ``file`` from ``start``. Keeps fileno() so
+    wsgi.file_wrapper can sendfile() from the current offset, and leaves
+    out seek()/tell() so FileResponse doesn't recount Content-Length.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def serve(request, path):
+    """Django view for everything under MEDIA_URL"""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=405, headers={'Allow': 'GET, HEAD'})
+    media = locate(path)
+    if media is None:
+        raise Http404('No such file')
+    serve_mode = mode()
+    answer = reply(media, request.headers, ranges=serve_mode == 'direct')
+    if answer.status == 304:
+        return HttpResponseNotModified(headers=answer.headers)
+    if answer.status == 416:
+        return HttpResponse(status=416, headers=answer.headers)
+    if serve_mode != 'direct':
+        headers = {**answer.headers, **offload_headers(media, serve_mode)}
+        headers.pop('Content-Length', None)
+        return HttpResponse(headers=headers)
+
+    response = FileResponse(
+        FileRange(open(media.path, 'rb'), answer.start, answer.length),
+        status=answer.status, content_type=media.content_type,
+    )
+    # Fewer, larger reads when the body does go through Python
+    response.block_size = CHUNK_SIZE
+    for header, value in answer.headers.items():
+        response[header] = value
+    return response
+
+
+async def asgi_serve(scope, receive, send):
+    """The same as serve(), as a plain ASGI app that keeps media off Django's threads"""
+    name = scope['path'][len(settings.MEDIA_URL):]
+    if scope['method'] not in ('GET', 'HEAD'):
+        return await _send_empty(send, 405, {'Allow': 'GET, HEAD'})
+    media = await asyncio.to_thread(locate, name)
+    if media is None:
+        return await _send_empty(send, 404, {'Content-Type': 'text/plain'}, b'Not found')
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope.get('headers', ())}
+    serve_mode = mode()
+    answer = reply(media, headers, ranges=serve_mode == 'direct')
+    if answer.status in (304, 416):
+        return await _send_empty(send, answer.status, answer.headers)
+    if serve_mode != 'direct':
+        out = {**answer.headers, **offload_headers(media, serve_mode), 'Content-Length': '0'}
+        return await _send_empty(send, 200, out)
+
+    await send({'type': 'http.response.start', 'status': answer.status, 'headers': _encode(answer.headers)})
+    if scope['method'] == 'HEAD' or not answer.length:
+        return await send({'type': 'http.response.body', 'body': b''})
+    with open(media.path, 'rb') as file:
+        if 'http.response.zerocopysend' in scope.get('extensions', {}):
+            return await send({
+                'type': 'http.response.zerocopysend', 'file': file, 'offset': answer.start, 'count': answer.length,
+            })
+        offset, end = answer.start, answer.start + answer.length
+        while offset < end:
+            chunk = await asyncio.to_thread(os.pread, file.fileno(), min(CHUNK_SIZE, end - offset), offset)
+            if not chunk:
+                # Truncated while we were sending; the client sees a short body
+                break
+            offset += len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': offset < end})
+    if offset < end:
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def _encode(headers):
+    return [(key.lower().encode('latin-1'), str(value).encode('latin-1')) for key, value in headers.items()]
+
+
+async def _send_empty(send, status, headers, body=b''):
+    await send({'type': 'http.response.start', 'status': status, 'headers': _encode(headers)})
+    await send({'type': 'http.response.body', 'body': body})
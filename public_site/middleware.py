@@ -0,0 +1,213 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+
+from . import bundles, compression, fragments
+
+# URL name -> the fragment sections (and so the models) a page is built from
+CACHED_PAGES = {
+    'home': ('photos', 'announcements', 'activities', 'financial'),
+    'gallery': ('photos',),
+    'announcements': ('announcements',),
+    'activities': ('activities',),
+}
+
+# Cookies that can make a page personal; requests carrying none of them
+# are anonymous and share one cached copy
+PERSONAL_COOKIES = (settings.SESSION_COOKIE_NAME, 'messages')
+
+
+def page_key(host, path, encoding='identity'):
+    return 'page:' + hashlib.md5(f'{host}{path}'.encode(), usedforsecurity=False).hexdigest() + f':{encoding}'
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Whole-response cache for public pages requested without a session.
+
+    Entries remember the version stamps of the sections they were built from
+    (see fragments.py), so saving a model makes every page showing it stale.
+    Stale entries are served with stale-while-revalidate semantics: the
+    first request to notice takes a short lock and re-renders the page while
+    concurrent requests keep getting the stale copy. Cached copies answer
+    conditional requests from the ETag and Last-Modified the view set (see
+    conditional.py). Responses carry ``X-Page-Cache: HIT``, ``STALE`` or
+    ``MISS``.
+
+    Sits above CompressionMiddleware and keeps one entry per content
+    encoding the client would get, so a page is compressed once per
+    version and encoding rather than on every hit.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        ttl = getattr(settings, 'PAGE_CACHE_TTL', 300)
+        sections = self.cached_sections(request) if ttl else None
+        if sections is None:
+            return self.get_response(request)
+
+        encoding = compression.choose_encoding(request.headers.get('Accept-Encoding', '')) or 'identity'
+        key = page_key(request.get_host(), request.get_full_path(), encoding)
+        # A deploy that changes the bundles makes every cached page stale too
+        versions = [fragments.versions(sections), bundles.fingerprint()]
+        entry = cache.get(key)
+        if entry is not None:
+            if entry['versions'] == versions and time.time() - entry['created'] < ttl:
+                return self.replay(request, entry, 'HIT')
+            if not cache.add(f'{key}:refreshing', 1, getattr(settings, 'PAGE_CACHE_LOCK_TIMEOUT', 30)):
+                return self.replay(request, entry, 'STALE')
+
+        try:
+            response = self.get_response(request)
+            patch_vary_headers(response, ['Cookie'])
+            if self.cacheable(response):
+                cache.set(key, {
+                    'content': response.content,
+                    'status': response.status_code,
+                    # Server-Timing measured this render, not later replays
+                    'headers': [(header, value) for header, value in response.items() if header != 'Server-Timing'],
+                    'created': time.time(),
+                    'versions': versions,
+                }, ttl + getattr(settings, 'PAGE_CACHE_STALE_TTL', 86400))
+        finally:
+            if entry is not None:
+                cache.delete(f'{key}:refreshing')
+        response['X-Page-Cache'] = 'MISS'
+        return response
+
+    def cached_sections(self, request):
+        if request.method != 'GET' or any(name in request.COOKIES for name in PERSONAL_COOKIES):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return CACHED_PAGES.get(match.url_name)
+
+    @staticmethod
+    def cacheable(response):
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not response.has_header('Set-Cookie')
+            and 'private' not in response.get('Cache-Control', '')
+            and 'no-store' not in response.get('Cache-Control', '')
+        )
+
+    @staticmethod
+    def replay(request, entry, state):
+        response = HttpResponse(entry['content'], status=entry['status'])
+        for header, value in entry['headers']:
+            response[header] = value
+        # The stored validators answer conditional requests, as the view would
+        last_modified = response.get('Last-Modified')
+        response = get_conditional_response(
+            request,
+            etag=response.get('ETag'),
+            last_modified=parse_http_date_safe(last_modified) if last_modified else None,
+            response=response,
+        )
+        response['X-Page-Cache'] = state
+        return response
+
+
+class HTMLMinifyMiddleware:
+    """
+    Collapses the whitespace templates leave in HTML pages (see
+    compression.minify_html). Sits below AnonymousPageCacheMiddleware so
+    cached pages are stored minified.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or not response.get('Content-Type', '').startswith('text/html')
+        ):
+            return response
+        charset = response.charset
+        response.content = compression.minify_html(response.content.decode(charset)).encode(charset)
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = str(len(response.content))
+        return response
+
+
+class CompressionMiddleware:
+    """
+    Brotli or gzip for dynamic responses, as Accept-Encoding allows.
+
+    Skips bodies under COMPRESSION_MIN_SIZE, types that are compressed
+    already, partial content and file downloads (media.serve sends those
+    with sendfile). Streaming responses are compressed chunk by chunk.
+    Buffered responses get a ``Server-Timing: compress`` entry with their
+    sizes and CPU time; every compressed response is logged (see
+    compression.py). Pages cached by AnonymousPageCacheMiddleware, which
+    sits above, are stored as this compressed them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.candidate(response):
+            return response
+        patch_vary_headers(response, ['Accept-Encoding'])
+        encoding = compression.choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        path = request.path
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compression.acompress_stream(
+                    response.streaming_content, encoding, lambda measurement: measurement.log(path),
+                )
+            else:
+                response.streaming_content = compression.compress_stream(
+                    response.streaming_content, encoding, lambda measurement: measurement.log(path),
+                )
+            del response['Content-Length']
+        else:
+            if len(response.content) < compression.min_size():
+                return response
+            compressed, measurement = compression.compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+            response['Server-Timing'] = ', '.join(
+                filter(None, [response.get('Server-Timing'), measurement.server_timing])
+            )
+            measurement.log(path)
+
+        # The bytes differ from the identity encoding's, as a strong ETag promises
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def candidate(response):
+        return (
+            response.status_code not in (204, 206, 304)
+            and not isinstance(response, FileResponse)
+            and not response.has_header('Content-Encoding')
+            and 'no-transform' not in response.get('Cache-Control', '')
+            and compression.compressible(response.get('Content-Type', ''))
+            and response.get('Content-Type', '').split(';')[0].strip() != 'text/event-stream'
+        )
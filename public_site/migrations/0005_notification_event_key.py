@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0004_alter_financialrecord_options'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='event_key',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('event_key', ''), _negated=True), fields=('user', 'event_key'), name='unique_notification_per_user_event'),
+        ),
+    ]
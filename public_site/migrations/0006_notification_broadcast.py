@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0005_notification_event_key'),
+        ('users', '0003_alter_customuser_last_activity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationReadState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True)),
+                ('read_ids', models.JSONField(blank=True, default=list)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='actor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True), models.Q(('event_key', ''), _negated=True)), fields=('event_key',), name='unique_broadcast_per_event'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:41
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_unread_counts(apps, schema_editor):
+    Notification = apps.get_model('public_site', 'Notification')
+    NotificationReadState = apps.get_model('public_site', 'NotificationReadState')
+    counts = (
+        Notification.objects.filter(user__isnull=False, is_read=False)
+        .order_by().values_list('user').annotate(total=Count('id'))
+    )
+    states = [NotificationReadState(user_id=user_id, unread_count=total) for user_id, total in counts]
+    NotificationReadState.objects.bulk_create(
+        states,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['unread_count'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0006_notification_broadcast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationreadstate',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0007_notificationreadstate_unread_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['-date'], name='activity_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-date'], name='announcement_active_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blogpost',
+            index=models.Index(fields=['-date', '-id'], name='blogpost_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['timestamp', 'id'], name='chatmessage_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'date'], name='comment_post_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='financialrecord',
+            index=models.Index(fields=['-record_date'], name='financialrecord_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', '-created_at'], name='notification_user_read_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['-created_at'], name='notification_broadcast_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['photo_type', '-upload_date'], name='photo_type_date_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:26
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def backfill_comment_counters(apps, schema_editor):
+    BlogPost = apps.get_model('public_site', 'BlogPost')
+    Comment = apps.get_model('public_site', 'Comment')
+    stats = (
+        Comment.objects.order_by().values_list('post')
+        .annotate(total=Count('id'), latest=Max('date'))
+    )
+    posts = [BlogPost(pk=post_id, comment_count=total, last_commented_at=latest) for post_id, total, latest in stats]
+    BlogPost.objects.bulk_update(posts, ['comment_count', 'last_commented_at'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0008_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogpost',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blogpost',
+            name='last_commented_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_comment_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='blogpost',
+            index=models.Index(fields=['-last_commented_at', '-id'], name='blogpost_last_commented_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blogpost',
+            index=models.Index(fields=['-comment_count', '-id'], name='blogpost_comment_count_idx'),
+        ),
+    ]
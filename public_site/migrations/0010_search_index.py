@@ -0,0 +1,59 @@
+# Full-text index for public_site/search.py. Written by hand: the table is
+# vendor-specific DDL rather than a model.
+
+from django.db import migrations
+
+SOURCES = [
+    ('announcement', 'public_site_announcement', 'title', 'content'),
+    ('activity', 'public_site_activity', 'title', 'description'),
+    ('blog', 'public_site_blogpost', 'title', 'content'),
+    ('comment', 'public_site_comment', "''", 'content'),
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE public_site_search USING fts5("
+            "title, body, kind UNINDEXED, object_id UNINDEXED, "
+            "tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE public_site_search ("
+            "kind varchar(20) NOT NULL, "
+            "object_id bigint NOT NULL, "
+            "title text NOT NULL, "
+            "body text NOT NULL, "
+            "document tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', title), 'A') || "
+            "setweight(to_tsvector('english', body), 'B')) STORED, "
+            "PRIMARY KEY (kind, object_id))"
+        )
+        schema_editor.execute("CREATE INDEX public_site_search_document_idx ON public_site_search USING gin (document)")
+    else:
+        return
+
+    for kind, table, title, body in SOURCES:
+        schema_editor.execute(
+            f"INSERT INTO public_site_search (kind, object_id, title, body) "
+            f"SELECT %s, id, {title}, {body} FROM {table}",
+            [kind],
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS public_site_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0009_blogpost_comment_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='derivatives',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='height',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0011_photo_derivatives'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='photo',
+            name='photo_type_date_idx',
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='album',
+            field=models.CharField(blank=True, help_text='Groups photos from one trip or event', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['photo_type', '-upload_date', '-id'], name='photo_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['photo_type', 'album', '-upload_date', '-id'], name='photo_album_date_idx'),
+        ),
+    ]
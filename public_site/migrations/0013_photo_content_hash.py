@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0012_photo_album'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='photo',
+            constraint=models.UniqueConstraint(condition=models.Q(('content_hash', ''), _negated=True), fields=('content_hash',), name='photo_unique_content_hash'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:01
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth, TruncYear
+
+
+def backfill_financial_rollups(apps, schema_editor):
+    FinancialRecord = apps.get_model('public_site', 'FinancialRecord')
+    FinancialRollup = apps.get_model('public_site', 'FinancialRollup')
+    rollups = []
+    for period, truncate in (('month', TruncMonth), ('year', TruncYear)):
+        totals = (
+            FinancialRecord.objects.order_by()
+            .annotate(start=truncate('record_date')).values('start')
+            .annotate(
+                record_count=Count('id'), offering=Sum('offering'),
+                donations=Sum('donations'), expenses=Sum('expenses'),
+            )
+        )
+        for row in totals:
+            amounts = {name: row[name] or Decimal('0') for name in ('offering', 'donations', 'expenses')}
+            rollups.append(FinancialRollup(
+                period=period, start=row['start'], record_count=row['record_count'],
+                net=amounts['offering'] + amounts['donations'] - amounts['expenses'], **amounts,
+            ))
+    FinancialRollup.objects.bulk_create(rollups, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0013_photo_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinancialRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('month', 'Month'), ('year', 'Year')], max_length=5)),
+                ('start', models.DateField()),
+                ('offering', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('donations', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expenses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('net', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('record_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['period', 'start'],
+                'constraints': [models.UniqueConstraint(fields=('period', 'start'), name='financialrollup_period_start')],
+            },
+        ),
+        migrations.RunPython(backfill_financial_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0014_financial_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notification_broadcast_idx',
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='notification_user_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['user', '-created_at'], name='notification_broadcast_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Renumbers the SQLite search index so each row's rowid encodes its kind and
+# object id (see public_site/search.py). Written by hand like 0010; Postgres
+# already has a primary key on (kind, object_id).
+
+from django.db import migrations
+
+KIND_CODES = {'announcement': 1, 'activity': 2, 'blog': 3, 'comment': 4}
+ROWID_KINDS = 8
+
+
+def renumber_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    code = ' '.join(f"WHEN '{kind}' THEN {number}" for kind, number in KIND_CODES.items())
+    schema_editor.execute(
+        "CREATE TEMP TABLE public_site_search_renumbered AS "
+        f"SELECT object_id * {ROWID_KINDS} + CASE kind {code} END AS id, kind, object_id, title, body "
+        "FROM public_site_search"
+    )
+    schema_editor.execute("DELETE FROM public_site_search")
+    schema_editor.execute(
+        "INSERT INTO public_site_search (rowid, kind, object_id, title, body) "
+        "SELECT id, kind, object_id, title, body FROM public_site_search_renumbered"
+    )
+    schema_editor.execute("DROP TABLE public_site_search_renumbered")
+    schema_editor.execute("INSERT INTO public_site_search(public_site_search) VALUES ('optimize')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0015_notification_unread_indexes'),
+    ]
+
+    operations = [
+        # Old code never looks at rowids, so going back needs nothing
+        migrations.RunPython(renumber_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:32
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_section_versions(apps, schema_editor):
+    SectionVersion = apps.get_model('public_site', 'SectionVersion')
+    now = timezone.now()
+    SectionVersion.objects.bulk_create([
+        SectionVersion(section=section, changed_at=now)
+        for section in ('announcements', 'activities', 'financial', 'photos')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('public_site', '0016_search_rowids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SectionVersion',
+            fields=[
+                ('section', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('changed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(create_section_versions, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,4 @@
 from django.db import models
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.utils import timezone
 from users.models import CustomUser
 
 
@@ -13,34 +10,20 @@ class Announcement(models.Model):
     date = models.DateField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
     
-    def save(self, *args, **kwargs):
-        is_new = self.pk is None  # Check if this is a new announcement
-        super().save(*args, **kwargs)
-        
-        # Create notification for new announcements
-        if is_new and self.is_active:
-            self.create_notification()
-
     def create_notification(self):
-        # Create notifications for all users except the author
-        try:
-            # Create notifications for all active users except the author
-            users = CustomUser.objects.filter(is_active=True).exclude(id=self.author.id)
-            for user in users:
-                Notification.objects.create(
-                    user=user,
-                    title='📢 New Announcement',
-                    message=f'{self.author.get_full_name()} posted: {self.title}',
-                    notification_type='announcement'
-                )
-            print(f"Created notifications for {users.count()} users")  # Debug
-        except Exception as e:
-            print(f"Error creating announcement notifications: {e}")
-
+        """Notify every active member except the author"""
+        from .notifications import notify_announcement
+        return notify_announcement(self)
     
     def __str__(self):
         return self.title
 
+    class Meta:
+        indexes = [
+            # Partial, because SQLite can't use "WHERE is_active" as an index equality
+            models.Index(fields=['-date'], condition=models.Q(is_active=True), name='announcement_active_date_idx'),
+        ]
+
 class Activity(models.Model):
     ACTIVITY_TYPES = [
         ('ongoing', 'Ongoing'),
@@ -54,65 +37,43 @@ class Activity(models.Model):
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
     
-    def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
-        
-        # Create notification for new activities
-        if is_new:
-            self.create_notification()
-
     def create_notification(self):
-        try:
-            users = CustomUser.objects.filter(is_active=True)
-            activity_type_display = self.get_activity_type_display()
-            
-            for user in users:
-                Notification.objects.create(
-                    user=user,
-                    title='📅 New Activity',
-                    message=f'New {activity_type_display.lower()}: {self.title}',
-                    notification_type='activity'
-                )
-            print(f"Created activity notifications for {users.count()} users")  # Debug
-        except Exception as e:
-            print(f"Error creating activity notifications: {e}")
+        """Notify every active member"""
+        from .notifications import notify_activity
+        return notify_activity(self)
     
     def __str__(self):
         return self.title
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date'], name='activity_date_idx'),
+        ]
+
 class BlogPost(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     author = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     date = models.DateField(auto_now_add=True)
+    # Kept up to date by public_site/blog.py as comments come and go
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    last_commented_at = models.DateTimeField(null=True, blank=True, editable=False)
     
-    def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
-        
-        # Create notification for new blog posts
-        if is_new:
-            self.create_notification()
-
     def create_notification(self):
-        try:
-            users = CustomUser.objects.filter(is_active=True).exclude(id=self.author.id)
-            for user in users:
-                Notification.objects.create(
-                    user=user,
-                    title='📝 New Blog Post',
-                    message=f'{self.author.get_full_name()} published: {self.title}',
-                    notification_type='blog'
-                )
-            print(f"Created blog notifications for {users.count()} users")  # Debug
-        except Exception as e:
-            print(f"Error creating blog notifications: {e}")
+        """Notify every active member except the author"""
+        from .notifications import notify_blog_post
+        return notify_blog_post(self)
     
     def __str__(self):
         return self.title
-    
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='blogpost_date_idx'),
+            models.Index(fields=['-last_commented_at', '-id'], name='blogpost_last_commented_idx'),
+            models.Index(fields=['-comment_count', '-id'], name='blogpost_comment_count_idx'),
+        ]
+
 
 class Comment(models.Model):
     post = models.ForeignKey(BlogPost, on_delete=models.CASCADE, related_name='comments')
@@ -123,6 +84,11 @@ class Comment(models.Model):
     def __str__(self):
         return f"Comment by {self.author} on {self.post}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'date'], name='comment_post_date_idx'),
+        ]
+
 class ChatMessage(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     message = models.TextField()
@@ -131,6 +97,11 @@ class ChatMessage(models.Model):
     def __str__(self):
         return f"{self.user}: {self.message[:50]}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='chatmessage_timestamp_idx'),
+        ]
+
 class Photo(models.Model):
     PHOTO_TYPES = [
         ('church', 'Church Photo'),
@@ -140,12 +111,31 @@ class Photo(models.Model):
     title = models.CharField(max_length=200)
     image = models.ImageField(upload_to='gallery/')
     photo_type = models.CharField(max_length=20, choices=PHOTO_TYPES)
+    album = models.CharField(max_length=100, blank=True, help_text='Groups photos from one trip or event')
     description = models.TextField(blank=True)
     upload_date = models.DateTimeField(auto_now_add=True)
+    # Filled in by public_site.images once the resized copies are written
+    width = models.PositiveIntegerField(null=True, editable=False)
+    height = models.PositiveIntegerField(null=True, editable=False)
+    derivatives = models.JSONField(default=dict, editable=False)
+    placeholder = models.TextField(blank=True, editable=False)
+    # SHA-256 of the original file, for photos added by manage.py import_photos
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
     
     def __str__(self):
         return self.title
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['photo_type', '-upload_date', '-id'], name='photo_type_date_idx'),
+            models.Index(fields=['photo_type', 'album', '-upload_date', '-id'], name='photo_album_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_hash'], condition=~models.Q(content_hash=''), name='photo_unique_content_hash',
+            ),
+        ]
+
 class FinancialRecord(models.Model):
     offering = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     donations = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -161,14 +151,102 @@ class FinancialRecord(models.Model):
     
     class Meta:
         ordering = ['-record_date']
-    
+        indexes = [
+            models.Index(fields=['-record_date'], name='financialrecord_date_idx'),
+        ]
+
+
+class FinancialRollup(models.Model):
+    """
+    Financial record totals per calendar month and year.
+
+    Kept in step with FinancialRecord by the finance service (wired to its
+    save and delete signals); reconcile_financial_rollups rebuilds it.
+    ``start`` is the first day of the period.
+    """
+    PERIODS = (
+        ('month', 'Month'),
+        ('year', 'Year'),
+    )
+
+    period = models.CharField(max_length=5, choices=PERIODS)
+    start = models.DateField()
+    offering = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    donations = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    record_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Financial {self.period} from {self.start}"
+
+    class Meta:
+        ordering = ['period', 'start']
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'start'], name='financialrollup_period_start'),
+        ]
+
+
+class SectionVersion(models.Model):
+    """
+    Database copy of a page section's version stamp (see fragments.py).
+
+    Every process and the jobs worker bump the same row, so validators built
+    from it (conditional.py) agree across web workers whatever cache each
+    one has.
+    """
+    section = models.CharField(max_length=30, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.section} v{self.version}"
+
     
 class NotificationManager(models.Manager):
-    def unread(self):
-        return self.filter(is_read=False)
+    """
+    ``unread()`` and ``read()`` resolve broadcast rows (``user=None``) against
+    the member's NotificationReadState. They apply to the member passed in
+    or, when called through ``user.notification_set``, to that member.
+    """
+    def _member(self, user):
+        user = user if user is not None else getattr(self, 'instance', None)
+        return user if isinstance(user, CustomUser) else None
+
+    def _broadcasts_for(self, user):
+        return models.Q(user__isnull=True, created_at__gte=user.date_joined) & ~models.Q(actor=user)
+
+    def visible_to(self, user):
+        """Personal notifications plus broadcasts sent since the member joined"""
+        return self.model.objects.filter(models.Q(user=user) | self._broadcasts_for(user))
+
+    def unread_personal(self, user):
+        """The member's own unread rows, newest first, off notification_user_read_idx"""
+        return self.filter(user=user, is_read=False).order_by('-created_at')
+
+    def unread_broadcasts(self, user):
+        """Broadcasts the member hasn't read, newest first, off notification_broadcast_idx"""
+        state = NotificationReadState.for_user(user)
+        return self.filter(self._broadcasts_for(user) & state.unread_broadcasts_q()).order_by('-created_at')
+
+    def unread(self, user=None):
+        user = self._member(user)
+        if user is None:
+            return self.filter(is_read=False)
+        state = NotificationReadState.for_user(user)
+        return self.visible_to(user).filter(
+            models.Q(user=user, is_read=False) | state.unread_broadcasts_q()
+        )
     
-    def read(self):
-        return self.filter(is_read=True)
+    def read(self, user=None):
+        user = self._member(user)
+        if user is None:
+            return self.filter(is_read=True)
+        state = NotificationReadState.for_user(user)
+        return self.visible_to(user).filter(
+            models.Q(user=user, is_read=True) | state.read_broadcasts_q()
+        )
+
 class Notification(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True)
     title = models.CharField(max_length=200)
@@ -176,6 +254,10 @@ class Notification(models.Model):
     notification_type = models.CharField(max_length=50)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Identifies the source event, e.g. "announcement:12"
+    event_key = models.CharField(max_length=100, blank=True, default='')
+    # Member who triggered a broadcast; they don't see their own broadcasts
+    actor = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     
     objects = NotificationManager()
     
@@ -184,84 +266,77 @@ class Notification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
-        
-        
-    @receiver(post_save, sender=FinancialRecord)
-    def create_financial_notification(sender, instance, created, **kwargs):
-        """
-        Create notifications when new financial records are added
-        Only create notifications for significant updates (not every small change)
-        """
-        if created:
-            try:
-                # Only notify if the amounts are significant (more than 1000 KSh)
-                total_amount = instance.offering + instance.donations
-                if total_amount > 1000:
-                    users = CustomUser.objects.filter(is_active=True)
-                    for user in users:
-                        Notification.objects.create(
-                            user=user,
-                            title='💰 Financial Update',
-                            message=f'New financial records updated: Offering KSh {instance.offering:,}, Donations KSh {instance.donations:,}',
-                            notification_type='financial'
-                        )
-                    print(f"Created financial notifications for {users.count()} users")
-            except Exception as e:
-                print(f"Error creating financial notifications: {e}")
-
-    # Signals for other models
-    @receiver(post_save, sender=Announcement)
-    def create_announcement_notification(sender, instance, created, **kwargs):
-        """Create notifications when new announcements are posted"""
-        if created and instance.is_active:
-            try:
-                users = CustomUser.objects.filter(is_active=True).exclude(id=instance.author.id)
-                for user in users:
-                    Notification.objects.create(
-                        user=user,
-                        title='📢 New Announcement',
-                        message=f'{instance.author.get_full_name()} posted: {instance.title}',
-                        notification_type='announcement'
-                    )
-                print(f"Created announcement notifications for {users.count()} users")
-            except Exception as e:
-                print(f"Error creating announcement notifications: {e}")
-
-    @receiver(post_save, sender=Activity)
-    def create_activity_notification(sender, instance, created, **kwargs):
-        """Create notifications when new activities are added"""
-        if created:
-            try:
-                users = CustomUser.objects.filter(is_active=True)
-                activity_type_display = instance.get_activity_type_display()
-                
-                for user in users:
-                    Notification.objects.create(
-                        user=user,
-                        title='📅 New Activity',
-                        message=f'New {activity_type_display.lower()}: {instance.title}',
-                        notification_type='activity'
-                    )
-                print(f"Created activity notifications for {users.count()} users")
-            except Exception as e:
-                print(f"Error creating activity notifications: {e}")
-
-    @receiver(post_save, sender=BlogPost)
-    def create_blog_notification(sender, instance, created, **kwargs):
-        """Create notifications when new blog posts are published"""
-        if created:
-            try:
-                users = CustomUser.objects.filter(is_active=True).exclude(id=instance.author.id)
-                for user in users:
-                    Notification.objects.create(
-                        user=user,
-                        title='📝 New Blog Post',
-                        message=f'{instance.author.get_full_name()} published: {instance.title}',
-                        notification_type='blog'
-                    )
-                print(f"Created blog notifications for {users.count()} users")
-            except Exception as e:
-                print(f"Error creating blog notifications: {e}")
-        
-        def __str__(self):
-            return self.title
+        indexes = [
+            # A member's unread/read notifications, newest first
+            models.Index(fields=['user', 'is_read', '-created_at'], name='notification_user_read_idx'),
+            # The same for unread rows on SQLite, which can't use "NOT is_read"
+            # as an index equality and would otherwise sort them for the bell
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=models.Q(is_read=False),
+                name='notification_user_unread_idx',
+            ),
+            # Broadcasts newer than a member's read cursor. The always-NULL
+            # user column lets SQLite match "user_id IS NULL" here rather than
+            # on the foreign key's index, which would leave the rows to sort
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=models.Q(user__isnull=True),
+                name='notification_broadcast_idx',
+            ),
+        ]
+        constraints = [
+            # One notification per member per event, see notifications.fan_out
+            models.UniqueConstraint(
+                fields=['user', 'event_key'],
+                condition=~models.Q(event_key=''),
+                name='unique_notification_per_user_event',
+            ),
+            models.UniqueConstraint(
+                fields=['event_key'],
+                condition=models.Q(user__isnull=True) & ~models.Q(event_key=''),
+                name='unique_broadcast_per_event',
+            ),
+        ]
+
+
+class NotificationReadState(models.Model):
+    """
+    Per-member notification state.
+
+    ``unread_count`` is a denormalized count of the member's own unread rows,
+    kept in step by the notifications service (reconcile_notification_counts
+    rebuilds it). For broadcast notifications everything created up to
+    ``last_seen_at`` is read, plus the ids in ``read_ids`` that were opened
+    individually after that.
+    """
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='notification_state')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+    read_ids = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return f"Notification state - {self.user.email}"
+
+    @classmethod
+    def for_user(cls, user):
+        """Return the member's state, cached on the user for the request"""
+        state = getattr(user, '_notification_state', None)
+        if state is None:
+            state = cls.objects.filter(user=user).first() or cls(user=user)
+            user._notification_state = state
+        return state
+
+    def unread_broadcasts_q(self):
+        q = models.Q(user__isnull=True)
+        if self.last_seen_at:
+            q &= models.Q(created_at__gt=self.last_seen_at)
+        if self.read_ids:
+            q &= ~models.Q(pk__in=self.read_ids)
+        return q
+
+    def read_broadcasts_q(self):
+        seen = models.Q(pk__in=self.read_ids)
+        if self.last_seen_at:
+            seen |= models.Q(created_at__lte=self.last_seen_at)
+        return models.Q(user__isnull=True) & seen
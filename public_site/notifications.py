@@ -0,0 +1,345 @@
+"""
+Notification fan-out service.
+
+Every new Announcement, Activity, BlogPost and FinancialRecord goes through
+``fan_out`` so members get exactly one notification per event, written with
+chunked bulk inserts instead of one INSERT per member.
+
+With ``NOTIFICATION_DELIVERY = 'broadcast'`` an event is stored as a single
+``Notification`` with ``user=None`` instead, and each member's read state
+lives in ``NotificationReadState``.
+
+Everything that changes a member's unread rows goes through this module so
+``NotificationReadState.unread_count`` stays in step with them.
+"""
+import heapq
+import logging
+import time
+from dataclasses import dataclass
+from functools import partial
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from users.models import CustomUser
+from .models import Notification, NotificationReadState
+from . import realtime
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT statement; SQLite caps bound parameters per query so keep
+# this comfortably below 999 / number-of-columns.
+FAN_OUT_BATCH_SIZE = getattr(settings, 'NOTIFICATION_FAN_OUT_BATCH_SIZE', 500)
+
+DELIVERY_FAN_OUT = 'fanout'
+DELIVERY_BROADCAST = 'broadcast'
+
+
+@dataclass(frozen=True)
+class FanOutResult:
+    event_key: str
+    created: int
+    elapsed: float
+
+    def __str__(self):
+        return f"{self.event_key}: {self.created} notifications in {self.elapsed * 1000:.1f} ms"
+
+
+def fan_out(event_key, title, message, notification_type, exclude_user_id=None,
+            batch_size=FAN_OUT_BATCH_SIZE):
+    """
+    Notify every active member about one event.
+
+    Members that already hold a notification for ``event_key`` are skipped,
+    and the (user, event_key) unique constraint backs that up if two
+    fan-outs for the same event race each other.
+    """
+    if delivery_mode() == DELIVERY_BROADCAST:
+        return broadcast(event_key, title, message, notification_type, exclude_user_id)
+
+    started = time.perf_counter()
+
+    recipients = (
+        CustomUser.objects.filter(is_active=True)
+        .exclude(notification__event_key=event_key)
+        .order_by('pk')
+    )
+    if exclude_user_id is not None:
+        recipients = recipients.exclude(pk=exclude_user_id)
+
+    created = 0
+    batch = []
+    for user_id in recipients.values_list('pk', flat=True).iterator(chunk_size=batch_size):
+        batch.append(Notification(
+            user_id=user_id,
+            title=title,
+            message=message,
+            notification_type=notification_type,
+            event_key=event_key,
+        ))
+        if len(batch) >= batch_size:
+            created += _write_batch(batch)
+            batch = []
+    if batch:
+        created += _write_batch(batch)
+
+    result = FanOutResult(event_key, created, time.perf_counter() - started)
+    logger.info("Notification fan-out %s", result)
+    return result
+
+
+def broadcast(event_key, title, message, notification_type, exclude_user_id=None):
+    """Store one event as a single row visible to every member"""
+    started = time.perf_counter()
+    notification, created = Notification.objects.get_or_create(
+        user=None,
+        event_key=event_key,
+        defaults={
+            'title': title,
+            'message': message,
+            'notification_type': notification_type,
+            'actor_id': exclude_user_id,
+        },
+    )
+    if created:
+        transaction.on_commit(partial(_publish, [notification]))
+    result = FanOutResult(event_key, int(created), time.perf_counter() - started)
+    logger.info("Notification broadcast %s", result)
+    return result
+
+
+def delivery_mode():
+    return getattr(settings, 'NOTIFICATION_DELIVERY', DELIVERY_FAN_OUT)
+
+
+def unread_count(user):
+    """
+    The member's badge count: one primary-key lookup for their own rows, plus
+    a count of unseen broadcasts when broadcast delivery is on.
+    """
+    count = (
+        NotificationReadState.objects.filter(user=user)
+        .values_list('unread_count', flat=True).first()
+    ) or 0
+    if delivery_mode() == DELIVERY_BROADCAST:
+        state = NotificationReadState.for_user(user)
+        count += Notification.objects.visible_to(user).filter(state.unread_broadcasts_q()).count()
+    return count
+
+
+@dataclass
+class Bell:
+    """What the header bell in base.html shows"""
+    count: int
+    items: list
+
+    @property
+    def has_more(self):
+        return self.count > len(self.items)
+
+
+BELL_CACHE_KEY = 'notification_bell:{}'
+
+
+def bell(user, limit=10):
+    """
+    Unread count and newest unread items for ``user``: two queries in fan-out
+    mode (the member's state row and the items), four with broadcasts. With
+    NOTIFICATION_BELL_CACHE_TTL set the result is cached per member.
+    """
+    ttl = getattr(settings, 'NOTIFICATION_BELL_CACHE_TTL', 0)
+    key = BELL_CACHE_KEY.format(user.pk)
+    if ttl:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    count = NotificationReadState.for_user(user).unread_count
+    if delivery_mode() == DELIVERY_BROADCAST:
+        count += Notification.objects.unread_broadcasts(user).count()
+    # Each query walks its own index in order; an OR of the two would sort
+    # all of the member's rows to find the newest
+    newest = heapq.merge(*bell_queries(user, limit), key=attrgetter('created_at'), reverse=True)
+    result = Bell(count=count, items=list(islice(newest, limit)))
+
+    if ttl:
+        cache.set(key, result, ttl)
+    return result
+
+
+def bell_queries(user, limit=10):
+    """The querysets bell() reads its items from, each newest first"""
+    queries = [Notification.objects.unread_personal(user)[:limit]]
+    if delivery_mode() == DELIVERY_BROADCAST:
+        queries.append(Notification.objects.unread_broadcasts(user)[:limit])
+    return queries
+
+
+def forget_bell(user_id):
+    """Called whenever a member's unread set changes"""
+    cache.delete(BELL_CACHE_KEY.format(user_id))
+    # Open notification streams re-send the badge count
+    realtime.publish(f'user:{user_id}', {'type': 'unread'})
+
+
+def adjust_unread_count(user_id, delta):
+    """Add ``delta`` to one member's stored unread count, never going below zero"""
+    if not delta or user_id is None:
+        return
+    if delta > 0:
+        NotificationReadState.objects.get_or_create(user_id=user_id)
+        NotificationReadState.objects.filter(user_id=user_id).update(unread_count=F('unread_count') + delta)
+    else:
+        states = NotificationReadState.objects.filter(user_id=user_id)
+        # Clamp first: the other order would zero a count the subtraction
+        # had just brought below -delta
+        if not states.filter(unread_count__lt=-delta).update(unread_count=0):
+            states.update(unread_count=F('unread_count') + delta)
+
+
+def mark_read(user, notification_id):
+    """Mark one notification read for ``user``; False if they can't see it"""
+    notification = Notification.objects.visible_to(user).filter(pk=notification_id).first()
+    if notification is None:
+        return False
+    if notification.user_id is not None:
+        with transaction.atomic():
+            changed = Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True)
+            adjust_unread_count(user.pk, -changed)
+        forget_bell(user.pk)
+        return True
+
+    state = NotificationReadState.for_user(user)
+    already_seen = state.last_seen_at and notification.created_at <= state.last_seen_at
+    if not already_seen and notification.pk not in state.read_ids:
+        NotificationReadState.objects.get_or_create(user=user)
+        state.read_ids = state.read_ids + [notification.pk]
+        NotificationReadState.objects.filter(user=user).update(read_ids=state.read_ids)
+        forget_bell(user.pk)
+    return True
+
+
+def mark_all_read(user):
+    """Mark every personal and broadcast notification read for ``user``"""
+    now = timezone.now()
+    with transaction.atomic():
+        changed = Notification.objects.filter(user=user, is_read=False).update(is_read=True)
+        # Subtract what was marked rather than writing 0, so a notification
+        # fanned out concurrently stays counted
+        adjust_unread_count(user.pk, -changed)
+        NotificationReadState.objects.update_or_create(
+            user=user,
+            defaults={'last_seen_at': now, 'read_ids': []},
+        )
+    user._notification_state = None
+    forget_bell(user.pk)
+
+
+def rebuild_unread_counts(batch_size=FAN_OUT_BATCH_SIZE):
+    """
+    Recompute every member's unread count from the notifications table.
+    Returns the number of members whose stored count was wrong.
+    """
+    counts = dict(
+        Notification.objects.filter(user__isnull=False, is_read=False)
+        .order_by().values_list('user').annotate(total=Count('id'))
+    )
+    with transaction.atomic():
+        missing = set(counts) - set(
+            NotificationReadState.objects.filter(user_id__in=counts).values_list('user_id', flat=True)
+        )
+        NotificationReadState.objects.bulk_create(
+            [NotificationReadState(user_id=user_id) for user_id in missing],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        drifted = []
+        for state in NotificationReadState.objects.select_for_update().only('user_id', 'unread_count').iterator(chunk_size=batch_size):
+            expected = counts.get(state.user_id, 0)
+            if state.unread_count != expected:
+                state.unread_count = expected
+                drifted.append(state)
+        NotificationReadState.objects.bulk_update(drifted, ['unread_count'], batch_size=batch_size)
+    return len(drifted)
+
+
+def _write_batch(batch):
+    """
+    Insert one batch of personal notifications for one event and bump the
+    counts of the members who actually got a new row. Returns how many did;
+    their open streams hear about it once the batch commits.
+    """
+    event_key = batch[0].event_key
+    user_ids = [notification.user_id for notification in batch]
+    holders = Notification.objects.filter(event_key=event_key, user_id__in=user_ids)
+    with transaction.atomic():
+        NotificationReadState.objects.bulk_create(
+            [NotificationReadState(user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        # Locking the members' states makes a concurrent write of the same
+        # event wait here, so its rows are already counted in ``existing``
+        list(NotificationReadState.objects.select_for_update().filter(user_id__in=user_ids).values_list('pk'))
+        existing = set(holders.order_by().values_list('user_id', flat=True))
+        # ignore_conflicts still covers rows written outside this module
+        Notification.objects.bulk_create(
+            [notification for notification in batch if notification.user_id not in existing],
+            ignore_conflicts=True,
+        )
+        # Re-read for the ids bulk_create can't report with ignore_conflicts
+        inserted = list(holders.exclude(user_id__in=existing).order_by('pk'))
+        NotificationReadState.objects.filter(
+            user_id__in=[notification.user_id for notification in inserted],
+        ).update(unread_count=F('unread_count') + 1)
+        transaction.on_commit(partial(_publish, inserted))
+    return len(inserted)
+
+
+def _publish(rows):
+    realtime.publish_all([
+        (realtime.notification_channel(notification), realtime.notification_event(notification))
+        for notification in rows
+    ])
+
+
+def notify_announcement(announcement):
+    return fan_out(
+        f'announcement:{announcement.pk}',
+        title='📢 New Announcement',
+        message=f'{announcement.author.get_full_name()} posted: {announcement.title}',
+        notification_type='announcement',
+        exclude_user_id=announcement.author_id,
+    )
+
+
+def notify_activity(activity):
+    return fan_out(
+        f'activity:{activity.pk}',
+        title='📅 New Activity',
+        message=f'New {activity.get_activity_type_display().lower()}: {activity.title}',
+        notification_type='activity',
+    )
+
+
+def notify_blog_post(post):
+    return fan_out(
+        f'blog:{post.pk}',
+        title='📝 New Blog Post',
+        message=f'{post.author.get_full_name()} published: {post.title}',
+        notification_type='blog',
+        exclude_user_id=post.author_id,
+    )
+
+
+def notify_financial_record(record):
+    return fan_out(
+        f'financial:{record.pk}',
+        title='💰 Financial Update',
+        message=f'New financial records updated: Offering KSh {record.offering:,}, Donations KSh {record.donations:,}',
+        notification_type='financial',
+    )
@@ -0,0 +1,102 @@
+"""
+Bulk photo import for ``manage.py import_photos``.
+
+``prepare()`` runs in worker processes and touches files only: it hashes a
+file, decodes and validates it, applies its EXIF orientation, re-encodes
+it without metadata under a name derived from the content hash and writes
+its derivatives (see images.py). The command saves the results as Photo
+rows in chunked bulk inserts.
+
+Content hashes make re-runs safe: files whose hash is already on a photo
+are skipped, and a file written before an interruption is reused rather
+than written again. Its derivatives are named after the hash too, so
+rendering them again overwrites what the interrupted run left.
+"""
+import hashlib
+import io
+import os
+from dataclasses import dataclass, field
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from . import images
+
+EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff'}
+
+
+@dataclass
+class Prepared:
+    path: str
+    content_hash: str = ''
+    name: str = ''
+    # What images.render() returns
+    rendered: dict = field(default_factory=dict)
+    duplicate: bool = False
+    error: str = ''
+
+
+def find(directory):
+    """Image files under ``directory`` with their album (subdirectory), sorted"""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        album = os.path.relpath(root, directory)
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() in EXTENSIONS:
+                found.append((os.path.join(root, filename), '' if album == '.' else album))
+    return found
+
+
+def title_for(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem.replace('_', ' ').replace('-', ' ').strip()[:200] or 'Photo'
+
+
+_known = frozenset()
+
+
+def init_worker(known):
+    """Pool initializer: Django for storage access, and the hashes already imported"""
+    global _known
+    django.setup()
+    _known = known
+
+
+def _clean(data):
+    # verify() catches truncated and corrupt files but leaves the image unusable
+    Image.open(io.BytesIO(data)).verify()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    image = ImageOps.exif_transpose(image)
+    buffer = io.BytesIO()
+    # Saving without exif= drops the metadata (GPS position included); the
+    # colour profile is not metadata worth losing
+    options = {'icc_profile': image.info['icc_profile']} if image.info.get('icc_profile') else {}
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        image.convert('RGBA').save(buffer, 'PNG', optimize=True, **options)
+        return buffer.getvalue(), 'png'
+    image.convert('RGB').save(buffer, 'JPEG', quality=90, optimize=True, **options)
+    return buffer.getvalue(), 'jpg'
+
+
+def prepare(path):
+    """Everything about one file that needs no database; never raises"""
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except OSError as error:
+        return Prepared(path, error=str(error))
+    content_hash = hashlib.sha256(data).hexdigest()
+    if content_hash in _known:
+        return Prepared(path, content_hash, duplicate=True)
+    try:
+        cleaned, extension = _clean(data)
+        name = f'gallery/imported/{content_hash[:2]}/{content_hash}.{extension}'
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(cleaned))
+        return Prepared(path, content_hash, name, images.render(name, replace=True))
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as error:
+        return Prepared(path, content_hash, error=str(error) or type(error).__name__)
@@ -0,0 +1,110 @@
+"""
+The hot querysets behind the public_site views, and an EXPLAIN-based check
+that none of them needs a full table scan. Run it with
+``manage.py check_query_plans``.
+"""
+import re
+from dataclasses import dataclass, field
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from users.models import CustomUser
+from .models import Announcement, Activity, BlogPost, Comment, ChatMessage, Photo, FinancialRecord, FinancialRollup, Notification
+
+
+def _sample_member():
+    # An unsaved stand-in is enough to build the per-member querysets
+    return CustomUser(pk=0, date_joined=timezone.now())
+
+
+def hot_queries():
+    """(label, queryset) pairs mirroring what the views run"""
+    member = _sample_member()
+    return [
+        ('home: announcements', Announcement.objects.filter(is_active=True).order_by('-date')[:5]),
+        ('home: activities', Activity.objects.order_by('-date')[:6]),
+        ('home: latest financial record', FinancialRecord.objects.order_by('-record_date')[:1]),
+        ('home: church photos', Photo.objects.filter(photo_type='church').order_by('-upload_date')[:8]),
+        ('gallery: trip photos', Photo.objects.filter(photo_type='trip').order_by('-upload_date', '-id')[:24]),
+        ('gallery: older trip photos', Photo.objects.filter(photo_type='trip').filter(
+            Q(upload_date__lt=timezone.now()) | Q(upload_date=timezone.now(), pk__lt=0),
+        ).order_by('-upload_date', '-id')[:24]),
+        ('gallery: album', Photo.objects.filter(photo_type='trip', album='').order_by('-upload_date', '-id')[:24]),
+        ('announcements', Announcement.objects.filter(is_active=True).order_by('-date')),
+        ('activities', Activity.objects.order_by('-date')),
+        ('blog: posts', BlogPost.objects.order_by('-date', '-id')[:20]),
+        ('blog: recently discussed', BlogPost.objects.order_by('-last_commented_at', '-id')[:10]),
+        ('blog: most discussed', BlogPost.objects.order_by('-comment_count', '-id')[:10]),
+        ('blog: comments for a post', Comment.objects.filter(post_id=0).order_by('date')),
+        ('community chat', ChatMessage.objects.order_by('-timestamp', '-id')[:50]),
+        ('community chat: older page', ChatMessage.objects.filter(
+            Q(timestamp__lt=timezone.now()) | Q(timestamp=timezone.now(), pk__lt=0),
+        ).order_by('-timestamp', '-id')[:50]),
+        ('financial updates', FinancialRecord.objects.order_by('-record_date')[:10]),
+        ('financial summary', FinancialRollup.objects.filter(
+            period='month', start__gte=timezone.localdate(), start__lte=timezone.localdate(),
+        ).order_by('start')),
+        ('notifications: unread', Notification.objects.unread_personal(member)[:10]),
+        ('notifications: unread broadcasts', Notification.objects.unread_broadcasts(member)[:10]),
+    ]
+
+
+@dataclass
+class PlanReport:
+    label: str
+    plan: str
+    scanned_tables: list = field(default_factory=list)
+    large_scans: dict = field(default_factory=dict)
+
+    @property
+    def ok(self):
+        return not self.large_scans
+
+
+# SQLite: "SCAN public_site_activity" (but not "SCAN ... USING INDEX ...")
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)')
+# Postgres: "Seq Scan on public_site_activity"
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def scanned_tables(plan, vendor=None):
+    """Tables the plan reads in full, in the order they appear"""
+    pattern = POSTGRES_SCAN if (vendor or connection.vendor) == 'postgresql' else SQLITE_SCAN
+    known = set(connection.introspection.table_names())
+    tables = []
+    for line in plan.splitlines():
+        for table in pattern.findall(line):
+            # Skip "SCAN CONSTANT ROW", subqueries and the like
+            if table in known and table not in tables:
+                tables.append(table)
+    return tables
+
+
+def table_rows(table):
+    """Row count, estimated from statistics on Postgres"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        else:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        # reltuples is -1 for tables that have never been analyzed
+        return max(cursor.fetchone()[0] or 0, 0)
+
+
+def check(min_rows, queries=None):
+    """
+    EXPLAIN every hot query and report full scans of tables holding more
+    than ``min_rows`` rows.
+    """
+    reports = []
+    for label, queryset in queries if queries is not None else hot_queries():
+        plan = queryset.explain()
+        report = PlanReport(label, plan, scanned_tables(plan))
+        for table in report.scanned_tables:
+            rows = table_rows(table)
+            if rows > min_rows:
+                report.large_scans[table] = rows
+        reports.append(report)
+    return reports
@@ -0,0 +1,446 @@
+"""
+In-process pub/sub for pushing events to connected browsers.
+
+Each worker process has one ``Hub``. Long-lived connections (the
+notification stream, the chat socket) subscribe to channels such as
+``user:5``, ``broadcast`` or ``chat`` and get events from a small
+per-connection queue. A backend carries events between processes:
+
+- ``DatabasePollingBackend`` (the default) treats the notifications and chat
+  tables as the bus: each process polls for the rows of the channels its
+  own connections are subscribed to.
+- ``RelayBackend`` forwards events through ``manage.py run_relay``, a small
+  TCP fan-out server, for sub-second delivery across processes.
+- ``LocalBackend`` keeps events inside one process.
+"""
+import asyncio
+import json
+import logging
+import socket
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class SlowConsumer(Exception):
+    """A subscriber fell further behind than its queue allows"""
+
+
+class Subscription:
+    def __init__(self, hub, channels, maxsize, drop_oldest=True):
+        self.hub = hub
+        self.channels = channels
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+        self.overflowed = False
+
+    def deliver(self, event):
+        # A slow client never holds memory for ever. With drop_oldest it
+        # loses its oldest events (fine for badge counts); otherwise the
+        # subscription is marked overflowed and get() raises SlowConsumer so
+        # the connection can be closed and the client resynchronise.
+        if self.queue.full():
+            if not self.drop_oldest:
+                self.overflowed = True
+                return
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Next event, or None if nothing arrived within ``timeout`` seconds"""
+        if self.overflowed:
+            raise SlowConsumer()
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        await self.hub.unsubscribe(self)
+
+
+class Hub:
+    def __init__(self, backend, queue_size=100):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.channels = defaultdict(set)
+        self.loop = None
+        self._started = False
+
+    @property
+    def subscriber_count(self):
+        return len({sub for subs in self.channels.values() for sub in subs})
+
+    async def subscribe(self, *channels, drop_oldest=True):
+        self.loop = asyncio.get_running_loop()
+        subscription = Subscription(self, channels, self.queue_size, drop_oldest)
+        for channel in channels:
+            self.channels[channel].add(subscription)
+        if not self._started:
+            self._started = True
+            await self.backend.start(self)
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        for channel in subscription.channels:
+            subscribers = self.channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.channels[channel]
+        if not self.channels and self._started:
+            self._started = False
+            await self.backend.stop()
+
+    def publish(self, channel, event):
+        """Deliver to local subscribers; must be called on the hub's loop"""
+        for subscription in list(self.channels.get(channel, ())):
+            subscription.deliver(event)
+
+    def publish_threadsafe(self, channel, event):
+        """Deliver to local subscribers from any thread (e.g. a sync view)"""
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.publish(channel, event)
+        else:
+            self.loop.call_soon_threadsafe(self.publish, channel, event)
+
+
+class LocalBackend:
+    """Events stay inside this process: fine for a single worker"""
+
+    async def start(self, hub):
+        self.hub = hub
+
+    async def stop(self):
+        pass
+
+    def publish(self, channel, event):
+        self.hub.publish_threadsafe(channel, event)
+
+    @classmethod
+    def publish_detached(cls, channel, event):
+        """Publish from a process whose hub isn't running; nobody is listening here"""
+
+    @classmethod
+    def publish_detached_all(cls, events):
+        for channel, event in events:
+            cls.publish_detached(channel, event)
+
+
+class DatabasePollingBackend(LocalBackend):
+    """
+    Picks up notifications and chat messages written by any process. Each
+    poll reads only the rows for channels this process has subscribers on,
+    page by page until a page comes back short.
+
+    Ids are handed out when rows are inserted, not when they commit, so a
+    fan-out that commits late can land below an id already seen. Polls
+    therefore re-read the last ``REALTIME_POLL_LOOKBACK`` seconds by creation
+    time and remember what they delivered in that window. Runs only while
+    this process has subscribers. Chat and notification events published
+    here are delivered at once and skipped when the poll finds their rows.
+    """
+
+    page_size = 500
+
+    def __init__(self, interval=None, lookback=None):
+        self.interval = interval or getattr(settings, 'REALTIME_POLL_INTERVAL', 2.0)
+        self.lookback = timedelta(seconds=lookback or getattr(settings, 'REALTIME_POLL_LOOKBACK', 30.0))
+        self.task = None
+        # (event type, row id) of events already delivered by publish()
+        self.published_here = set()
+        # (event type, row id) -> when delivered, for rows inside the window
+        self.delivered = {}
+
+    async def start(self, hub):
+        await super().start(hub)
+        self.task = asyncio.create_task(self.poll(timezone.now()))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.published_here.clear()
+        self.delivered.clear()
+
+    def publish(self, channel, event):
+        if event.get('type') == 'chat':
+            self.published_here.add(('chat', event['message']['id']))
+        elif event.get('type') == 'notification':
+            self.published_here.add(('notification', event['id']))
+        super().publish(channel, event)
+
+    async def poll(self, started):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = timezone.now()
+            # Nothing from before this process subscribed
+            since = max(started, now - self.lookback)
+            try:
+                events = await sync_to_async(self.fetch_new, thread_sensitive=False)(set(self.hub.channels), since)
+            except Exception:
+                logger.exception("Realtime poll failed")
+                continue
+            self.deliver(events, now, since)
+
+    def deliver(self, events, now, since):
+        """Publish the ``(key, channel, event)`` found by a poll that this process hasn't yet"""
+        while self.published_here:
+            self.delivered[self.published_here.pop()] = now
+        for key, channel, event in events:
+            if key not in self.delivered:
+                self.delivered[key] = now
+                self.hub.publish(channel, event)
+        # A row delivered before the window opened was also created before it
+        for key in [key for key, at in self.delivered.items() if at < since]:
+            del self.delivered[key]
+
+    @classmethod
+    def fetch_new(cls, channels, since):
+        """``(key, channel, event)`` for every row on ``channels`` created since ``since``"""
+        found = [
+            (('notification', event['id']), channel, event)
+            for channel, event in cls._drain(lambda after: cls.fetch(channels, since, after, cls.page_size))
+        ]
+        if CHAT_CHANNEL in channels:
+            found += [
+                (('chat', event['message']['id']), channel, event)
+                for channel, event in cls._drain(lambda after: cls.fetch_chat(since, after, cls.page_size))
+            ]
+        return found
+
+    @classmethod
+    def _drain(cls, fetch):
+        """Call ``fetch(after_id)`` until a page comes back short"""
+        events, after = [], 0
+        while True:
+            page = fetch(after)
+            events += page
+            if len(page) < cls.page_size:
+                return events
+            last = page[-1][1]
+            after = last['message']['id'] if last.get('type') == 'chat' else last['id']
+
+    @staticmethod
+    def fetch(channels, since, after=0, limit=500):
+        from .models import Notification
+        members = [int(channel[5:]) for channel in channels if channel.startswith('user:')]
+        # A personal row read before the poll reaches it needs no push
+        q = Q(user_id__in=members, is_read=False) if members else Q(pk__in=[])
+        if BROADCAST_CHANNEL in channels:
+            q |= Q(user__isnull=True)
+        rows = Notification.objects.filter(q, created_at__gte=since, pk__gt=after).order_by('pk')[:limit]
+        return [(notification_channel(row), notification_event(row)) for row in rows]
+
+    @staticmethod
+    def fetch_chat(since, after=0, limit=500):
+        from .models import ChatMessage
+        rows = (
+            ChatMessage.objects.select_related('user')
+            .filter(timestamp__gte=since, pk__gt=after).order_by('pk')[:limit]
+        )
+        return [(CHAT_CHANNEL, chat_event(row)) for row in rows]
+
+
+def _encode(channel, event):
+    return json.dumps({'channel': channel, 'event': event}).encode() + b'\n'
+
+
+def relay_address(url=None):
+    """(host, port) from REALTIME_RELAY_URL, e.g. ``tcp://127.0.0.1:8765``"""
+    url = url or getattr(settings, 'REALTIME_RELAY_URL', 'tcp://127.0.0.1:8765')
+    host, _, port = url.split('://', 1)[-1].rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class RelayBackend(LocalBackend):
+    """
+    Shares events between processes through ``manage.py run_relay``. Every
+    event, including this process's own, comes back from the relay before
+    it reaches local subscribers, so all processes see the same order.
+    While the relay is unreachable events are delivered locally only.
+    """
+
+    def __init__(self, url=None):
+        self.address = relay_address(url)
+        self.writer = None
+        self.task = None
+        self.connected = None
+
+    async def start(self, hub):
+        await super().start(hub)
+        self.connected = asyncio.Event()
+        self.task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def listen(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(*self.address)
+            except OSError as e:
+                logger.warning("Cannot reach the realtime relay at %s:%s: %s", *self.address, e)
+                await asyncio.sleep(1)
+                continue
+            self.writer = writer
+            self.connected.set()
+            try:
+                async for line in reader:
+                    try:
+                        data = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.hub.publish(data['channel'], data['event'])
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                self.connected.clear()
+                self.writer = None
+                writer.close()
+            logger.warning("Lost the realtime relay; reconnecting")
+
+    def publish(self, channel, event):
+        loop = self.hub.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._send(channel, event)
+        else:
+            loop.call_soon_threadsafe(self._send, channel, event)
+
+    def _send(self, channel, event):
+        if self.writer is None:
+            self.hub.publish(channel, event)
+        else:
+            self.writer.write(_encode(channel, event))
+
+    @classmethod
+    def publish_detached(cls, channel, event):
+        cls.publish_detached_all([(channel, event)])
+
+    @classmethod
+    def publish_detached_all(cls, events):
+        # One connection for the lot, e.g. a whole fan-out batch
+        try:
+            with socket.create_connection(relay_address(), timeout=1) as sock:
+                sock.sendall(b''.join(_encode(channel, event) for channel, event in events))
+        except OSError:
+            logger.warning("Could not publish %d events to the realtime relay", len(events))
+
+
+class Relay:
+    """
+    The fan-out server behind RelayBackend: each line a client sends is
+    written to every connected client. A client whose unsent output passes
+    ``buffer_limit`` bytes is disconnected rather than buffered for ever; its
+    hub reconnects and its subscribers catch up from the database.
+    """
+
+    def __init__(self, buffer_limit=1024 * 1024):
+        self.buffer_limit = buffer_limit
+        self.clients = set()
+        self.disconnected_slow = 0
+
+    async def handle(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            async for line in reader:
+                for client in list(self.clients):
+                    if client.transport.get_write_buffer_size() > self.buffer_limit:
+                        self.disconnected_slow += 1
+                        self.clients.discard(client)
+                        client.close()
+                        continue
+                    client.write(line)
+        except (ConnectionError, asyncio.CancelledError):
+            # CancelledError: the relay is shutting down. Swallowing it
+            # keeps asyncio from logging every open connection as an error.
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+CHAT_CHANNEL = 'chat'
+BROADCAST_CHANNEL = 'broadcast'
+
+
+def chat_event(message, client_id=None):
+    from . import chat
+    event = {'type': 'chat', 'message': chat.serialize(message)}
+    if client_id is not None:
+        # Lets the sender match the saved message to its provisional id
+        event['message']['client_id'] = client_id
+    return event
+
+
+def notification_channel(notification):
+    return f'user:{notification.user_id}' if notification.user_id else BROADCAST_CHANNEL
+
+
+def notification_event(notification):
+    return {
+        'type': 'notification',
+        'id': notification.pk,
+        'title': notification.title,
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'created_at': notification.created_at.isoformat(),
+        'actor_id': notification.actor_id,
+    }
+
+
+_hub = None
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        backend_path = getattr(settings, 'REALTIME_BACKEND', 'public_site.realtime.DatabasePollingBackend')
+        _hub = Hub(import_string(backend_path)(), getattr(settings, 'REALTIME_QUEUE_SIZE', 100))
+    return _hub
+
+
+def publish(channel, event):
+    """Publish an event from sync code through the configured backend"""
+    publish_all([(channel, event)])
+
+
+def publish_all(events):
+    """publish() for a list of ``(channel, event)`` pairs"""
+    if not events:
+        return
+    if _hub is not None and _hub._started:
+        for channel, event in events:
+            _hub.backend.publish(channel, event)
+    else:
+        backend_path = getattr(settings, 'REALTIME_BACKEND', 'public_site.realtime.DatabasePollingBackend')
+        import_string(backend_path).publish_detached_all(events)
@@ -0,0 +1,150 @@
+"""
+Retention policies for tables that otherwise only grow; applied by
+``manage.py prune``.
+
+Each policy names a model and the rows that may go once they are older than
+``days``. Override the defaults with ``RETENTION_DAYS`` in settings, e.g.
+``RETENTION_DAYS = {'chat_messages': 180}``.
+"""
+import gzip
+import json
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+@dataclass(frozen=True)
+class Policy:
+    name: str
+    model: str
+    days: int
+    condition: Callable[[object], Q]
+    description: str
+
+    def queryset(self, now=None, days=None):
+        cutoff = (now or timezone.now()) - timedelta(days=self.days if days is None else days)
+        model = apps.get_model(self.model)
+        return model._default_manager.filter(self.condition(cutoff)).order_by('pk')
+
+
+POLICIES = [
+    Policy(
+        'notifications', 'public_site.Notification', 90,
+        lambda cutoff: Q(user__isnull=False, is_read=True, created_at__lt=cutoff),
+        'read notifications',
+    ),
+    Policy(
+        'broadcasts', 'public_site.Notification', 180,
+        lambda cutoff: Q(user__isnull=True, created_at__lt=cutoff),
+        'broadcast notifications',
+    ),
+    Policy(
+        'chat_messages', 'public_site.ChatMessage', 365,
+        lambda cutoff: Q(timestamp__lt=cutoff),
+        'community chat messages',
+    ),
+    Policy(
+        # PasswordResetToken.is_expired() is "older than a day"
+        'password_reset_tokens', 'users.PasswordResetToken', 2,
+        lambda cutoff: Q(used=True) | Q(created_at__lt=cutoff),
+        'used or expired password reset tokens',
+    ),
+    Policy(
+        'sessions', 'sessions.Session', 0,
+        lambda cutoff: Q(expire_date__lt=cutoff),
+        'expired sessions',
+    ),
+    Policy(
+        'finished_jobs', 'jobs.Job', 7,
+        lambda cutoff: Q(status='done', finished_at__lt=cutoff),
+        'completed background jobs',
+    ),
+    Policy(
+        'failed_jobs', 'jobs.Job', 30,
+        lambda cutoff: Q(status='failed', finished_at__lt=cutoff),
+        'failed background jobs',
+    ),
+]
+
+
+def get_policies(names=None):
+    by_name = {policy.name: policy for policy in POLICIES}
+    if not names:
+        return list(by_name.values())
+    unknown = set(names) - set(by_name)
+    if unknown:
+        raise KeyError(f"Unknown retention policies: {', '.join(sorted(unknown))}")
+    return [by_name[name] for name in names]
+
+
+def retention_days(policy):
+    return getattr(settings, 'RETENTION_DAYS', {}).get(policy.name, policy.days)
+
+
+def estimate_row_bytes(queryset, sample=200):
+    """
+    Average bytes per row. Postgres reports the table's on-disk size per
+    tuple; elsewhere we fall back to the JSON size of a sample of rows.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_total_relation_size(c.oid) / GREATEST(c.reltuples, 1) "
+                "FROM pg_class c WHERE c.oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0]:
+            return float(row[0])
+    rows = list(queryset.values()[:sample])
+    if not rows:
+        return 0.0
+    return sum(len(json.dumps(row, cls=DjangoJSONEncoder)) for row in rows) / len(rows)
+
+
+def prune(policy, days=None, batch_size=500, pause=0.0, archive=None, now=None):
+    """
+    Delete the policy's expired rows in primary-key order, ``batch_size`` at a
+    time, each batch in its own short transaction. When ``archive`` is an
+    open binary file the rows are appended to it as gzip-compressed JSON lines
+    before they are deleted. Returns the number of rows deleted.
+    """
+    queryset = policy.queryset(now, days)
+    model = queryset.model
+    writer = gzip.GzipFile(fileobj=archive, mode='ab') if archive is not None else None
+    deleted = 0
+    last_pk = None
+    try:
+        while True:
+            page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            if writer is not None:
+                rows = list(page.values()[:batch_size])
+                pks = [row[model._meta.pk.attname] for row in rows]
+            else:
+                pks = list(page.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+
+            if writer is not None:
+                for row in rows:
+                    line = json.dumps({'model': policy.model, 'fields': row}, cls=DjangoJSONEncoder)
+                    writer.write(line.encode() + b'\n')
+                writer.flush()
+            with transaction.atomic():
+                deleted += model._default_manager.filter(pk__in=pks).delete()[1].get(model._meta.label, 0)
+
+            last_pk = pks[-1]
+            if pause:
+                time.sleep(pause)
+    finally:
+        if writer is not None:
+            writer.close()
+    return deleted
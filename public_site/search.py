@@ -0,0 +1,311 @@
+"""
+Site search over announcements, activities, blog posts and comments.
+
+Every searchable object has one row in ``public_site_search``, an inverted
+index kept current by post_save/post_delete receivers:
+
+- on SQLite it is an FTS5 virtual table ranked with bm25();
+- on Postgres it is a table with a generated, weighted ``tsvector`` column
+  under a GIN index, ranked with ts_rank_cd().
+
+Titles weigh more than bodies. The table is created by migration 0010 and
+refilled with ``manage.py rebuild_search_index``. On any other database
+search falls back to ``icontains`` filters.
+
+FTS5 columns can't be indexed, so on SQLite a row's rowid encodes its kind
+and object id (see ``rowid()``); updates and deletes find the row by it
+instead of scanning the table. Ranking is the expensive part of a query,
+so only the newest SEARCH_CANDIDATES matches of each kind are ranked: a
+word that appears everywhere costs the same as a rare one, and relevance is
+judged among recent content. The cap is per kind because ids from
+different tables don't compare; one busy table can't crowd out the rest.
+"""
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Announcement, Activity, BlogPost, Comment
+
+TABLE = 'public_site_search'
+
+# rowid = object_id * ROWID_KINDS + KIND_CODES[kind]; migration 0016
+# renumbered existing rows, so don't change these
+KIND_CODES = {'announcement': 1, 'activity': 2, 'blog': 3, 'comment': 4}
+ROWID_KINDS = 8
+
+
+def rowid(kind, object_id):
+    return object_id * ROWID_KINDS + KIND_CODES[kind]
+
+
+def candidates():
+    return getattr(settings, 'SEARCH_CANDIDATES', 1000)
+
+
+@dataclass(frozen=True)
+class Source:
+    kind: str
+    model: type
+    label: str
+    title: Callable
+    body: Callable
+    url: Callable
+    # Narrows the model's queryset to what the public site shows; the index
+    # holds everything so the admin can find hidden objects too
+    visible: Callable = lambda queryset: queryset
+    members_only: bool = False
+    # Fields for the icontains fallback
+    fallback_fields: tuple = ()
+    # Relations the hit's title reads, loaded with the hits
+    select_related: tuple = ()
+
+
+SOURCES = {
+    source.kind: source for source in [
+        Source(
+            'announcement', Announcement, 'Announcement',
+            title=lambda a: a.title, body=lambda a: a.content,
+            url=lambda a: reverse('announcements'),
+            visible=lambda queryset: queryset.filter(is_active=True),
+            fallback_fields=('title', 'content'),
+        ),
+        Source(
+            'activity', Activity, 'Activity',
+            title=lambda a: a.title, body=lambda a: a.description,
+            url=lambda a: reverse('activities'),
+            fallback_fields=('title', 'description'),
+        ),
+        Source(
+            'blog', BlogPost, 'Blog post',
+            title=lambda p: p.title, body=lambda p: p.content,
+            url=lambda p: reverse('blog'),
+            members_only=True,
+            fallback_fields=('title', 'content'),
+        ),
+        Source(
+            'comment', Comment, 'Comment',
+            title=lambda c: '', body=lambda c: c.content,
+            url=lambda c: reverse('blog'),
+            members_only=True,
+            fallback_fields=('content',),
+            select_related=('author', 'post'),
+        ),
+    ]
+}
+KINDS_BY_MODEL = {source.model: source.kind for source in SOURCES.values()}
+
+
+@dataclass
+class Hit:
+    kind: str
+    object: object
+    rank: float
+    snippet: str
+
+    @property
+    def source(self):
+        return SOURCES[self.kind]
+
+    @property
+    def title(self):
+        return self.source.title(self.object) or str(self.object)
+
+    @property
+    def url(self):
+        return self.source.url(self.object)
+
+    @property
+    def snippet_html(self):
+        """The snippet with matched words in <mark>, everything else escaped"""
+        return mark_safe(escape(self.snippet).replace('[[', '<mark>').replace(']]', '</mark>'))
+
+
+def available(using=None):
+    return (using or connection).vendor in ('sqlite', 'postgresql')
+
+
+# Keeping the index current ------------------------------------------------
+
+def index(obj, created=False):
+    """Add or refresh one object's row; ``created`` skips looking for an old one"""
+    kind = KINDS_BY_MODEL[type(obj)]
+    source = SOURCES[kind]
+    if not available():
+        return
+    row = [kind, obj.pk, source.title(obj) or '', source.body(obj) or '']
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"INSERT INTO {TABLE} (kind, object_id, title, body) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (kind, object_id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body",
+                row,
+            )
+        else:
+            verb = 'INSERT' if created else 'INSERT OR REPLACE'
+            cursor.execute(
+                f"{verb} INTO {TABLE} (rowid, kind, object_id, title, body) VALUES (%s, %s, %s, %s, %s)",
+                [rowid(kind, obj.pk), *row],
+            )
+
+
+def unindex(kind, object_id):
+    if not available():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f"DELETE FROM {TABLE} WHERE kind = %s AND object_id = %s", [kind, object_id])
+        else:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [rowid(kind, object_id)])
+
+
+def rebuild(batch_size=500):
+    """Refill the whole index from the models; returns the number of rows"""
+    if not available():
+        return 0
+    total = 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE}")
+            for kind, source in SOURCES.items():
+                rows = []
+                for obj in source.model._default_manager.order_by('pk').iterator(chunk_size=batch_size):
+                    rows.append([kind, obj.pk, source.title(obj) or '', source.body(obj) or ''])
+                    if len(rows) >= batch_size:
+                        total += _insert(cursor, rows)
+                        rows = []
+                total += _insert(cursor, rows)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+    return total
+
+
+def _insert(cursor, rows):
+    if not rows:
+        return 0
+    if connection.vendor == 'postgresql':
+        cursor.executemany(f"INSERT INTO {TABLE} (kind, object_id, title, body) VALUES (%s, %s, %s, %s)", rows)
+    else:
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (rowid, kind, object_id, title, body) VALUES (%s, %s, %s, %s, %s)",
+            [[rowid(kind, object_id), kind, object_id, *rest] for kind, object_id, *rest in rows],
+        )
+    return len(rows)
+
+
+# Querying -----------------------------------------------------------------
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _fts5_query(text):
+    # Quote every word so user input can't use FTS5 syntax; the last word
+    # matches as a prefix so results appear while people are still typing
+    words = WORD.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def matches(text, kinds=None, limit=20, offset=0):
+    """(kind, object_id, rank, snippet) for the best of each kind's newest matches, best first"""
+    kinds = list(kinds or SOURCES)
+    placeholders = ', '.join(['%s'] * len(kinds))
+    pool = max(candidates(), limit + offset)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            if not WORD.search(text):
+                return []
+            cursor.execute(
+                f"SELECT kind, object_id, rank, "
+                f"ts_headline('english', body, query, 'MaxFragments=1, MaxWords=25, MinWords=10, StartSel=[[, StopSel=]]') "
+                f"FROM (SELECT kind, object_id, body, query, ts_rank_cd(document, query) AS rank "
+                f"      FROM (SELECT kind, object_id, body, document, query, "
+                f"                   row_number() OVER (PARTITION BY kind ORDER BY object_id DESC) AS age "
+                f"            FROM {TABLE}, websearch_to_tsquery('english', %s) query "
+                f"            WHERE document @@ query AND kind IN ({placeholders})) matched "
+                f"      WHERE age <= %s "
+                f"      ORDER BY rank DESC, kind, object_id DESC LIMIT %s OFFSET %s) best "
+                f"ORDER BY rank DESC, kind, object_id DESC",
+                [text, *kinds, pool, limit, offset],
+            )
+        else:
+            query = _fts5_query(text)
+            if query is None:
+                return []
+            # One capped scan per kind. FTS5 walks matches in rowid order, so
+            # each LIMIT stops it early. bm25() is lower-is-better; title
+            # matches count ten times as much
+            newest = (
+                f"SELECT * FROM (SELECT kind, object_id, bm25({TABLE}, 10.0, 1.0) AS score, "
+                f"snippet({TABLE}, 1, '[[', ']]', '…', 25) AS snippet "
+                f"FROM {TABLE} WHERE {TABLE} MATCH %s AND rowid %% {ROWID_KINDS} = %s "
+                f"ORDER BY rowid DESC LIMIT %s)"
+            )
+            cursor.execute(
+                f"SELECT kind, object_id, -score, snippet "
+                f"FROM ({' UNION ALL '.join([newest] * len(kinds))}) "
+                f"ORDER BY score LIMIT %s OFFSET %s",
+                [value for kind in kinds for value in (query, KIND_CODES[kind], pool)] + [limit, offset],
+            )
+        return [(kind, int(object_id), rank, snippet) for kind, object_id, rank, snippet in cursor.fetchall()]
+
+
+def search(text, member=None, kinds=None, limit=20, offset=0):
+    """
+    Ranked hits for ``text`` among the kinds ``member`` may see; anonymous
+    visitors only search public kinds.
+    """
+    allowed = [
+        kind for kind, source in SOURCES.items()
+        if (member is not None and member.is_authenticated) or not source.members_only
+    ]
+    if kinds:
+        allowed = [kind for kind in allowed if kind in kinds]
+    if not allowed or not text.strip():
+        return []
+    if not available():
+        return _fallback_search(text, allowed, limit, offset)
+
+    found = matches(text, allowed, limit, offset)
+    ids_by_kind = {}
+    for kind, object_id, _, _ in found:
+        ids_by_kind.setdefault(kind, []).append(object_id)
+    objects = {
+        kind: SOURCES[kind].visible(
+            SOURCES[kind].model._default_manager.select_related(*SOURCES[kind].select_related)
+        ).in_bulk(ids)
+        for kind, ids in ids_by_kind.items()
+    }
+    return [
+        Hit(kind, objects[kind][object_id], rank, snippet)
+        for kind, object_id, rank, snippet in found
+        # Hidden objects, and rows whose object vanished without a signal
+        if object_id in objects[kind]
+    ]
+
+
+def _fallback_search(text, kinds, limit, offset):
+    hits = []
+    for kind in kinds:
+        source = SOURCES[kind]
+        condition = Q()
+        for field in source.fallback_fields:
+            condition |= Q(**{f'{field}__icontains': text})
+        queryset = source.visible(source.model._default_manager.filter(condition)).order_by('-pk')
+        hits += [Hit(kind, obj, 0.0, source.body(obj)[:200]) for obj in queryset[:offset + limit]]
+    return hits[offset:offset + limit]
+
+
+def matching_ids(model, text, limit=1000):
+    """Primary keys of ``model`` objects matching ``text``, for admin search"""
+    return [object_id for _, object_id, _, _ in matches(text, [KINDS_BY_MODEL[model]], limit)]
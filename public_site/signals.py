@@ -0,0 +1,112 @@
+from decimal import Decimal
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import blog, finance, fragments, images, search
+from .models import Announcement, Activity, BlogPost, Comment, FinancialRecord, Photo
+from .tasks import notify, photo_derivatives
+
+# Only notify members about significant financial updates (in KSh)
+FINANCIAL_NOTIFICATION_THRESHOLD = Decimal('1000')
+
+
+@receiver(post_save, sender=Announcement)
+def create_announcement_notification(sender, instance, created, **kwargs):
+    """Notify members when a new active announcement is posted"""
+    if created and instance.is_active:
+        notify.delay(kind='announcement', pk=instance.pk)
+
+
+@receiver(post_save, sender=Activity)
+def create_activity_notification(sender, instance, created, **kwargs):
+    """Notify members when a new activity is added"""
+    if created:
+        notify.delay(kind='activity', pk=instance.pk)
+
+
+@receiver(post_save, sender=BlogPost)
+def create_blog_notification(sender, instance, created, **kwargs):
+    """Notify members when a new blog post is published"""
+    if created:
+        notify.delay(kind='blog', pk=instance.pk)
+
+
+@receiver(post_save, sender=FinancialRecord)
+def create_financial_notification(sender, instance, created, **kwargs):
+    """Notify members when a significant financial record is added"""
+    if created and instance.offering + instance.donations > FINANCIAL_NOTIFICATION_THRESHOLD:
+        notify.delay(kind='financial', pk=instance.pk)
+
+
+@receiver(pre_save, sender=FinancialRecord)
+def remember_financial_amounts(sender, instance, raw=False, **kwargs):
+    """What an edited record held before, so its rollups move by the difference"""
+    if not raw:
+        instance._rollup_previous = finance.previous_state(instance)
+
+
+@receiver(post_save, sender=FinancialRecord)
+def roll_up_financial_record(sender, instance, raw=False, **kwargs):
+    """Keep the monthly and yearly totals current"""
+    if not raw:
+        finance.record_saved(instance, getattr(instance, '_rollup_previous', None))
+
+
+@receiver(post_delete, sender=FinancialRecord)
+def roll_back_financial_record(sender, instance, **kwargs):
+    finance.record_deleted(instance)
+
+
+@receiver(post_save, sender=Photo)
+def queue_photo_derivatives(sender, instance, **kwargs):
+    """Resize new and replaced images for the gallery's srcset markup"""
+    if instance.image and not images.is_current(instance):
+        photo_derivatives.delay(pk=instance.pk)
+
+
+@receiver(post_delete, sender=Photo)
+def delete_photo_derivatives(sender, instance, **kwargs):
+    images.delete_files(images.files(instance.derivatives))
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    """Keep the post's stored comment count and latest comment time current"""
+    if created:
+        blog.comment_added(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_deleted_comment(sender, instance, **kwargs):
+    blog.comment_removed(instance)
+
+
+@receiver(post_save, sender=Announcement)
+@receiver(post_save, sender=Activity)
+@receiver(post_save, sender=BlogPost)
+@receiver(post_save, sender=Comment)
+def update_search_index(sender, instance, created, **kwargs):
+    """Keep the full-text index in step with searchable content"""
+    search.index(instance, created)
+
+
+@receiver(post_delete, sender=Announcement)
+@receiver(post_delete, sender=Activity)
+@receiver(post_delete, sender=BlogPost)
+@receiver(post_delete, sender=Comment)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.unindex(search.KINDS_BY_MODEL[sender], instance.pk)
+
+
+@receiver(post_save, sender=Announcement)
+@receiver(post_save, sender=Activity)
+@receiver(post_save, sender=FinancialRecord)
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=Announcement)
+@receiver(post_delete, sender=Activity)
+@receiver(post_delete, sender=FinancialRecord)
+@receiver(post_delete, sender=Photo)
+def expire_page_fragments(sender, **kwargs):
+    """Make cached page sections built from this model render afresh"""
+    fragments.expire_for(sender)
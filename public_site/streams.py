@@ -0,0 +1,237 @@
+"""
+Long-lived ASGI endpoints, routed in GatituProject/asgi.py ahead of Django
+so an idle connection costs a coroutine and a small queue instead of a
+thread.
+"""
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+
+from . import chat, chat_buffer, notifications, realtime
+from .models import Notification
+
+HEARTBEAT_SECONDS = 20
+# Browsers reconnect on their own (sending Last-Event-ID), so closing
+# streams now and then costs nothing and bounds any connection we lose track of
+MAX_STREAM_SECONDS = 600
+REPLAY_LIMIT = 20
+# Close code for chat clients that fall too far behind; they reconnect and
+# fetch what they missed from the chat API
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+class _SessionRequest:
+    """Just enough of an HttpRequest for django.contrib.auth.get_user()"""
+
+    def __init__(self, session):
+        self.session = session
+
+
+def scope_cookies(scope):
+    cookie = SimpleCookie()
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            cookie.load(value.decode('latin-1'))
+    return {key: morsel.value for key, morsel in cookie.items()}
+
+
+def scope_header(scope, wanted):
+    for name, value in scope.get('headers', ()):
+        if name == wanted:
+            return value.decode('latin-1')
+    return None
+
+
+def same_origin(scope):
+    """
+    Browsers send cookies with cross-site WebSocket handshakes, so a socket
+    authenticated by cookie must check that the page opening it is ours.
+    """
+    origin = scope_header(scope, b'origin')
+    if origin is None:
+        return True
+    return urlsplit(origin).netloc == scope_header(scope, b'host')
+
+
+def _authenticate(session_key):
+    engine = import_module(settings.SESSION_ENGINE)
+    user = get_user(_SessionRequest(engine.SessionStore(session_key)))
+    return user if user.is_authenticated else None
+
+
+async def authenticate(scope):
+    """The logged-in member for an ASGI scope, from the session cookie"""
+    session_key = scope_cookies(scope).get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None
+    return await sync_to_async(_authenticate, thread_sensitive=False)(session_key)
+
+
+def sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def _unread_count(user):
+    # Drop the request-scoped read state so every event sees fresh counts
+    user._notification_state = None
+    return notifications.unread_count(user)
+
+
+def _missed(user, last_id):
+    missed = (
+        Notification.objects.unread(user)
+        .filter(pk__gt=last_id)
+        .order_by('pk')[:REPLAY_LIMIT]
+    )
+    return [realtime.notification_event(notification) for notification in missed]
+
+
+async def notification_stream(scope, receive, send):
+    """
+    Server-Sent Events: an ``unread`` event with the badge count, then a
+    ``notification`` event for every new notification the member can see.
+    """
+    user = await authenticate(scope)
+    if user is None:
+        await send({'type': 'http.response.start', 'status': 403, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Login required'})
+        return
+
+    hub = realtime.get_hub()
+    subscription = await hub.subscribe(f'user:{user.pk}', 'broadcast')
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    async def next_event():
+        # Wake up for the disconnect too, not just for events and heartbeats
+        getter = asyncio.ensure_future(subscription.get(timeout=HEARTBEAT_SECONDS))
+        await asyncio.wait([getter, watcher], return_when=asyncio.FIRST_COMPLETED)
+        if not getter.done():
+            getter.cancel()
+            return None
+        return getter.result()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    unread_count = sync_to_async(_unread_count, thread_sensitive=False)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Stop nginx-style proxies from buffering the stream
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+        last_id = scope_header(scope, b'last-event-id')
+        if last_id and last_id.isdigit():
+            missed = await sync_to_async(_missed, thread_sensitive=False)(user, int(last_id))
+            for event in missed:
+                await send({'type': 'http.response.body', 'body': sse('notification', event, event['id']), 'more_body': True})
+        count = await unread_count(user)
+        await send({'type': 'http.response.body', 'body': sse('unread', {'count': count}), 'more_body': True})
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + MAX_STREAM_SECONDS
+        while not disconnected.is_set() and loop.time() < deadline:
+            event = await next_event()
+            if disconnected.is_set():
+                break
+            if event is None:
+                body = b': keep-alive\n\n'
+            elif event.get('type') == 'notification':
+                if event.get('actor_id') == user.pk:
+                    continue
+                count = await unread_count(user)
+                body = sse('notification', event, event['id']) + sse('unread', {'count': count})
+            else:
+                # e.g. {'type': 'unread'} after the member reads something
+                count = await unread_count(user)
+                body = sse('unread', {'count': count})
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        await subscription.close()
+
+
+def _post_chat_message(user, text):
+    try:
+        chat.post(user, text)
+    except chat_buffer.BufferFull:
+        return False
+    return True
+
+
+async def chat_socket(scope, receive, send):
+    """
+    WebSocket for the community chat. Clients send ``{"message": "..."}``;
+    every connected member receives ``{"type": "chat", "message": {...}}``
+    for each new message, their own included.
+    """
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    user = await authenticate(scope) if same_origin(scope) else None
+    if user is None:
+        # Closing before accepting rejects the handshake with a 403
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+
+    await send({'type': 'websocket.accept'})
+    subscription = await realtime.get_hub().subscribe(realtime.CHAT_CHANNEL, drop_oldest=False)
+    post = sync_to_async(_post_chat_message, thread_sensitive=False)
+
+    async def forward_events():
+        while True:
+            event = await subscription.get(timeout=HEARTBEAT_SECONDS)
+            if event is None:
+                continue
+            message = dict(event['message'], mine=event['message']['user']['id'] == user.pk)
+            await send({'type': 'websocket.send', 'text': json.dumps({'type': 'chat', 'message': message})})
+
+    async def read_messages():
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            try:
+                text = json.loads(message.get('text') or '{}').get('message', '')
+            except (ValueError, AttributeError):
+                text = ''
+            text = str(text).strip()[:chat.MAX_MESSAGE_LENGTH]
+            if text and not await post(user, text):
+                await send({'type': 'websocket.send', 'text': json.dumps({'type': 'error', 'error': 'busy'})})
+
+    forwarder = asyncio.create_task(forward_events())
+    reader = asyncio.create_task(read_messages())
+    try:
+        done, _ = await asyncio.wait([forwarder, reader], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            try:
+                task.result()
+            except realtime.SlowConsumer:
+                await send({'type': 'websocket.close', 'code': SLOW_CONSUMER_CLOSE_CODE})
+    finally:
+        forwarder.cancel()
+        reader.cancel()
+        await subscription.close()
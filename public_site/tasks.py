@@ -0,0 +1,27 @@
+from jobs.queue import job
+from .models import Announcement, Activity, BlogPost, FinancialRecord, Photo
+from . import images, notifications
+
+NOTIFIERS = {
+    'announcement': (Announcement, notifications.notify_announcement),
+    'activity': (Activity, notifications.notify_activity),
+    'blog': (BlogPost, notifications.notify_blog_post),
+    'financial': (FinancialRecord, notifications.notify_financial_record),
+}
+
+
+@job('public_site.notify')
+def notify(kind, pk):
+    """Fan out the notification for a newly created object"""
+    model, notifier = NOTIFIERS[kind]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is not None:
+        notifier(instance)
+
+
+@job('public_site.photo_derivatives')
+def photo_derivatives(pk):
+    """Write the resized copies of a newly uploaded or replaced photo"""
+    photo = Photo.objects.filter(pk=pk).first()
+    if photo is not None:
+        images.process(photo)
@@ -0,0 +1,16 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from public_site import bundles
+
+register = template.Library()
+
+
+@register.simple_tag
+def inline_bundle(name):
+    """
+    A built bundle's content, for ``<style>`` and ``<script>`` elements::
+
+        <style>{% inline_bundle 'critical.css' %}</style>
+    """
+    return mark_safe(bundles.inline(name))
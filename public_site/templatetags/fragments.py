@@ -0,0 +1,32 @@
+from django import template
+
+from public_site import fragments
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, section, nodelist):
+        self.section = section
+        self.nodelist = nodelist
+
+    def render(self, context):
+        section = self.section.resolve(context)
+        return fragments.get_or_render(section, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def fragment(parser, token):
+    """
+    Cache the enclosed template until the section's models change::
+
+        {% fragment 'announcements' %}...{% endfragment %}
+
+    The section must be listed in ``public_site.fragments.SECTION_MODELS``.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes one argument, the section name")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(parser.compile_filter(bits[1]), nodelist)
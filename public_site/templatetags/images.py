@@ -0,0 +1,42 @@
+from django import template
+from django.utils.html import format_html
+
+from public_site import images
+
+register = template.Library()
+
+# The gallery grid: one column on phones, then tiles at least 250px wide
+# in a container at most 1200px wide
+GALLERY_SIZES = '(max-width: 600px) 90vw, (max-width: 1000px) 45vw, 300px'
+
+
+@register.simple_tag
+def photo_img(photo, sizes=GALLERY_SIZES):
+    """
+    A gallery photo as a ``<picture>`` with WebP and JPEG srcsets, explicit
+    dimensions and a blurred placeholder::
+
+        {% photo_img photo %}
+        {% photo_img photo sizes='100vw' %}
+
+    Photos whose derivatives aren't written yet show the original image.
+    """
+    if not images.is_current(photo):
+        return format_html('<img src="{}" alt="{}" loading="lazy">', photo.image.url, photo.title)
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" '
+        'loading="lazy" decoding="async" style="background: url({}) center / cover no-repeat">'
+        '</picture>',
+        images.srcset(photo, 'webp'), sizes,
+        images.fallback_url(photo), images.srcset(photo, 'jpeg'), sizes,
+        photo.width, photo.height, photo.title, photo.placeholder,
+    )
+
+
+@register.simple_tag
+def photo_sizes():
+    """The ``sizes`` attribute ``{% photo_img %}`` uses, for scripts drawing tiles"""
+    return GALLERY_SIZES
@@ -1,3 +1,1608 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from jobs import queue
+from jobs.models import Job
+from users.models import CustomUser, PasswordResetToken
+from .models import Announcement, Activity, BlogPost, ChatMessage, Comment, FinancialRecord, FinancialRollup, Notification, NotificationReadState, Photo
+from . import blog, bundles, chat, chat_buffer, compression, finance, fragments, images, media, middleware, notifications, query_plans, realtime, search, streams
+
+
+def make_user(email, **extra):
+    return CustomUser.objects.create_user(username=email, email=email, **extra)
+
+
+@override_settings(JOBS_RUN_EAGERLY=True)
+class NotificationFanOutTests(TestCase):
+    def setUp(self):
+        self.author = make_user('author@example.com', first_name='Ann', last_name='Author')
+        self.members = [make_user(f'member{i}@example.com') for i in range(5)]
+        make_user('inactive@example.com', is_active=False)
+
+    def test_announcement_notifies_each_member_once(self):
+        announcement = Announcement.objects.create(title='Service', content='Sunday', author=self.author)
+
+        notified = Notification.objects.filter(event_key=f'announcement:{announcement.pk}')
+        self.assertEqual(notified.count(), len(self.members))
+        self.assertFalse(notified.filter(user=self.author).exists())
+        self.assertEqual(notified.values('user').distinct().count(), len(self.members))
+
+    def test_activity_notifies_author_too(self):
+        Activity.objects.create(title='Retreat', description='Camp', activity_type='upcoming', date='2025-01-01')
+        self.assertEqual(Notification.objects.filter(notification_type='activity').count(), len(self.members) + 1)
+
+    def test_fan_out_is_idempotent_and_batched(self):
+        post = BlogPost.objects.create(title='Hello', content='World', author=self.author)
+
+        result = notifications.fan_out(
+            f'blog:{post.pk}', 'title', 'message', 'blog', exclude_user_id=self.author.pk, batch_size=2,
+        )
+        self.assertEqual(result.created, 0)
+        self.assertEqual(Notification.objects.filter(event_key=f'blog:{post.pk}').count(), len(self.members))
+
+    def test_fan_out_reports_rows_written(self):
+        # One recipient query, then per batch of two: savepoint, state rows,
+        # lock, existing rows, insert, inserted rows, counter bump, release
+        with self.assertNumQueries(1 + 3 * 8):
+            result = notifications.fan_out('custom:1', 'title', 'message', 'other', batch_size=2)
+        self.assertEqual(result.created, len(self.members) + 1)
+        self.assertGreaterEqual(result.elapsed, 0)
+
+    def test_rewritten_batch_counts_and_bumps_only_new_rows(self):
+        first, second = self.members[:2]
+        notifications.fan_out('custom:2', 'title', 'message', 'other', batch_size=2)
+        Notification.objects.filter(event_key='custom:2', user=second).delete()
+        before = NotificationReadState.objects.get(user=first).unread_count
+
+        # As when two fan-outs of one event race past the recipient query
+        created = notifications._write_batch([
+            Notification(user=member, title='title', notification_type='other', event_key='custom:2')
+            for member in (first, second)
+        ])
+        self.assertEqual(created, 1)
+        self.assertEqual(NotificationReadState.objects.get(user=first).unread_count, before)
+        self.assertEqual(Notification.objects.filter(event_key='custom:2').count(), len(self.members) + 1)
+
+    def test_fan_out_publishes_each_batch_after_commit(self):
+        with mock.patch.object(realtime, 'publish_all') as publish_all:
+            with self.captureOnCommitCallbacks(execute=True):
+                notifications.fan_out('custom:3', 'title', 'message', 'other', batch_size=4)
+                publish_all.assert_not_called()
+
+        self.assertEqual(publish_all.call_count, 2)
+        published = [event for call in publish_all.call_args_list for event in call.args[0]]
+        self.assertEqual(
+            sorted(channel for channel, _ in published),
+            sorted(f'user:{user.pk}' for user in [self.author, *self.members]),
+        )
+        self.assertEqual(
+            {event['id'] for _, event in published},
+            set(Notification.objects.filter(event_key='custom:3').values_list('pk', flat=True)),
+        )
+
+    @override_settings(NOTIFICATION_DELIVERY='broadcast')
+    def test_broadcast_publishes_once(self):
+        with mock.patch.object(realtime, 'publish_all') as publish_all:
+            with self.captureOnCommitCallbacks(execute=True):
+                notifications.fan_out('custom:4', 'title', 'message', 'other')
+                notifications.fan_out('custom:4', 'title', 'message', 'other')
+
+        (events,), _ = publish_all.call_args
+        self.assertEqual([(channel, event['title']) for channel, event in events], [('broadcast', 'title')])
+
+    @override_settings(JOBS_RUN_EAGERLY=False)
+    def test_notifications_are_queued_for_the_worker(self):
+        post = BlogPost.objects.create(title='Hello', content='World', author=self.author)
+        self.assertFalse(Notification.objects.exists())
+        job = Job.objects.get(name='public_site.notify')
+        self.assertEqual(job.payload, {'kind': 'blog', 'pk': post.pk})
+
+        queue.run(queue.claim('test', 1)[0])
+        self.assertEqual(Notification.objects.count(), len(self.members))
+
+    def test_small_financial_record_is_not_announced(self):
+        FinancialRecord.objects.create(offering=100, donations=200)
+        FinancialRecord.objects.create(offering=1000, donations=500)
+        self.assertEqual(Notification.objects.filter(notification_type='financial').count(), len(self.members) + 1)
+
+
+@override_settings(NOTIFICATION_DELIVERY='broadcast', JOBS_RUN_EAGERLY=True)
+class BroadcastNotificationTests(TestCase):
+    def setUp(self):
+        self.author = make_user('author@example.com')
+        self.member = make_user('member@example.com')
+        self.other = make_user('other@example.com')
+
+    def reload(self, user):
+        return CustomUser.objects.get(pk=user.pk)
+
+    def test_event_is_stored_once(self):
+        announcement = Announcement.objects.create(title='Service', content='Sunday', author=self.author)
+        notifications.notify_announcement(announcement)
+
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertIsNone(Notification.objects.get().user)
+
+    def test_unread_resolves_per_member_state(self):
+        Announcement.objects.create(title='One', content='x', author=self.author)
+        Activity.objects.create(title='Two', description='x', activity_type='upcoming', date='2025-01-01')
+        first, second = Notification.objects.order_by('pk')
+
+        self.assertEqual(self.member.notification_set.unread().count(), 2)
+        self.assertEqual(self.author.notification_set.unread().count(), 1)
+
+        self.assertTrue(notifications.mark_read(self.member, first.pk))
+        member = self.reload(self.member)
+        self.assertEqual(list(member.notification_set.unread()), [second])
+        self.assertEqual(list(member.notification_set.read()), [first])
+        self.assertEqual(notifications.unread_count(self.reload(self.other)), 2)
+
+        notifications.mark_all_read(member)
+        self.assertEqual(notifications.unread_count(self.reload(self.member)), 0)
+
+    def test_author_cannot_mark_hidden_broadcast(self):
+        Announcement.objects.create(title='One', content='x', author=self.author)
+        self.assertFalse(notifications.mark_read(self.author, Notification.objects.get().pk))
+
+
+@override_settings(JOBS_RUN_EAGERLY=True, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.author = make_user('author@example.com')
+        self.member = make_user('member@example.com')
+        Announcement.objects.create(title='One', content='x', author=self.author)
+        Activity.objects.create(title='Two', description='x', activity_type='upcoming', date='2025-01-01')
+
+    def stored_count(self, user):
+        return NotificationReadState.objects.get(user=user).unread_count
+
+    def test_fan_out_and_mark_read_keep_counter_in_step(self):
+        self.assertEqual(self.stored_count(self.member), 2)
+        self.assertEqual(self.stored_count(self.author), 1)
+
+        first = self.member.notification_set.first()
+        notifications.mark_read(self.member, first.pk)
+        notifications.mark_read(self.member, first.pk)
+        self.assertEqual(self.stored_count(self.member), 1)
+
+        notifications.mark_all_read(self.member)
+        self.assertEqual(self.stored_count(self.member), 0)
+        self.assertEqual(self.stored_count(self.author), 1)
+
+    def test_mark_all_read_subtracts_what_it_marked(self):
+        # A bump from a fan-out whose row this update didn't see
+        NotificationReadState.objects.filter(user=self.member).update(unread_count=3)
+        notifications.mark_all_read(self.member)
+        self.assertEqual(self.stored_count(self.member), 1)
+        self.assertFalse(self.member.notification_set.filter(is_read=False).exists())
+
+    def test_badge_is_a_single_lookup(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(notifications.unread_count(self.member), 2)
+
+    @override_settings(NOTIFICATION_BELL_CACHE_TTL=60)
+    def test_admin_toggle_updates_counter_and_bell(self):
+        admin = make_user('admin@example.com', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        notification = self.member.notification_set.first()
+        self.assertEqual(notifications.bell(self.member).count, 2)
+
+        with mock.patch.object(realtime, 'publish') as publish:
+            response = self.client.post(reverse('admin:public_site_notification_change', args=[notification.pk]), {
+                'user': self.member.pk,
+                'title': notification.title,
+                'message': notification.message,
+                'notification_type': notification.notification_type,
+                'event_key': notification.event_key,
+                'is_read': 'on',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stored_count(self.member), 1)
+        self.assertEqual(notifications.bell(CustomUser.objects.get(pk=self.member.pk)).count, 1)
+        publish.assert_called_once_with(f'user:{self.member.pk}', {'type': 'unread'})
+
+        response = self.client.post(reverse('admin:public_site_notification_changelist'), {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': list(self.member.notification_set.values_list('pk', flat=True)),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(notifications.bell(CustomUser.objects.get(pk=self.member.pk)).count, 0)
+
+    def test_reconcile_fixes_drift(self):
+        NotificationReadState.objects.update(unread_count=7)
+        out = StringIO()
+        call_command('reconcile_notification_counts', stdout=out)
+        self.assertIn('Fixed 2', out.getvalue())
+        self.assertEqual(self.stored_count(self.member), 2)
+        self.assertEqual(self.stored_count(self.author), 1)
+
+
+@override_settings(JOBS_RUN_EAGERLY=True, NOTIFICATION_BELL_CACHE_TTL=0)
+class NotificationBellTests(TestCase):
+    def setUp(self):
+        self.member = make_user('member@example.com')
+        self.client.force_login(self.member)
+
+    def header_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('announcements'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx), response
+
+    def test_header_query_count_is_constant(self):
+        notifications.fan_out('event:0', 'First', 'message', 'other')
+        baseline, response = self.header_queries()
+        self.assertEqual(response.context['notification_bell'].count, 1)
+
+        for i in range(1, 25):
+            notifications.fan_out(f'event:{i}', f'Event {i}', 'message', 'other')
+        queries, response = self.header_queries()
+
+        self.assertEqual(queries, baseline)
+        bell = response.context['notification_bell']
+        self.assertEqual(bell.count, 25)
+        self.assertEqual(len(bell.items), 10)
+        self.assertContains(response, 'View all 25 notifications')
+
+    @override_settings(NOTIFICATION_BELL_CACHE_TTL=60)
+    def test_bell_is_cached_until_member_reads(self):
+        cache.clear()
+        notifications.fan_out('event:1', 'First', 'message', 'other')
+        uncached, _ = self.header_queries()
+        cached, _ = self.header_queries()
+        self.assertEqual(cached, uncached - 2)
+
+        notifications.mark_all_read(self.member)
+        _, response = self.header_queries()
+        self.assertEqual(response.context['notification_bell'].count, 0)
+
+    def test_anonymous_pages_skip_the_bell(self):
+        self.client.logout()
+        response = self.client.get(reverse('announcements'))
+        self.assertNotIn('notification_bell', response.context)
+
+
+class PruneTests(TestCase):
+    def setUp(self):
+        self.member = make_user('member@example.com')
+        old = timezone.now() - timedelta(days=200)
+        for i in range(5):
+            Notification.objects.create(user=self.member, title=f'old read {i}', notification_type='x', is_read=True)
+        Notification.objects.create(user=self.member, title='old unread', notification_type='x')
+        Notification.objects.update(created_at=old)
+        Notification.objects.create(user=self.member, title='new read', notification_type='x', is_read=True)
+        PasswordResetToken.objects.create(user=self.member, token='used', used=True)
+        PasswordResetToken.objects.create(user=self.member, token='fresh')
+
+    def test_dry_run_reports_without_deleting(self):
+        out = StringIO()
+        call_command('prune', 'notifications', '--dry-run', stdout=out)
+        self.assertIn('notifications (read notifications older than 90 days): 5 rows', out.getvalue())
+        self.assertEqual(Notification.objects.count(), 7)
+
+    def test_prune_deletes_in_batches_and_archives(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            call_command('prune', 'notifications', 'password_reset_tokens',
+                         '--batch-size', '2', '--archive-dir', archive_dir, stdout=StringIO())
+
+            names = sorted(os.listdir(archive_dir))
+            self.assertEqual(len(names), 2)
+            with gzip.open(os.path.join(archive_dir, names[0]), 'rt') as f:
+                archived = [json.loads(line) for line in f]
+
+        self.assertEqual(len(archived), 5)
+        self.assertEqual(archived[0]['model'], 'public_site.Notification')
+        self.assertEqual(
+            sorted(Notification.objects.values_list('title', flat=True)), ['new read', 'old unread'],
+        )
+        self.assertEqual(list(PasswordResetToken.objects.values_list('token', flat=True)), ['fresh'])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(CommandError):
+            call_command('prune', 'everything', stdout=StringIO())
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', '--min-rows', '-1', stdout=out)
+        self.assertIn('All', out.getvalue())
+
+    def test_full_scan_of_large_table_fails(self):
+        make_user('member@example.com')
+        queries = [('unindexed', CustomUser.objects.filter(first_name='x'))]
+        report, = query_plans.check(0, queries)
+        self.assertEqual(report.large_scans, {'users_customuser': 1})
+
+    @override_settings(NOTIFICATION_DELIVERY='broadcast')
+    def test_bell_reads_its_indexes_in_order(self):
+        member = make_user('member@example.com')
+        for queryset in notifications.bell_queries(member):
+            plan = queryset.explain()
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('MULTI-INDEX OR', plan)
+
+    def test_postgres_plan_parsing(self):
+        plan = (
+            "Limit  (cost=0.15..0.35 rows=5 width=8)\n"
+            "  ->  Seq Scan on public_site_activity  (cost=0.00..1.05 rows=5 width=8)"
+        )
+        self.assertEqual(query_plans.scanned_tables(plan, vendor='postgresql'), ['public_site_activity'])
+
+
+class HubTests(TestCase):
+    def test_slow_subscriber_drops_oldest_events(self):
+        async def scenario():
+            hub = realtime.Hub(realtime.LocalBackend(), queue_size=2)
+            subscription = await hub.subscribe('user:1')
+            for i in range(4):
+                hub.publish('user:1', {'id': i})
+            received = [await subscription.get(0.1), await subscription.get(0.1), await subscription.get(0.01)]
+            await subscription.close()
+            return received, subscription.dropped, hub.subscriber_count
+
+        received, dropped, remaining = async_to_sync(scenario)()
+        self.assertEqual(received, [{'id': 2}, {'id': 3}, None])
+        self.assertEqual(dropped, 2)
+        self.assertEqual(remaining, 0)
+
+    def test_polling_backend_maps_rows_to_channels(self):
+        member = make_user('member@example.com')
+        other = make_user('other@example.com')
+        since = timezone.now()
+        personal = Notification.objects.create(user=member, title='mine', notification_type='x')
+        Notification.objects.create(user=other, title='theirs', notification_type='x')
+        broadcast = Notification.objects.create(title='everyone', notification_type='x')
+
+        # Only the channels someone in this process is subscribed to
+        events = realtime.DatabasePollingBackend.fetch({f'user:{member.pk}', 'broadcast'}, since)
+        self.assertEqual(
+            [(channel, event['id']) for channel, event in events],
+            [(f'user:{member.pk}', personal.pk), ('broadcast', broadcast.pk)],
+        )
+        self.assertEqual(realtime.DatabasePollingBackend.fetch({'chat'}, since), [])
+
+    def test_polling_reads_every_page_and_rows_committed_late(self):
+        members = [make_user(f'member{i}@example.com') for i in range(3)]
+        channels = {f'user:{member.pk}' for member in members}
+        since = timezone.now()
+        rows = Notification.objects.bulk_create([
+            Notification(id=10 + i, user=members[i % 3], title=f'n{i}', notification_type='x') for i in range(7)
+        ])
+        backend = realtime.DatabasePollingBackend()
+        backend.hub = realtime.Hub(backend)
+        delivered = []
+        backend.hub.publish = lambda channel, event: delivered.append(event['id'])
+
+        now = timezone.now()
+        with mock.patch.object(realtime.DatabasePollingBackend, 'page_size', 3), self.assertNumQueries(3):
+            backend.deliver(backend.fetch_new(channels, since), now, since)
+        self.assertEqual(delivered, [row.pk for row in rows])
+
+        # A lower id than any seen, committed after the last poll
+        Notification.objects.create(id=5, user=members[0], title='late', notification_type='x')
+        backend.deliver(backend.fetch_new(channels, since), now, since)
+        self.assertEqual(delivered, [row.pk for row in rows] + [5])
+
+
+@override_settings(REALTIME_BACKEND='public_site.realtime.LocalBackend', NOTIFICATION_BELL_CACHE_TTL=0)
+class NotificationStreamTests(TransactionTestCase):
+    def setUp(self):
+        realtime._hub = None
+        self.member = make_user('member@example.com')
+        Notification.objects.create(user=self.member, title='waiting', notification_type='x')
+        notifications.rebuild_unread_counts()
+        self.client.force_login(self.member)
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    def stream(self, cookie, until):
+        """Run the stream until ``until(body)`` is true, then disconnect"""
+        async def scenario():
+            messages = []
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {'type': 'http', 'path': '/notifications/stream/', 'headers': [(b'cookie', cookie.encode())]}
+            task = asyncio.create_task(streams.notification_stream(scope, receive, send))
+            for _ in range(100):
+                await asyncio.sleep(0.02)
+                body = b''.join(m.get('body', b'') for m in messages)
+                if until(body):
+                    break
+                if b'event: unread' in body and not getattr(scenario, 'published', False):
+                    scenario.published = True
+                    realtime.get_hub().publish('broadcast', {
+                        'type': 'notification', 'id': 99, 'title': 'Live', 'message': '', 'actor_id': None,
+                    })
+            disconnect.set()
+            await asyncio.wait_for(task, 5)
+            return messages
+
+        return async_to_sync(scenario)()
+
+    def test_stream_sends_count_then_pushed_notifications(self):
+        messages = self.stream(self.cookie, lambda body: b'event: notification' in body)
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), messages[0]['headers'])
+        body = b''.join(m.get('body', b'') for m in messages)
+        self.assertIn(b'event: unread\ndata: {"count": 1}', body)
+        self.assertIn(b'id: 99\nevent: notification', body)
+        self.assertEqual(realtime.get_hub().subscriber_count, 0)
+
+    def test_anonymous_stream_is_refused(self):
+        messages = self.stream('', lambda body: True)
+        self.assertEqual(messages[0]['status'], 403)
+
+
+@override_settings(CHAT_PAGE_SIZE=3)
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        self.member = make_user('member@example.com', first_name='Grace')
+        self.other = make_user('other@example.com')
+        # Two messages share a timestamp so the id tie-break matters
+        now = timezone.now()
+        stamps = [now - timedelta(minutes=5 - i) for i in range(5)]
+        stamps.insert(3, stamps[2])
+        self.messages = []
+        for i, stamp in enumerate(stamps):
+            message = ChatMessage.objects.create(user=self.member if i % 2 else self.other, message=f'm{i}')
+            ChatMessage.objects.filter(pk=message.pk).update(timestamp=stamp)
+            self.messages.append(message.pk)
+
+    def ids(self, page):
+        return [message.pk for message in page.messages]
+
+    def test_first_page_is_newest_messages_oldest_first(self):
+        page = chat.page()
+        self.assertEqual(self.ids(page), self.messages[-3:])
+        self.assertTrue(page.has_more)
+
+    def test_walking_back_and_forward_visits_every_message_once(self):
+        seen = []
+        page = chat.page()
+        while True:
+            seen = self.ids(page) + seen
+            if not page.has_more:
+                break
+            page = chat.page(before_id=seen[0])
+        self.assertEqual(seen, self.messages)
+
+        forward = self.ids(chat.page(after_id=self.messages[1]))
+        self.assertEqual(forward, self.messages[2:5])
+        self.assertEqual(self.ids(chat.page(after_id=self.messages[-1])), [])
+
+    def test_each_page_is_two_queries(self):
+        with self.assertNumQueries(2):
+            page = chat.page(before_id=self.messages[-1])
+            [message.user.get_full_name() for message in page.messages]
+
+    def test_json_api(self):
+        self.client.force_login(self.member)
+        response = self.client.get(reverse('chat_messages'), {'after_id': self.messages[2]})
+        data = response.json()
+        self.assertEqual([m['id'] for m in data['messages']], self.messages[3:6])
+        self.assertFalse(data['has_more'])
+        self.assertEqual(data['messages'][0]['user']['name'], 'Grace')
+        self.assertTrue(data['messages'][0]['mine'])
+
+        self.assertEqual(self.client.get(reverse('chat_messages'), {'before_id': 'x'}).status_code, 400)
+
+    def test_send_message_returns_json_when_asked(self):
+        self.client.force_login(self.member)
+        response = self.client.post(reverse('send_message'), {'message': 'hello'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['message']['message'], 'hello')
+        response = self.client.post(reverse('send_message'), {'message': 'hi'})
+        self.assertRedirects(response, reverse('community_chat'))
+
+
+class RelayTests(TestCase):
+    def test_events_reach_subscribers_in_other_processes(self):
+        async def scenario():
+            server = await realtime.Relay().serve('127.0.0.1', 0)
+            url = 'tcp://127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+            # Two hubs stand in for two web processes
+            first, second = realtime.Hub(realtime.RelayBackend(url)), realtime.Hub(realtime.RelayBackend(url))
+            mine = await first.subscribe('chat')
+            theirs = await second.subscribe('chat')
+            await first.backend.connected.wait()
+            await second.backend.connected.wait()
+
+            first.backend.publish('chat', {'n': 1})
+            received = [await mine.get(1), await theirs.get(1)]
+            await mine.close()
+            await theirs.close()
+            server.close()
+            await server.wait_closed()
+            return received
+
+        self.assertEqual(async_to_sync(scenario)(), [{'n': 1}, {'n': 1}])
+
+    def test_strict_subscription_overflows_instead_of_dropping(self):
+        async def scenario():
+            hub = realtime.Hub(realtime.LocalBackend(), queue_size=1)
+            subscription = await hub.subscribe('chat', drop_oldest=False)
+            hub.publish('chat', {'n': 1})
+            hub.publish('chat', {'n': 2})
+            with self.assertRaises(realtime.SlowConsumer):
+                await subscription.get(0.1)
+            await subscription.close()
+
+        async_to_sync(scenario)()
+
+
+@override_settings(REALTIME_BACKEND='public_site.realtime.LocalBackend')
+class ChatSocketTests(TransactionTestCase):
+    def setUp(self):
+        realtime._hub = None
+        self.member = make_user('member@example.com', first_name='Grace')
+        self.client.force_login(self.member)
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    def converse(self, headers, texts=()):
+        """Connect, send ``texts``, and return what the server sent until the echoes arrive"""
+        async def scenario():
+            inbox = asyncio.Queue()
+            inbox.put_nowait({'type': 'websocket.connect'})
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'websocket', 'path': '/community/ws/', 'headers': headers}
+            task = asyncio.create_task(streams.chat_socket(scope, inbox.get, send))
+            for _ in range(100):
+                await asyncio.sleep(0.02)
+                if task.done() or realtime.get_hub().subscriber_count:
+                    break
+            for text in texts:
+                inbox.put_nowait({'type': 'websocket.receive', 'text': json.dumps({'message': text})})
+            for _ in range(100):
+                if task.done() or len([m for m in sent if m['type'] == 'websocket.send']) >= len(texts):
+                    break
+                await asyncio.sleep(0.02)
+            inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+            await asyncio.wait_for(task, 5)
+            return sent
+
+        return async_to_sync(scenario)()
+
+    def test_messages_are_saved_and_echoed(self):
+        sent = self.converse([(b'cookie', self.cookie.encode())], ['hello', '  '])
+        self.assertEqual(sent[0], {'type': 'websocket.accept'})
+        event = json.loads(sent[1]['text'])
+        self.assertEqual(event['message']['message'], 'hello')
+        self.assertEqual(event['message']['user']['name'], 'Grace')
+        self.assertTrue(event['message']['mine'])
+        self.assertEqual(list(ChatMessage.objects.values_list('message', flat=True)), ['hello'])
+        self.assertEqual(realtime.get_hub().subscriber_count, 0)
+
+    def test_anonymous_and_cross_site_handshakes_are_refused(self):
+        self.assertEqual(self.converse([])[0]['type'], 'websocket.close')
+        cross_site = [(b'cookie', self.cookie.encode()), (b'origin', b'https://evil.example'), (b'host', b'testserver')]
+        self.assertEqual(self.converse(cross_site)[0]['type'], 'websocket.close')
+
+    def test_benchmark_runs(self):
+        out = StringIO()
+        call_command('bench_chat', clients=3, senders=1, messages=2, stdout=out)
+        self.assertIn('6/6 deliveries', out.getvalue())
+        self.assertFalse(ChatMessage.objects.exists())
+
+
+class ChatBufferTests(TestCase):
+    def setUp(self):
+        self.member = make_user('member@example.com')
+
+    def test_flush_saves_in_order_and_publishes_real_ids(self):
+        buffer = chat_buffer.ChatBuffer(max_size=10, batch_size=2, background=False)
+        accepted = [buffer.submit(self.member, f'Amen {n}') for n in range(3)]
+        self.assertEqual(len({a.provisional_id for a in accepted}), 3)
+        self.assertFalse(ChatMessage.objects.exists())
+
+        published = []
+        with mock.patch.object(realtime, 'publish', lambda channel, event: published.append(event)):
+            with self.assertNumQueries(2):
+                self.assertEqual(buffer.flush(), 3)
+
+        saved = list(ChatMessage.objects.order_by('pk').values_list('pk', 'message'))
+        self.assertEqual([text for _, text in saved], ['Amen 0', 'Amen 1', 'Amen 2'])
+        self.assertEqual(
+            [(e['message']['id'], e['message']['client_id']) for e in published],
+            [(pk, a.provisional_id) for (pk, _), a in zip(saved, accepted)],
+        )
+
+    def test_full_buffer_refuses_posts(self):
+        buffer = chat_buffer.ChatBuffer(max_size=1, batch_size=10, background=False)
+        buffer.submit(self.member, 'first')
+        with self.assertRaises(chat_buffer.BufferFull):
+            buffer.submit(self.member, 'second')
+
+
+@override_settings(CHAT_WRITE_BEHIND=True, CHAT_FLUSH_INTERVAL=0.01)
+class WriteBehindViewTests(TransactionTestCase):
+    def tearDown(self):
+        chat_buffer._buffer = None
+
+    def test_post_is_acknowledged_then_saved_on_close(self):
+        member = make_user('member@example.com')
+        self.client.force_login(member)
+        response = self.client.post(reverse('send_message'), {'message': 'Amen'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertIn('provisional_id', response.json())
+
+        chat_buffer.get_buffer().close()
+        self.assertEqual(list(ChatMessage.objects.values_list('message', flat=True)), ['Amen'])
+
+
+@override_settings(BLOG_PAGE_SIZE=5, BLOG_INLINE_COMMENTS=2, NOTIFICATION_BELL_CACHE_TTL=0)
+class BlogPageTests(TestCase):
+    def setUp(self):
+        self.member = make_user('member@example.com', first_name='Grace')
+        self.client.force_login(self.member)
+
+    def add_posts(self, count, comments_each):
+        authors = [make_user(f'author{BlogPost.objects.count() + i}@example.com') for i in range(count)]
+        posts = [BlogPost.objects.create(title=f'Post {i}', content='...', author=author) for i, author in enumerate(authors)]
+        Comment.objects.bulk_create([
+            Comment(post=post, author=authors[n % len(authors)], content=f'Comment {n}')
+            for post in posts for n in range(comments_each)
+        ])
+        # bulk_create skips the signals that keep the counters current
+        blog.rebuild_comment_counters()
+        return posts
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('blog'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_posts_or_comments(self):
+        self.add_posts(1, 1)
+        baseline = self.count_queries()
+        self.add_posts(12, 8)
+        self.assertEqual(self.count_queries(), baseline)
+
+    def test_pages_walk_every_post_once(self):
+        posts = self.add_posts(12, 0)
+        seen = []
+        url = reverse('blog')
+        while url:
+            response = self.client.get(url)
+            seen += [post.pk for post in response.context['posts']]
+            cursor = response.context['next_cursor']
+            url = f"{reverse('blog')}?before_id={cursor}" if cursor else None
+        self.assertEqual(seen, sorted((post.pk for post in posts), reverse=True))
+
+    def test_inline_comments_are_the_latest_and_the_rest_come_from_the_api(self):
+        post, = self.add_posts(1, 5)
+        response = self.client.get(reverse('blog'))
+        shown = response.context['posts'][0]
+        self.assertEqual(shown.comment_count, 5)
+        self.assertEqual([c.content for c in shown.recent_comments], ['Comment 3', 'Comment 4'])
+        self.assertContains(response, 'Show all 5 comments')
+
+        url = reverse('post_comments', args=[post.pk])
+        first = self.client.get(url, {'limit': 3}).json()
+        self.assertEqual([c['content'] for c in first['comments']], ['Comment 0', 'Comment 1', 'Comment 2'])
+        self.assertTrue(first['has_more'])
+        rest = self.client.get(url, {'after_id': first['comments'][-1]['id']}).json()
+        self.assertEqual([c['content'] for c in rest['comments']], ['Comment 3', 'Comment 4'])
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(self.client.get(reverse('post_comments', args=[post.pk + 1])).status_code, 404)
+
+
+class CommentCounterTests(TestCase):
+    def setUp(self):
+        self.member = make_user('member@example.com')
+        self.post = BlogPost.objects.create(title='Post', content='...', author=self.member)
+
+    def comment(self, content='Amen'):
+        return Comment.objects.create(post=self.post, author=self.member, content=content)
+
+    def test_counters_follow_comments(self):
+        first = self.comment()
+        second = self.comment()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        self.assertEqual(self.post.last_commented_at, second.date)
+
+        second.delete()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.last_commented_at), (1, first.date))
+
+        first.delete()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.last_commented_at), (0, None))
+
+    def test_each_change_is_one_update(self):
+        def post_updates(queries):
+            return [q for q in queries if q['sql'].startswith('UPDATE "public_site_blogpost"')]
+
+        with CaptureQueriesContext(connection) as queries:
+            comment = self.comment()
+        self.assertEqual(len(post_updates(queries)), 1)
+        with CaptureQueriesContext(connection) as queries:
+            comment.delete()
+        self.assertEqual(len(post_updates(queries)), 1)
+
+    def test_reconcile_repairs_drift(self):
+        comment = self.comment()
+        BlogPost.objects.update(comment_count=7, last_commented_at=None)
+        out = StringIO()
+        call_command('reconcile_comment_counts', stdout=out)
+        self.assertIn('Fixed 1 blog posts', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.last_commented_at), (1, comment.date))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.member = make_user('member@example.com')
+
+    def kinds_and_titles(self, text, member=None):
+        return [(hit.kind, hit.title) for hit in search.search(text, member)]
+
+    def test_title_matches_rank_above_body_matches(self):
+        Announcement.objects.create(title='Choir news', content='The harvest festival choir sings on Sunday', author=self.member)
+        Announcement.objects.create(title='Harvest festival', content='Bring produce to the altar', author=self.member)
+        self.assertEqual(
+            [title for _, title in self.kinds_and_titles('harvest')],
+            ['Harvest festival', 'Choir news'],
+        )
+
+    def test_index_follows_saves_and_deletes(self):
+        activity = Activity.objects.create(title='Youth camp', description='A weekend away', activity_type='upcoming', date=timezone.now().date())
+        self.assertEqual(self.kinds_and_titles('camp'), [('activity', 'Youth camp')])
+
+        activity.title = 'Youth retreat'
+        activity.save()
+        self.assertEqual(self.kinds_and_titles('camp'), [])
+        self.assertEqual(self.kinds_and_titles('retre'), [('activity', 'Youth retreat')])
+
+        activity.delete()
+        self.assertEqual(self.kinds_and_titles('retreat'), [])
+
+    def test_visibility(self):
+        post = BlogPost.objects.create(title='Prayer request', content='Please pray', author=self.member)
+        Comment.objects.create(post=post, author=self.member, content='Praying for you')
+        Announcement.objects.create(title='Prayer meeting', content='Cancelled', author=self.member, is_active=False)
+
+        self.assertEqual(self.kinds_and_titles('prayer'), [])
+        self.assertEqual(
+            sorted(kind for kind, _ in self.kinds_and_titles('pray', self.member)),
+            ['blog', 'comment'],
+        )
+
+    def test_search_syntax_is_treated_as_text(self):
+        Announcement.objects.create(title='Choir "NEAR" practice', content='OR AND NOT', author=self.member)
+        for text in ['"', 'NEAR(', 'choir OR', 'title:choir', '*', 'AND NOT']:
+            search.search(text, self.member)
+        self.assertEqual(len(search.search('choir OR', self.member)), 1)
+
+    def test_search_page_and_admin_use_the_index(self):
+        Announcement.objects.create(title='Harvest festival', content='...', author=self.member, is_active=False)
+        response = self.client.get(reverse('search'), {'q': 'harvest'})
+        self.assertContains(response, 'Nothing found')
+
+        admin = make_user('admin@example.com', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:public_site_announcement_changelist'), {'q': 'festivals'})
+        self.assertContains(response, 'Harvest festival')
+
+    def test_rows_are_found_by_rowid(self):
+        activity = Activity.objects.create(title='Youth camp', description='...', activity_type='upcoming', date=timezone.now().date())
+        with CaptureQueriesContext(connection) as queries:
+            activity.save()
+            activity.delete()
+        writes = [query['sql'] for query in queries if search.TABLE in query['sql']]
+        self.assertTrue(writes)
+        self.assertFalse([sql for sql in writes if 'kind =' in sql])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {search.TABLE}')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    @override_settings(SEARCH_CANDIDATES=2)
+    def test_only_the_newest_matches_are_ranked(self):
+        Announcement.objects.create(title='Harvest festival', content='...', author=self.member)
+        Announcement.objects.create(title='Choir', content='Harvest hymns', author=self.member)
+        Announcement.objects.create(title='Cleaning', content='After the harvest', author=self.member)
+        # The title match would rank first, but it isn't among the newest two
+        hit, = search.search('harvest', limit=1)
+        self.assertIn(hit.title, ['Choir', 'Cleaning'])
+        self.assertEqual(len(search.search('harvest', limit=3)), 3)
+
+    @override_settings(SEARCH_CANDIDATES=2)
+    def test_candidates_are_capped_per_kind(self):
+        Announcement.objects.create(title='Harvest festival', content='...', author=self.member)
+        post = BlogPost.objects.create(title='Notes', content='...', author=self.member)
+        # Higher comment ids don't push the announcement out
+        for i in range(5):
+            Comment.objects.create(post=post, author=self.member, content=f'Harvest thanks {i}')
+        hits = search.search('harvest', self.member, limit=2)
+        self.assertIn('announcement', [hit.kind for hit in hits])
+
+    def test_comment_hits_load_author_and_post_with_them(self):
+        for i in range(3):
+            post = BlogPost.objects.create(title=f'Post {i}', content='...', author=make_user(f'author{i}@example.com'))
+            Comment.objects.create(post=post, author=post.author, content='Harvest thanks')
+        with self.assertNumQueries(2):
+            titles = [hit.title for hit in search.search('harvest', self.member, kinds=['comment'])]
+        self.assertEqual(len(titles), 3)
+
+    def test_rebuild(self):
+        Announcement.objects.create(title='Harvest festival', content='...', author=self.member)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABLE}')
+        self.assertEqual(self.kinds_and_titles('harvest'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.kinds_and_titles('harvest'), [('announcement', 'Harvest festival')])
+
+
+@override_settings(PAGE_CACHE_TTL=0)
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = make_user('member@example.com', first_name='Grace')
+
+    def get_home(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        tables = {table for query in queries for table in ('announcement', 'activity', 'financialrecord', 'photo')
+                  if f'"public_site_{table}"' in query['sql']}
+        return response, tables
+
+    def test_sections_are_served_from_cache_until_their_model_changes(self):
+        Announcement.objects.create(title='Harvest festival', content='...', author=self.member)
+        response, tables = self.get_home()
+        self.assertContains(response, 'Harvest festival')
+        self.assertEqual(tables, {'announcement', 'activity', 'financialrecord', 'photo'})
+
+        response, tables = self.get_home()
+        self.assertContains(response, 'Harvest festival')
+        self.assertEqual(tables, set())
+
+        Announcement.objects.create(title='Choir practice', content='...', author=self.member)
+        response, tables = self.get_home()
+        self.assertContains(response, 'Choir practice')
+        self.assertEqual(tables, {'announcement'})
+
+        stats = fragments.stats()
+        self.assertEqual((stats['announcements']['hits'], stats['announcements']['misses']), (1, 2))
+        self.assertEqual((stats['photos']['hits'], stats['photos']['misses']), (2, 1))
+
+    def test_stats_view_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('fragment_cache_stats')).status_code, 302)
+        self.client.force_login(make_user('staff@example.com', is_staff=True))
+        self.assertIn('announcements', self.client.get(reverse('fragment_cache_stats')).json())
+
+
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = make_user('member@example.com')
+
+    def test_anonymous_pages_are_cached_until_content_changes(self):
+        Announcement.objects.create(title='Harvest festival', content='...', author=self.member)
+        response = self.client.get(reverse('announcements'))
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertIn('Cookie', response['Vary'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('announcements'))
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertContains(response, 'Harvest festival')
+
+        Announcement.objects.create(title='Choir practice', content='...', author=self.member)
+        response = self.client.get(reverse('announcements'))
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'Choir practice')
+
+    def test_stale_copy_is_served_while_another_request_refreshes(self):
+        self.client.get(reverse('activities'))
+        Activity.objects.create(title='Youth camp', description='...', activity_type='upcoming', date=timezone.now().date())
+
+        # Pretend another worker is already re-rendering the page
+        cache.add(middleware.page_key('testserver', reverse('activities')) + ':refreshing', 1)
+        response = self.client.get(reverse('activities'))
+        self.assertEqual(response['X-Page-Cache'], 'STALE')
+        self.assertNotContains(response, 'Youth camp')
+
+    def test_members_bypass_the_cache(self):
+        self.client.get(reverse('home'))
+        self.client.force_login(self.member)
+        response = self.client.get(reverse('home'))
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+
+@override_settings(PAGE_CACHE_TTL=0)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = make_user('member@example.com')
+        Announcement.objects.create(title='Harvest festival', content='...', author=self.member)
+
+    def test_matching_etag_skips_the_listing_and_template(self):
+        response = self.client.get(reverse('announcements'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # Only the aggregate and the section stamps behind the validator run
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('announcements'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.templates, [])
+        self.assertEqual(response.content, b'')
+
+    def test_if_modified_since_is_answered_for_visitors(self):
+        response = self.client.get(reverse('gallery'))
+        response = self.client.get(reverse('gallery'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.templates, [])
+
+    def test_changes_invalidate_the_etag(self):
+        etag = self.client.get(reverse('announcements'))['ETag']
+        announcement = Announcement.objects.create(title='Choir practice', content='...', author=self.member)
+        response = self.client.get(reverse('announcements'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Choir practice')
+
+        # Edits keep the row count and date but still change the page
+        etag = response['ETag']
+        announcement.title = 'Choir rehearsal'
+        announcement.save()
+        self.assertEqual(self.client.get(reverse('announcements'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_edits_saved_by_another_process_invalidate_the_etag(self):
+        activity = Activity.objects.create(title='Youth camp', description='...', activity_type='upcoming', date=timezone.now().date())
+        response = self.client.get(reverse('activities'))
+        etag, modified = response['ETag'], response['Last-Modified']
+
+        # Another worker saves the edit; this process's cache never hears of it
+        local = cache.get_many([fragments.VERSION_KEY.format('activities')])
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=5)):
+            activity.description = 'Bring a sleeping bag'
+            activity.save()
+        cache.set_many(local, None)
+
+        response = self.client.get(reverse('activities'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Bring a sleeping bag')
+        self.assertEqual(self.client.get(reverse('activities'), HTTP_IF_MODIFIED_SINCE=modified).status_code, 200)
+
+    def test_members_get_their_own_etag(self):
+        other = make_user('other@example.com')
+        self.client.force_login(self.member)
+        response = self.client.get(reverse('financial_updates'))
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(reverse('financial_updates'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('financial_updates'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_the_notification_bell_is_part_of_a_members_etag(self):
+        notifications.fan_out('custom:welcome', 'Welcome', 'Hello', 'other')
+        self.client.force_login(self.member)
+        etag = self.client.get(reverse('activities'))['ETag']
+        notifications.mark_all_read(self.member)
+        self.assertEqual(self.client.get(reverse('activities'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(PAGE_CACHE_TTL=300)
+    def test_cached_pages_answer_conditional_requests(self):
+        etag = self.client.get(reverse('announcements'))['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('announcements'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+
+
+def jpeg_upload(name='photo.jpg', size=(2000, 1000)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'teal').save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(JOBS_RUN_EAGERLY=True, PAGE_CACHE_TTL=0)
+class PhotoDerivativeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def test_saving_a_photo_writes_resized_copies(self):
+        photo = Photo.objects.create(title='Choir', image=jpeg_upload(), photo_type='church')
+        photo.refresh_from_db()
+        self.assertEqual((photo.width, photo.height), (2000, 1000))
+        self.assertTrue(photo.placeholder.startswith('data:image/jpeg;base64,'))
+        for fmt in images.FORMATS:
+            self.assertEqual(
+                [(item['width'], item['height']) for item in photo.derivatives[fmt]],
+                [(320, 160), (640, 320), (1280, 640)],
+            )
+        for name in images.files(photo.derivatives):
+            self.assertTrue(default_storage.exists(name))
+        with default_storage.open(photo.derivatives['webp'][0]['name']) as file:
+            self.assertEqual(Image.open(file).format, 'WEBP')
+
+    def test_small_images_are_never_upscaled(self):
+        photo = Photo.objects.create(title='Choir', image=jpeg_upload(size=(500, 250)), photo_type='church')
+        photo.refresh_from_db()
+        self.assertEqual([item['width'] for item in photo.derivatives['jpeg']], [320, 500])
+
+    def test_gallery_uses_srcset_and_dimensions(self):
+        Photo.objects.create(title='Choir', image=jpeg_upload(), photo_type='church')
+        response = self.client.get(reverse('gallery'))
+        self.assertContains(response, '<source type="image/webp" srcset="')
+        self.assertContains(response, '-1280w.jpg 1280w')
+        self.assertContains(response, 'width="2000" height="1000"')
+
+    def test_replacing_the_image_regenerates_and_removes_old_copies(self):
+        photo = Photo.objects.create(title='Choir', image=jpeg_upload(), photo_type='church')
+        photo.refresh_from_db()
+        old = images.files(photo.derivatives)
+        photo.image = jpeg_upload('other.jpg', size=(800, 600))
+        photo.save()
+        photo.refresh_from_db()
+        self.assertEqual(photo.width, 800)
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+
+        photo.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in images.files(photo.derivatives)))
+
+    @override_settings(JOBS_RUN_EAGERLY=False)
+    def test_backfill_command(self):
+        photo = Photo.objects.create(title='Choir', image=jpeg_upload(), photo_type='church')
+        response = self.client.get(reverse('gallery'))
+        self.assertContains(response, f'src="{photo.image.url}"')
+
+        out = StringIO()
+        call_command('generate_photo_derivatives', workers=2, stdout=out)
+        self.assertIn('Processed 1 photos, 0 failed', out.getvalue())
+        photo.refresh_from_db()
+        self.assertTrue(images.is_current(photo))
+
+        call_command('generate_photo_derivatives', stdout=out)
+        self.assertIn('Every photo is up to date', out.getvalue())
+
+
+@override_settings(PAGE_CACHE_TTL=0, GALLERY_PAGE_SIZE=3)
+class GalleryPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Skip the image files; tiles fall back to the stored name
+        self.photos = [
+            Photo.objects.create(title=f'Trip {i}', image=f'gallery/trip{i}.jpg', photo_type='trip',
+                                 album='Naivasha' if i % 2 else 'Mombasa')
+            for i in range(7)
+        ]
+        Photo.objects.create(title='Sanctuary', image='gallery/church.jpg', photo_type='church')
+
+    def test_api_pages_by_keyset_in_constant_queries(self):
+        url = reverse('gallery_photos', args=['trip'])
+        seen = []
+        cursor = ''
+        while True:
+            with self.assertNumQueries(2 if cursor else 1):
+                data = self.client.get(url, {'before_id': cursor}).json()
+            seen += [photo['title'] for photo in data['photos']]
+            if data['next_cursor'] is None:
+                break
+            cursor = data['next_cursor']
+        self.assertEqual(seen, [f'Trip {i}' for i in reversed(range(7))])
+        self.assertEqual(set(data['photos'][0]), {'id', 'title', 'album', 'src', 'width', 'height'})
+
+    def test_api_filters_by_album(self):
+        data = self.client.get(reverse('gallery_photos', args=['trip']), {'album': 'Mombasa', 'limit': 10}).json()
+        self.assertEqual([photo['title'] for photo in data['photos']], ['Trip 6', 'Trip 4', 'Trip 2', 'Trip 0'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_albums_are_cached_until_photos_change(self):
+        url = reverse('gallery_albums', args=['trip'])
+        self.assertEqual(
+            [(album['name'], album['count']) for album in self.client.get(url).json()['albums']],
+            [('Mombasa', 4), ('Naivasha', 3)],
+        )
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        Photo.objects.create(title='Trip 7', image='gallery/trip7.jpg', photo_type='trip', album='Kisumu')
+        self.assertEqual(self.client.get(url).json()['albums'][0]['name'], 'Kisumu')
+
+    def test_page_renders_the_first_screen_only(self):
+        response = self.client.get(reverse('gallery'))
+        self.assertContains(response, 'alt="Trip 6"')
+        self.assertNotContains(response, 'alt="Trip 3"')
+        self.assertContains(response, f'data-next-cursor="{self.photos[4].pk}"')
+        self.assertContains(response, 'alt="Sanctuary"')
+        self.assertContains(response, 'Naivasha (3)')
+
+        response = self.client.get(reverse('gallery'), {'album': 'Naivasha'})
+        self.assertContains(response, 'alt="Trip 5"')
+        self.assertNotContains(response, 'alt="Trip 6"')
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(reverse('gallery_photos', args=['selfies'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('gallery_photos', args=['trip']), {'before_id': 'x'}).status_code, 400)
+
+
+@override_settings(PAGE_CACHE_TTL=0)
+class ImportPhotosTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.addCleanup(shutil.rmtree, self.source)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        # A portrait phone photo stored sideways, with its orientation in EXIF
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (400, 200), 'navy').save(os.path.join(self.source, 'Lake_Naivasha.jpg'), exif=exif)
+        os.makedirs(os.path.join(self.source, 'Mombasa 2024'))
+        Image.new('RGBA', (300, 300), (255, 0, 0, 128)).save(os.path.join(self.source, 'Mombasa 2024', 'beach.png'))
+        shutil.copy(os.path.join(self.source, 'Lake_Naivasha.jpg'), os.path.join(self.source, 'Mombasa 2024', 'copy.jpg'))
+        with open(os.path.join(self.source, 'broken.jpg'), 'wb') as file:
+            file.write(b'not an image')
+
+    def import_photos(self, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_photos', self.source, '--type', 'trip', workers=2, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_validates_and_deduplicates(self):
+        out, err = self.import_photos()
+        self.assertIn('Imported 2 photos, skipped 1 duplicates and 1 invalid files', out)
+        self.assertIn('images/s', out)
+        self.assertIn('broken.jpg', err)
+
+        lake = Photo.objects.get(title='Lake Naivasha')
+        self.assertEqual(lake.album, '')
+        self.assertEqual((lake.width, lake.height), (200, 400))
+        self.assertTrue(images.is_current(lake))
+        with default_storage.open(lake.image.name) as file:
+            stored = Image.open(file)
+            self.assertEqual(stored.size, (200, 400))
+            self.assertEqual(dict(stored.getexif()), {})
+        beach = Photo.objects.get(title='beach')
+        self.assertEqual(beach.album, 'Mombasa 2024')
+        self.assertTrue(beach.image.name.endswith('.png'))
+
+    def test_running_again_imports_nothing_new(self):
+        self.import_photos(chunk_size=1)
+        out, _ = self.import_photos()
+        self.assertIn('Imported 0 photos, skipped 3 duplicates', out)
+        self.assertEqual(Photo.objects.count(), 2)
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), settings.MEDIA_ROOT)
+            for root, _, names in os.walk(settings.MEDIA_ROOT) for name in names
+        )
+
+    def test_resumed_run_reuses_file_names(self):
+        self.import_photos()
+        written = self.stored_files()
+        # As if the files were written but the run died before saving rows
+        Photo.objects.all().delete()
+
+        out, _ = self.import_photos()
+        self.assertIn('Imported 2 photos', out)
+        self.assertEqual(self.stored_files(), written)
+        for photo in Photo.objects.all():
+            self.assertTrue(all(default_storage.exists(name) for name in images.files(photo.derivatives)))
+
+    def test_rows_added_meanwhile_are_not_counted(self):
+        def import_elsewhere_first(rows, **kwargs):
+            bulk_create([Photo(
+                title='elsewhere', image=row.image.name, photo_type='trip', content_hash=row.content_hash,
+            ) for row in rows])
+            return bulk_create(rows, **kwargs)
+
+        bulk_create = Photo.objects.bulk_create
+        with mock.patch.object(Photo.objects, 'bulk_create', import_elsewhere_first):
+            out, _ = self.import_photos()
+        self.assertIn('Imported 0 photos', out)
+        self.assertEqual(set(Photo.objects.values_list('title', flat=True)), {'elsewhere'})
+        # The derivatives this run rendered belong to no photo
+        self.assertFalse([name for name in self.stored_files() if '/derivatives/' in name])
+
+    def test_album_option(self):
+        self.import_photos(album='Retreat')
+        self.assertEqual(set(Photo.objects.values_list('album', flat=True)), {'Retreat'})
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.data = bytes(range(256)) * 40
+        default_storage.save('gallery/harvest.jpg', io.BytesIO(self.data))
+        default_storage.save('gallery/derivatives/harvest-320w.webp', io.BytesIO(b'webp'))
+        self.url = settings.MEDIA_URL + 'gallery/harvest.jpg'
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertRegex(response['ETag'], r'^"[0-9a-f]{32}"$')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+        response = self.client.get(settings.MEDIA_URL + 'gallery/derivatives/harvest-320w.webp')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        with open(os.path.join(settings.MEDIA_ROOT, 'gallery/harvest.jpg'), 'ab') as file:
+            file.write(b'more')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), self.data[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(self.body(response), self.data[-5:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10000-')
+        self.assertEqual(self.body(response), self.data[10000:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+        # A multi-range or stale If-Range request gets the whole file
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"').status_code, 200)
+
+    def test_paths_outside_media_root(self):
+        self.assertEqual(self.client.get(settings.MEDIA_URL + '../manage.py').status_code, 404)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + 'gallery/').status_code, 404)
+
+    @override_settings(MEDIA_SERVE_MODE='x-accel-redirect')
+    def test_offloading_to_nginx(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/gallery/harvest.jpg')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+    def asgi_get(self, path, headers=(), extensions=None):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'headers': list(headers)}
+        if extensions is not None:
+            scope['extensions'] = extensions
+        async_to_sync(media.asgi_serve)(scope, receive, send)
+        return messages
+
+    def test_asgi_ranges(self):
+        messages = self.asgi_get(self.url, [(b'range', b'bytes=100-70000')])
+        self.assertEqual(messages[0]['status'], 206)
+        self.assertIn((b'content-length', str(len(self.data) - 100).encode()), messages[0]['headers'])
+        self.assertEqual(b''.join(message.get('body', b'') for message in messages[1:]), self.data[100:])
+        self.assertFalse(messages[-1].get('more_body'))
+
+    def test_asgi_chunked_fallback(self):
+        # What the Procfile's uvicorn workers run: no zerocopysend extension
+        data = os.urandom(media.CHUNK_SIZE * 2 + 123)
+        default_storage.save('gallery/large.jpg', io.BytesIO(data))
+        messages = self.asgi_get(settings.MEDIA_URL + 'gallery/large.jpg')
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'content-length', str(len(data)).encode()), messages[0]['headers'])
+        bodies = messages[1:]
+        self.assertEqual([len(message['body']) for message in bodies], [media.CHUNK_SIZE, media.CHUNK_SIZE, 123])
+        self.assertEqual([message['more_body'] for message in bodies], [True, True, False])
+        self.assertEqual(b''.join(message['body'] for message in bodies), data)
+
+        messages = self.asgi_get(settings.MEDIA_URL + 'gallery/large.jpg', [(b'range', b'bytes=65530-65545')])
+        self.assertEqual(messages[0]['status'], 206)
+        self.assertEqual(b''.join(message['body'] for message in messages[1:]), data[65530:65546])
+
+    def test_asgi_zero_copy(self):
+        messages = self.asgi_get(self.url, [(b'range', b'bytes=5-9')], {'http.response.zerocopysend': {}})
+        self.assertEqual(messages[1]['type'], 'http.response.zerocopysend')
+        self.assertEqual((messages[1]['offset'], messages[1]['count']), (5, 5))
+
+
+class BundleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_committed_bundles_match_their_sources(self):
+        call_command('build_assets', '--check', stdout=StringIO())
+
+    def test_css_minifier_keeps_strings(self):
+        css = "/* header */\n.logo h1 , a > b {\n    font-family: 'Segoe UI', Tahoma;\n    content: \"a: b /* c */\";\n}\n"
+        self.assertEqual(
+            bundles.minify_css(css),
+            ".logo h1,a>b{font-family:'Segoe UI',Tahoma;content:\"a: b /* c */\"}",
+        )
+
+    def test_js_minifier_keeps_strings_and_line_breaks(self):
+        js = "// Poll\nfunction poll() {\n    /* note */\n    fetch(`/a/${id}/`);   // trailing\n    return 'http://x'\n}\n"
+        self.assertEqual(bundles.minify_js(js), "function poll() {\nfetch(`/a/${id}/`);\nreturn 'http://x'\n}")
+
+    def test_pages_inline_critical_css_and_link_the_rest(self):
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, f"<style>{bundles.inline('critical.css')}</style>")
+        # Inlined, the cover's url() must not be relative to the page
+        self.assertContains(response, "url('/static/images/cover.jpg')")
+        self.assertContains(response, 'bundles/site.css')
+        self.assertContains(response, 'bundles/site.js')
+        self.assertNotContains(response, '.gallery-container{')
+
+    def test_new_bundles_make_cached_pages_stale(self):
+        self.client.get(reverse('gallery'))
+        self.assertEqual(self.client.get(reverse('gallery'))['X-Page-Cache'], 'HIT')
+        etag = self.client.get(reverse('gallery'))['ETag']
+        with mock.patch.object(bundles, 'fingerprint', return_value='deployed'):
+            response = self.client.get(reverse('gallery'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+
+    def test_collectstatic_builds_bundles_first(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with override_settings(STATIC_ROOT=static_root), mock.patch.object(bundles, 'build', wraps=bundles.build) as build:
+            call_command('collectstatic', '--noinput', verbosity=0)
+        build.assert_called_once_with(check=False)
+
+        with open(os.path.join(static_root, 'staticfiles.json')) as file:
+            manifest = json.load(file)['paths']
+        hashed_css = manifest['bundles/critical.css']
+        self.assertRegex(hashed_css, r'^bundles/critical\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(static_root, hashed_css)) as file:
+            self.assertIn(f"url(\"../{manifest['images/cover.jpg']}\")", file.read())
+        suffixes = ['', '.gz', '.br'] if compression.brotli else ['', '.gz']
+        for name in ('bundles/site.css', 'bundles/site.js'):
+            for suffix in suffixes:
+                self.assertTrue(os.path.exists(os.path.join(static_root, manifest[name] + suffix)), manifest[name] + suffix)
+
+
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def through_middleware(self, response, accept='gzip'):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=accept)
+        return middleware.CompressionMiddleware(lambda request: response)(request)
+
+    def test_pages_are_minified_and_gzipped(self):
+        with self.assertLogs('public_site.compression', 'INFO'):
+            response = self.client.get(reverse('announcements'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('compress;dur=', response['Server-Timing'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        html = gzip.decompress(response.content).decode()
+        self.assertIn('<title>PCEA Gatitu Church', html)
+        self.assertNotIn('\n    ', html)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+    @skipUnless(compression.brotli, 'Brotli is not installed')
+    def test_brotli_is_preferred(self):
+        response = self.client.get(reverse('announcements'), HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn(b'PCEA Gatitu Church', compression.brotli.decompress(response.content))
+
+    def test_choose_encoding_honours_accept_encoding(self):
+        self.assertEqual(compression.choose_encoding('br;q=0, gzip'), 'gzip')
+        self.assertEqual(compression.choose_encoding('gzip;q=1, br;q=0.5'), 'gzip')
+        self.assertIsNone(compression.choose_encoding('identity'))
+        self.assertIsNone(compression.choose_encoding(''))
+        with mock.patch.object(compression, 'brotli', None):
+            self.assertEqual(compression.choose_encoding('br, gzip'), 'gzip')
+            self.assertIsNone(compression.choose_encoding('br'))
+
+    def test_small_and_precompressed_bodies_are_left_alone(self):
+        self.assertFalse(self.through_middleware(HttpResponse('x' * 100)).has_header('Content-Encoding'))
+        image = HttpResponse(b'x' * 5000, content_type='image/jpeg')
+        self.assertFalse(self.through_middleware(image).has_header('Content-Encoding'))
+        page = HttpResponse('x' * 5000)
+        self.assertFalse(self.through_middleware(page, accept='identity').has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', page['Vary'])
+
+    def test_streams_are_compressed_chunk_by_chunk(self):
+        response = self.through_middleware(StreamingHttpResponse(iter([b'a' * 1000, b'b' * 1000])))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        chunks = iter(response.streaming_content)
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # Each chunk decodes on arrival; nothing waits for the end of the stream
+        self.assertEqual(decoder.decompress(next(chunks)), b'a' * 1000)
+        with self.assertLogs('public_site.compression', 'INFO') as logs:
+            rest = b''.join(chunks)
+        self.assertEqual(decoder.decompress(rest), b'b' * 1000)
+        self.assertIn('2000 ->', logs.output[0])
+
+    def test_async_streams_are_compressed(self):
+        async def body():
+            for chunk in (b'<p>one</p>' * 100, b'<p>two</p>' * 100):
+                yield chunk
+
+        response = self.through_middleware(StreamingHttpResponse(body()))
+
+        async def consume():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual(gzip.decompress(async_to_sync(consume)()), b'<p>one</p>' * 100 + b'<p>two</p>' * 100)
+
+    def test_minify_keeps_preformatted_content(self):
+        html = '<div>\n    <p>a   b</p>\n</div><pre>  x\n  y</pre><script>\n  // note\n  go()\n</script>'
+        self.assertEqual(
+            compression.minify_html(html),
+            '<div>\n<p>a b</p>\n</div><pre>  x\n  y</pre><script>\n  // note\n  go()\n</script>',
+        )
+
+    @override_settings(PAGE_CACHE_TTL=300)
+    def test_cached_pages_are_compressed_once_per_encoding(self):
+        url = reverse('gallery')
+        with mock.patch.object(compression, 'compress', wraps=compression.compress) as compress:
+            first = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            hits = [self.client.get(url, HTTP_ACCEPT_ENCODING='gzip') for _ in range(3)]
+            plain = self.client.get(url)
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual([response['X-Page-Cache'] for response in hits], ['HIT'] * 3)
+        self.assertEqual(hits[0]['Content-Encoding'], 'gzip')
+        self.assertEqual(hits[0].content, first.content)
+        self.assertFalse(hits[0].has_header('Server-Timing'))
+        # A client that can't decode gzip has its own entry
+        self.assertEqual(plain['X-Page-Cache'], 'MISS')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(gzip.decompress(first.content), plain.content)
+
+    @override_settings(PAGE_CACHE_TTL=300)
+    def test_cached_pages_are_stored_minified(self):
+        self.client.get(reverse('gallery'))
+        entry = cache.get(middleware.page_key('testserver', reverse('gallery')))
+        self.assertIn(b'\n<header>\n<div class="container">\n', entry['content'])
+
+
+class FinancialRollupTests(TestCase):
+    def setUp(self):
+        self.member = make_user('member@example.com')
+
+    def record(self, day, offering='0', donations='0', expenses='0'):
+        record = FinancialRecord.objects.create(
+            offering=Decimal(offering), donations=Decimal(donations), expenses=Decimal(expenses),
+        )
+        # record_date is auto_now_add; moving it is an ordinary edit
+        record.record_date = day
+        record.save()
+        return record
+
+    def totals(self, period, start):
+        rollup = FinancialRollup.objects.get(period=period, start=start)
+        return rollup.offering, rollup.donations, rollup.expenses, rollup.net, rollup.record_count
+
+    def test_saves_and_deletes_keep_rollups_current(self):
+        march = self.record(date(2024, 3, 3), offering='500.50', expenses='100')
+        self.record(date(2024, 3, 24), donations='200')
+        self.record(date(2025, 1, 5), offering='50')
+        self.assertEqual(self.totals('month', date(2024, 3, 1)), (Decimal('500.50'), 200, 100, Decimal('600.50'), 2))
+        self.assertEqual(self.totals('year', date(2024, 1, 1)), (Decimal('500.50'), 200, 100, Decimal('600.50'), 2))
+        self.assertEqual(self.totals('year', date(2025, 1, 1)), (50, 0, 0, 50, 1))
+
+        march.expenses = Decimal('300')
+        march.save()
+        self.assertEqual(self.totals('month', date(2024, 3, 1))[2:], (300, Decimal('400.50'), 2))
+
+        march.record_date = date(2024, 4, 1)
+        march.save()
+        self.assertEqual(self.totals('month', date(2024, 3, 1)), (0, 200, 0, 200, 1))
+        self.assertEqual(self.totals('month', date(2024, 4, 1))[3:], (Decimal('200.50'), 1))
+        self.assertEqual(self.totals('year', date(2024, 1, 1))[3:], (Decimal('400.50'), 2))
+
+        march.delete()
+        self.assertFalse(FinancialRollup.objects.filter(period='month', start=date(2024, 4, 1)).exists())
+        self.assertEqual(self.totals('year', date(2024, 1, 1)), (0, 200, 0, 200, 1))
+
+    def test_reconcile_repairs_bulk_changes(self):
+        record = self.record(date(2024, 3, 3), offering='100')
+        self.record(date(2024, 5, 3), offering='10')
+        # Queryset updates and bulk inserts send no signals
+        FinancialRecord.objects.filter(pk=record.pk).update(offering=Decimal('150'))
+        FinancialRecord.objects.bulk_create([FinancialRecord(offering=Decimal('7'))])
+        FinancialRollup.objects.create(period='month', start=date(2020, 1, 1), record_count=1)
+
+        out = StringIO()
+        call_command('reconcile_financial_rollups', stdout=out)
+        self.assertIn('Fixed', out.getvalue())
+        self.assertEqual(self.totals('month', date(2024, 3, 1))[0], 150)
+        this_month = finance.period_start(timezone.localdate(), 'month')
+        self.assertEqual(self.totals('month', this_month)[0], 7)
+        self.assertFalse(FinancialRollup.objects.filter(start=date(2020, 1, 1)).exists())
+        self.assertEqual(finance.rebuild_rollups(), 0)
+
+    def test_summary_reads_only_rollups(self):
+        for month in range(1, 13):
+            self.record(date(2023, month, 10), offering='100', expenses=str(month))
+        self.record(date(2024, 2, 10), offering='40')
+        self.client.force_login(self.member)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('financial_summary_data'), {'from': '2023-11', 'to': '2024-02'})
+        self.assertFalse(any('public_site_financialrecord' in query['sql'] for query in queries.captured_queries))
+        data = response.json()
+        self.assertEqual([row['start'] for row in data['periods']], ['2023-11-01', '2023-12-01', '2024-02-01'])
+        self.assertEqual(data['periods'][1]['net'], '88.00')
+        self.assertEqual(data['periods'][1]['net_change'], '-1.00')
+        self.assertEqual(data['totals'], {
+            'offering': '240.00', 'donations': '0.00', 'expenses': '23.00', 'net': '217.00', 'record_count': 3,
+        })
+
+        data = self.client.get(reverse('financial_summary_data'), {'period': 'year'}).json()
+        self.assertEqual([(row['start'], row['net']) for row in data['periods']], [('2023-01-01', '1122.00'), ('2024-01-01', '40.00')])
+
+        response = self.client.get(reverse('financial_summary'), {'period': 'year'})
+        self.assertContains(response, 'KSh 1122.00')
+        self.assertContains(response, '-1082.00')
+
+    def test_summary_rejects_bad_ranges(self):
+        self.client.force_login(self.member)
+        response = self.client.get(reverse('financial_summary_data'), {'from': 'March'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('financial_summary_data'), {'period': 'week'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('financial_summary'), {'to': '2024-13'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('financial_summary_data')).status_code, 302)
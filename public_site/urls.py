@@ -4,13 +4,21 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('gallery/', views.gallery, name='gallery'),
+    path('gallery/<str:photo_type>/photos/', views.gallery_photos, name='gallery_photos'),
+    path('gallery/<str:photo_type>/albums/', views.gallery_albums, name='gallery_albums'),
     path('announcements/', views.announcements, name='announcements'),
     path('activities/', views.activities, name='activities'),
     path('blog/', views.blog, name='blog'),
     path('blog/<int:post_id>/comment/', views.add_comment, name='add_comment'),
+    path('blog/<int:post_id>/comments/', views.post_comments, name='post_comments'),
     path('community/', views.community_chat, name='community_chat'),
+    path('community/messages/', views.chat_messages, name='chat_messages'),
     path('community/send/', views.send_message, name='send_message'),
     path('financial/', views.financial_updates, name='financial_updates'),
+    path('financial/summary/', views.financial_summary, name='financial_summary'),
+    path('financial/summary/data/', views.financial_summary_data, name='financial_summary_data'),
+    path('search/', views.search, name='search'),
+    path('cache/stats/', views.fragment_cache_stats, name='fragment_cache_stats'),
     path('notifications/mark-read/<int:notification_id>/', views.mark_notification_read, name='mark_notification_read'),
     path('notifications/mark-all-read/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
     path('notifications/count/', views.notification_count, name='notification_count'),
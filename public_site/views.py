@@ -1,26 +1,26 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from .models import Announcement, Activity, BlogPost, Comment, ChatMessage, Photo, FinancialRecord
-from .models import Notification
+from django.http import Http404, JsonResponse
+from django.utils.functional import SimpleLazyObject
+from .models import Announcement, Activity, BlogPost, Comment, Photo, FinancialRecord
+from . import blog as blog_pages, chat, chat_buffer, finance, fragments, notifications, search as site_search
+from . import gallery as gallery_pages
+from .conditional import conditional_listing
 
 
 @login_required
 def mark_notification_read(request, notification_id):
     """Mark a notification as read"""
-    try:
-        notification = Notification.objects.get(id=notification_id, user=request.user)
-        notification.is_read = True
-        notification.save()
+    if notifications.mark_read(request.user, notification_id):
         return JsonResponse({'success': True})
-    except Notification.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'Notification not found'})
+    return JsonResponse({'success': False, 'error': 'Notification not found'})
 
 @login_required
 def mark_all_notifications_read(request):
     """Mark all notifications as read for the current user"""
     try:
-        Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+        notifications.mark_all_read(request.user)
         return JsonResponse({'success': True})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
@@ -28,15 +28,16 @@ def mark_all_notifications_read(request):
 @login_required
 def notification_count(request):
     """Get unread notification count"""
-    count = Notification.objects.filter(user=request.user, is_read=False).count()
-    return JsonResponse({'count': count})
+    return JsonResponse({'count': notifications.unread_count(request.user)})
 
 def home(request):
-    announcements = Announcement.objects.filter(is_active=True).order_by('-date')[:5]
+    # Everything here is lazy: sections served from the fragment cache
+    # (see home.html) never run their queries
+    announcements = Announcement.objects.filter(is_active=True).select_related('author').order_by('-date')[:5]
     activities = Activity.objects.all().order_by('-date')[:6]
-    latest_financial = FinancialRecord.objects.order_by('-record_date').first()
-    church_photos = Photo.objects.filter(photo_type='church')[:8]
-    trip_photos = Photo.objects.filter(photo_type='trip')[:8]
+    latest_financial = SimpleLazyObject(lambda: FinancialRecord.objects.order_by('-record_date').first())
+    church_photos = Photo.objects.filter(photo_type='church').order_by('-upload_date')[:8]
+    trip_photos = Photo.objects.filter(photo_type='trip').order_by('-upload_date')[:8]
     
     context = {
         'announcements': announcements,
@@ -47,28 +48,76 @@ def home(request):
     }
     return render(request, 'public_site/home.html', context)
 
+@conditional_listing(Photo.objects.all(), 'upload_date', ['photos'])
 def gallery(request):
-    church_photos = Photo.objects.filter(photo_type='church')
-    trip_photos = Photo.objects.filter(photo_type='trip')
+    # The first screen of each section; the rest is fetched on scroll
+    album = request.GET.get('album') or None
+    church = gallery_pages.page('church')
+    trips = gallery_pages.page('trip', album=album)
     
     context = {
-        'church_photos': church_photos,
-        'trip_photos': trip_photos,
+        'church_page': church,
+        'trip_page': trips,
+        'albums': gallery_pages.albums('trip'),
+        'album': album,
     }
     return render(request, 'public_site/gallery.html', context)
 
+def gallery_photos(request, photo_type):
+    """A page of gallery tiles as JSON; page with ?before_id=, narrow with ?album="""
+    if photo_type not in dict(Photo.PHOTO_TYPES):
+        raise Http404('Unknown photo type')
+    try:
+        before_id = _cursor(request.GET.get('before_id'))
+    except ValueError:
+        return JsonResponse({'error': 'before_id must be a photo id'}, status=400)
+    page = gallery_pages.page(photo_type, before_id, request.GET.get('album') or None, request.GET.get('limit'))
+    return JsonResponse({
+        'photos': [gallery_pages.serialize(photo) for photo in page.photos],
+        'next_cursor': page.next_cursor,
+    })
+
+def gallery_albums(request, photo_type):
+    if photo_type not in dict(Photo.PHOTO_TYPES):
+        raise Http404('Unknown photo type')
+    return JsonResponse({'albums': gallery_pages.albums(photo_type)})
+
+@conditional_listing(Announcement.objects.filter(is_active=True), 'date', ['announcements'])
 def announcements(request):
     announcements = Announcement.objects.filter(is_active=True).order_by('-date')
     return render(request, 'public_site/announcements.html', {'announcements': announcements})
 
+@conditional_listing(Activity.objects.all(), 'created_at', ['activities'])
 def activities(request):
     activities = Activity.objects.all().order_by('-date')
     return render(request, 'public_site/activities.html', {'activities': activities})
 
 @login_required
 def blog(request):
-    posts = BlogPost.objects.all().order_by('-date')
-    return render(request, 'public_site/blog.html', {'posts': posts})
+    try:
+        before_id = _cursor(request.GET.get('before_id'))
+    except ValueError:
+        before_id = None
+    page = blog_pages.posts(before_id)
+    return render(request, 'public_site/blog.html', {
+        'posts': page.posts,
+        'next_cursor': page.next_cursor,
+        'is_first_page': before_id is None,
+    })
+
+@login_required
+def post_comments(request, post_id):
+    """A post's comments as JSON; page with ?after_id="""
+    get_object_or_404(BlogPost.objects.only('pk'), pk=post_id)
+    try:
+        after_id = _cursor(request.GET.get('after_id'))
+    except ValueError:
+        return JsonResponse({'error': 'after_id must be a comment id'}, status=400)
+    comments, has_more = blog_pages.comments(post_id, after_id, request.GET.get('limit'))
+    return JsonResponse({
+        'comments': [blog_pages.serialize_comment(comment) for comment in comments],
+        'has_more': has_more,
+    })
 
 @login_required
 def add_comment(request, post_id):
@@ -86,22 +135,99 @@ def add_comment(request, post_id):
 
 @login_required
 def community_chat(request):
-    messages = ChatMessage.objects.all().order_by('timestamp')[:50]
-    return render(request, 'public_site/community_chat.html', {'messages': messages})
+    page = chat.page()
+    return render(request, 'public_site/community_chat.html', {'messages': page.messages, 'has_more': page.has_more})
+
+def _cursor(value):
+    if value in (None, ''):
+        return None
+    if not value.isdigit():
+        raise ValueError(value)
+    return int(value)
+
+@login_required
+def chat_messages(request):
+    """Chat history as JSON; page with ?after_id= or ?before_id="""
+    try:
+        after_id = _cursor(request.GET.get('after_id'))
+        before_id = _cursor(request.GET.get('before_id'))
+    except ValueError:
+        return JsonResponse({'error': 'Cursors must be message ids'}, status=400)
+    if after_id is not None and before_id is not None:
+        return JsonResponse({'error': 'Use either after_id or before_id, not both'}, status=400)
+
+    page = chat.page(after_id, before_id, request.GET.get('limit'))
+    return JsonResponse({
+        'messages': [chat.serialize(message, request.user) for message in page.messages],
+        'has_more': page.has_more,
+    })
 
 @login_required
 def send_message(request):
+    wants_json = 'application/json' in request.headers.get('Accept', '')
     if request.method == 'POST':
-        message_text = request.POST.get('message')
+        message_text = request.POST.get('message', '').strip()[:chat.MAX_MESSAGE_LENGTH]
         
         if message_text:
-            ChatMessage.objects.create(
-                user=request.user,
-                message=message_text
-            )
-        return redirect('community_chat')
+            try:
+                result = chat.post(request.user, message_text)
+            except chat_buffer.BufferFull:
+                response = JsonResponse({'error': 'Chat is busy, please try again'}, status=503)
+                response['Retry-After'] = '1'
+                return response
+            if wants_json and isinstance(result, chat_buffer.Accepted):
+                return JsonResponse({'provisional_id': result.provisional_id}, status=202)
+            if wants_json:
+                return JsonResponse({'message': chat.serialize(result, request.user)}, status=201)
+        elif wants_json:
+            return JsonResponse({'error': 'Message is empty'}, status=400)
+    return redirect('community_chat')
 
 @login_required
+@conditional_listing(FinancialRecord.objects.all(), 'record_date', ['financial'])
 def financial_updates(request):
     financial_records = FinancialRecord.objects.all().order_by('-record_date')[:10]
-    return render(request, 'public_site/financial.html', {'financial_records': financial_records})
\ No newline at end of file
+    return render(request, 'public_site/financial.html', {'financial_records': financial_records})
+
+def _financial_summary(request):
+    """finance.summary() for ?period=month|year&from=&to= (YYYY or YYYY-MM); ValueError on bad input"""
+    bounds = [request.GET.get(name, '').strip() for name in ('from', 'to')]
+    start, end = [finance.parse_bound(bound) if bound else None for bound in bounds]
+    return finance.summary(request.GET.get('period') or 'month', start, end)
+
+@login_required
+def financial_summary(request):
+    """Totals and trend per month or year, read from the rollups only"""
+    context = {'period': request.GET.get('period') or 'month', 'start': request.GET.get('from', ''), 'end': request.GET.get('to', '')}
+    try:
+        context['summary'] = _financial_summary(request)
+    except ValueError as e:
+        context['error'] = str(e)
+        return render(request, 'public_site/financial_summary.html', context, status=400)
+    return render(request, 'public_site/financial_summary.html', context)
+
+@login_required
+def financial_summary_data(request):
+    """The same totals as JSON"""
+    try:
+        summary = _financial_summary(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'period': summary.period,
+        'periods': [
+            {**finance.serialize(rollup), 'net_change': None if change is None else str(change)}
+            for rollup, change in summary.trend
+        ],
+        'totals': finance.serialize_totals(summary.totals),
+    })
+
+def search(request):
+    query = request.GET.get('q', '').strip()[:200]
+    hits = site_search.search(query, request.user, limit=30) if query else []
+    return render(request, 'public_site/search.html', {'query': query, 'hits': hits})
+
+@staff_member_required
+def fragment_cache_stats(request):
+    """Hit and miss counts for the home page fragment cache"""
+    return JsonResponse(fragments.stats())
\ No newline at end of file
@@ -0,0 +1,170 @@
+document.addEventListener('DOMContentLoaded', function() {
+const mobileNavToggle = document.getElementById('mobileNavToggle');
+const mobileNav = document.getElementById('mobileNav');
+mobileNavToggle.addEventListener('click', function() {
+mobileNav.classList.toggle('active');
+const icon = mobileNavToggle.querySelector('i');
+if (mobileNav.classList.contains('active')) {
+icon.classList.remove('fa-bars');
+icon.classList.add('fa-times');
+} else {
+icon.classList.remove('fa-times');
+icon.classList.add('fa-bars');
+}
+});
+document.addEventListener('click', function(event) {
+if (!event.target.closest('.mobile-nav') && !event.target.closest('.mobile-nav-toggle')) {
+mobileNav.classList.remove('active');
+const icon = mobileNavToggle.querySelector('i');
+icon.classList.remove('fa-times');
+icon.classList.add('fa-bars');
+}
+});
+const mobileNavLinks = mobileNav.querySelectorAll('a');
+mobileNavLinks.forEach(link => {
+link.addEventListener('click', function() {
+mobileNav.classList.remove('active');
+const icon = mobileNavToggle.querySelector('i');
+icon.classList.remove('fa-times');
+icon.classList.add('fa-bars');
+});
+});
+updateNotificationCount();
+document.getElementById('notificationBell').addEventListener('click', function(e) {
+e.stopPropagation();
+const dropdown = document.getElementById('notificationDropdown');
+dropdown.style.display = dropdown.style.display === 'block' ? 'none' : 'block';
+});
+document.addEventListener('click', function() {
+document.getElementById('notificationDropdown').style.display = 'none';
+});
+});
+function markNotificationRead(notificationId) {
+fetch(`/notifications/mark-read/${notificationId}/`, {
+method: 'POST',
+headers: {
+'X-CSRFToken': getCookie('csrftoken'),
+'Content-Type': 'application/json',
+},
+})
+.then(response => response.json())
+.then(data => {
+if (data.success) {
+const notificationElement = document.querySelector(`[data-notification-id="${notificationId}"]`);
+if (notificationElement) {
+notificationElement.remove();
+}
+updateNotificationCount();
+const notificationList = document.getElementById('notificationList');
+if (notificationList.children.length === 0) {
+notificationList.innerHTML = `
+                    <div style="padding: 30px; text-align: center; color: #6c757d;">
+                        <i class="fas fa-bell-slash" style="font-size: 2rem; margin-bottom: 10px; display: block; color: #dee2e6;"></i>
+                        <p style="margin: 0;">No new notifications</p>
+                        <small>Notifications will appear here when there's new activity.</small>
+                    </div>
+                `;
+}
+}
+});
+}
+function markAllNotificationsRead() {
+fetch('/notifications/mark-all-read/', {
+method: 'POST',
+headers: {
+'X-CSRFToken': getCookie('csrftoken'),
+'Content-Type': 'application/json',
+},
+})
+.then(response => response.json())
+.then(data => {
+if (data.success) {
+const notificationList = document.getElementById('notificationList');
+notificationList.innerHTML = `
+                <div style="padding: 30px; text-align: center; color: #6c757d;">
+                    <i class="fas fa-bell-slash" style="font-size: 2rem; margin-bottom: 10px; display: block; color: #dee2e6;"></i>
+                    <p style="margin: 0;">No new notifications</p>
+                    <small>Notifications will appear here when there's new activity.</small>
+                </div>
+            `;
+updateNotificationCount();
+}
+});
+}
+function updateNotificationCount() {
+fetch('/notifications/count/')
+.then(response => response.json())
+.then(data => setNotificationCount(data.count));
+}
+function setNotificationCount(count) {
+const countElement = document.getElementById('notificationCount');
+if (!countElement) {
+return;
+}
+if (count > 0) {
+countElement.textContent = count;
+countElement.style.display = 'flex';
+} else {
+countElement.style.display = 'none';
+}
+}
+function prependNotification(notification) {
+const notificationList = document.getElementById('notificationList');
+if (!notificationList || document.querySelector(`[data-notification-id="${notification.id}"]`)) {
+return;
+}
+if (!notificationList.querySelector('.notification-item')) {
+notificationList.innerHTML = '';
+}
+const item = document.createElement('div');
+item.className = 'notification-item';
+item.dataset.notificationId = notification.id;
+item.style.cssText = 'padding: 12px 15px; border-bottom: 1px solid #f8f9fa; cursor: pointer; transition: background-color 0.2s;';
+item.onclick = () => markNotificationRead(notification.id);
+const title = document.createElement('div');
+title.className = 'notification-title';
+title.style.cssText = 'font-weight: 600; color: var(--primary); margin-bottom: 5px;';
+title.textContent = notification.title;
+const message = document.createElement('div');
+message.className = 'notification-message';
+message.style.cssText = 'font-size: 0.9rem; color: #495057; margin-bottom: 5px; line-height: 1.4;';
+message.textContent = notification.message;
+const time = document.createElement('div');
+time.className = 'notification-time';
+time.style.cssText = 'font-size: 0.8rem; color: #6c757d;';
+time.textContent = 'just now';
+item.append(title, message, time);
+notificationList.prepend(item);
+}
+function connectNotificationStream() {
+if (!window.EventSource || !document.getElementById('notificationBell')) {
+return false;
+}
+const source = new EventSource('/notifications/stream/');
+source.addEventListener('unread', event => setNotificationCount(JSON.parse(event.data).count));
+source.addEventListener('notification', event => prependNotification(JSON.parse(event.data)));
+source.onerror = function() {
+if (source.readyState === EventSource.CLOSED && !notificationPoller) {
+notificationPoller = setInterval(updateNotificationCount, 30000);
+}
+};
+return true;
+}
+function getCookie(name) {
+let cookieValue = null;
+if (document.cookie && document.cookie !== '') {
+const cookies = document.cookie.split(';');
+for (let i = 0; i < cookies.length; i++) {
+const cookie = cookies[i].trim();
+if (cookie.substring(0, name.length + 1) === (name + '=')) {
+cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+break;
+}
+}
+}
+return cookieValue;
+}
+let notificationPoller = null;
+if (!connectNotificationStream()) {
+notificationPoller = setInterval(updateNotificationCount, 30000);
+}
@@ -0,0 +1,98 @@
+"""
+Member avatars, normalized on upload.
+
+An uploaded photo is decoded in Pillow's draft mode (JPEGs decode straight
+at a reduced scale), turned upright, cropped to a centred square and saved
+as WebP at each of ``AVATAR_SIZES``. ``CustomUser.avatar`` points at the
+largest copy and ``avatar_variants`` maps every size to its file. Replacing
+an avatar deletes the previous files once the new ones are saved.
+
+``{% avatar_img %}`` and ``{% avatar_url %}`` (templatetags/avatars.py)
+pick the smallest copy that is sharp at the size shown.
+"""
+import io
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+def sizes():
+    return sorted(getattr(settings, 'AVATAR_SIZES', (32, 96, 256)))
+
+
+def render(file):
+    """WebP bytes of ``file`` cropped square, per size"""
+    largest = sizes()[-1]
+    file.seek(0)
+    image = Image.open(file)
+    # Lets JPEG decoding skip detail we would throw away: a 12MP photo
+    # decodes at 1/8 scale when that still covers the largest size
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    side = min(largest, image.width, image.height)
+    square = ImageOps.fit(image, (side, side), Image.LANCZOS)
+
+    rendered = {}
+    for size in sizes():
+        resized = square if size >= side else square.resize((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, 'WEBP', quality=80, method=4)
+        rendered[size] = buffer.getvalue()
+    return rendered
+
+
+def files(avatar, variants):
+    names = set(variants.values())
+    if avatar:
+        names.add(str(avatar))
+    return names
+
+
+def delete_files(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning("Could not delete avatar file %s", name, exc_info=True)
+
+
+def replace(user, file):
+    """
+    Store ``file`` as ``user``'s avatar variants; the caller saves ``user``.
+    The files of the previous avatar are deleted after that save commits.
+    """
+    old = user.__class__.objects.filter(pk=user.pk).values_list('avatar', 'avatar_variants').first()
+    # A fresh name per upload, so browsers never show a cached old face
+    prefix = f'avatars/{uuid.uuid4().hex[:16]}'
+    variants = {
+        str(size): default_storage.save(f'{prefix}-{size}.webp', ContentFile(data))
+        for size, data in render(file).items()
+    }
+    # Assigning a name, not the upload, stops the raw file being saved too
+    user.avatar = variants[str(sizes()[-1])]
+    user.avatar_variants = variants
+    if old is not None:
+        garbage = files(*old) - set(variants.values())
+        transaction.on_commit(lambda: delete_files(garbage))
+
+
+def url(user, size):
+    """The URL of the smallest variant at least ``size`` pixels wide"""
+    if not user.avatar:
+        return ''
+    variants = sorted((int(width), name) for width, name in (user.avatar_variants or {}).items())
+    if not variants:
+        # Uploaded before variants existed
+        return user.avatar.url
+    for width, name in variants:
+        if width >= size:
+            return default_storage.url(name)
+    return default_storage.url(variants[-1][1])
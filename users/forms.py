@@ -1,7 +1,10 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm, PasswordResetForm, SetPasswordForm
 from django.contrib.auth import authenticate
+from django.conf import settings
+from . import avatars
 from .models import CustomUser
+from .tasks import send_password_reset
 
 class CustomUserCreationForm(UserCreationForm):
     first_name = forms.CharField(
@@ -108,7 +111,16 @@ class CustomUserLoginForm(forms.Form):
         return cleaned_data
 
 
-class ProfileUpdateForm(forms.ModelForm):
+class AvatarMixin:
+    """Normalizes a newly uploaded avatar into its fixed-size variants on save"""
+
+    def save_avatar(self, user):
+        avatar = self.cleaned_data.get('avatar')
+        if 'avatar' in self.changed_data and avatar:
+            avatars.replace(user, avatar)
+
+
+class ProfileUpdateForm(AvatarMixin, forms.ModelForm):
     current_password = forms.CharField(
         required=False,
         widget=forms.PasswordInput(attrs={
@@ -210,6 +222,7 @@ class ProfileUpdateForm(forms.ModelForm):
         new_password = self.cleaned_data.get('new_password')
         if new_password:
             user.set_password(new_password)
+        self.save_avatar(user)
         
         if commit:
             user.save()
@@ -242,7 +255,6 @@ class CustomPasswordResetForm(PasswordResetForm):
         Override save method to ensure our custom templates are used
         """
         if not domain_override:
-            from django.conf import settings
             domain_override = settings.SITE_URL.replace('https://', '').replace('http://', '')
             
         super().save(
@@ -257,6 +269,15 @@ class CustomPasswordResetForm(PasswordResetForm):
             extra_email_context=extra_email_context
         )
 
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email, html_email_template_name=None):
+        """
+        Leave rendering and the SMTP round trip to the background worker.
+        Only the member and address are queued; the reset link is built
+        there, so the token is never stored in the job table.
+        """
+        send_password_reset.delay(user_id=context['user'].pk, email=to_email)
+
 class CustomSetPasswordForm(SetPasswordForm):
     new_password1 = forms.CharField(
         widget=forms.PasswordInput(attrs={
@@ -276,7 +297,7 @@ class CustomSetPasswordForm(SetPasswordForm):
     )
 
 
-class AvatarUploadForm(forms.ModelForm):
+class AvatarUploadForm(AvatarMixin, forms.ModelForm):
     class Meta:
         model = CustomUser
         fields = ('avatar',)
@@ -287,6 +308,13 @@ class AvatarUploadForm(forms.ModelForm):
             })
         }
 
+    def save(self, commit=True):
+        user = super().save(commit=False)
+        self.save_avatar(user)
+        if commit:
+            user.save()
+        return user
+
 
 class UserSearchForm(forms.Form):
     search = forms.CharField(
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_customuser_last_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -12,6 +12,8 @@ class CustomUser(AbstractUser):
     ]
     phone = models.CharField(max_length=20, blank=True)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    # Square WebP copies by width, written by users.avatars; avatar is the largest
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     role = models.CharField(max_length=20, default='member', choices=ROLE_CHOICES)
     registration_date = models.DateTimeField(auto_now_add=True)
     
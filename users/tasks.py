@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from jobs.queue import job
+from .models import CustomUser
+
+
+@job('users.send_email')
+def send_email(subject, body, from_email, to_email, html_body=None):
+    message = EmailMultiAlternatives(subject, body, from_email, [to_email])
+    if html_body:
+        message.attach_alternative(html_body, 'text/html')
+    message.send()
+
+
+@job('users.send_password_reset')
+def send_password_reset(user_id, email):
+    """
+    Render and send a password reset email. The token is made here rather
+    than by the form so it never sits in the job table.
+    """
+    user = CustomUser.objects.filter(pk=user_id, email=email, is_active=True).first()
+    if user is None:
+        return  # deactivated or changed address since the request
+    context = {
+        'email': email,
+        'domain': settings.SITE_URL.replace('https://', '').replace('http://', ''),
+        'site_name': 'PCEA Gatitu Church',
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'user': user,
+        'token': default_token_generator.make_token(user),
+        'protocol': 'http' if settings.DEBUG else 'https',
+    }
+    subject = ''.join(loader.render_to_string('users/password_reset_subject.txt', context).splitlines())
+    body = loader.render_to_string('users/password_reset_email.html', context)
+    send_email(subject, body, None, email)
@@ -0,0 +1,28 @@
+from django import template
+from django.utils.html import format_html
+
+from users import avatars
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar_url(user, size):
+    """The URL of ``user``'s avatar variant for a ``size`` pixel box, or ''"""
+    return avatars.url(user, int(size))
+
+
+@register.simple_tag
+def avatar_img(user, size, css_class='', style=''):
+    """
+    ``user``'s avatar as an ``<img>`` for a ``size`` pixel box, with a 2x
+    variant for high-density screens::
+
+        {% avatar_img user 38 style='border-radius: 50%;' %}
+    """
+    size = int(size)
+    return format_html(
+        '<img src="{}" srcset="{} 1x, {} 2x" width="{}" height="{}" alt="{}" class="{}" style="{}" decoding="async">',
+        avatars.url(user, size), avatars.url(user, size), avatars.url(user, size * 2),
+        size, size, user.get_full_name(), css_class, style,
+    )
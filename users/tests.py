@@ -1,3 +1,94 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.core import mail
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from jobs import queue
+from jobs.models import Job
+from .models import CustomUser
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PasswordResetTests(TestCase):
+    def setUp(self):
+        self.member = CustomUser.objects.create_user(username='member@example.com', email='member@example.com', password='pass12345')
+
+    def test_reset_email_is_sent_by_the_worker(self):
+        response = self.client.post(reverse('password_reset'), {'email': 'member@example.com'})
+        self.assertRedirects(response, reverse('password_reset_done'), fetch_redirect_response=False)
+        self.assertEqual(len(mail.outbox), 0)
+
+        job = Job.objects.get(name='users.send_password_reset')
+        self.assertEqual(job.payload, {'user_id': self.member.pk, 'email': 'member@example.com'})
+
+        queue.run(queue.claim('test', 1)[0])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('/users/password-reset-confirm/', mail.outbox[0].body)
+        self.assertEqual(Job.objects.get(pk=job.pk).payload, {})
+
+    @override_settings(JOBS_RUN_EAGERLY=True)
+    def test_reset_email_eager(self):
+        self.client.post(reverse('password_reset'), {'email': 'member@example.com'})
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_unknown_email_is_rejected(self):
+        response = self.client.post(reverse('password_reset'), {'email': 'nobody@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Job.objects.exists())
+
+
+def photo_upload(size=(3000, 2000), orientation=None):
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'olive').save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('me.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class AvatarTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.member = CustomUser.objects.create_user(username='member@example.com', email='member@example.com')
+        self.client.force_login(self.member)
+
+    def upload(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('profile'), {'avatar': photo_upload(**kwargs)})
+        self.member.refresh_from_db()
+
+    def test_upload_is_stored_as_square_webp_variants(self):
+        self.upload(orientation=6)
+        self.assertEqual(set(self.member.avatar_variants), {'32', '96', '256'})
+        for size, name in self.member.avatar_variants.items():
+            with default_storage.open(name) as file:
+                image = Image.open(file)
+                self.assertEqual((image.format, image.size), ('WEBP', (int(size), int(size))))
+        self.assertEqual(self.member.avatar.name, self.member.avatar_variants['256'])
+        # Only the variants are kept, not the multi-megabyte original
+        self.assertEqual(len(default_storage.listdir('avatars')[1]), 3)
+
+    def test_replacing_deletes_the_old_variants(self):
+        self.upload()
+        old = list(self.member.avatar_variants.values())
+        self.upload(size=(500, 800))
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+        self.assertEqual(len(default_storage.listdir('avatars')[1]), 3)
+
+    def test_header_uses_a_small_variant(self):
+        self.upload()
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, self.member.avatar_variants['96'])
+        self.assertNotContains(response, f"src=\"{default_storage.url(self.member.avatar_variants['256'])}\"")
+        # The large profile picture uses the big one
+        self.assertContains(response, f"url('{default_storage.url(self.member.avatar_variants['256'])}')")
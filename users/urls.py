@@ -1,6 +1,7 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from . import views
+from .forms import CustomPasswordResetForm
 
 urlpatterns = [
     path('login/', views.custom_login, name='login'),
@@ -11,6 +12,7 @@ urlpatterns = [
     
     # Password reset with email template
     path('password-reset/', auth_views.PasswordResetView.as_view(
+        form_class=CustomPasswordResetForm,
         template_name='users/password_reset.html',
         email_template_name='users/password_reset_email.html',
         subject_template_name='users/password_reset_subject.txt'